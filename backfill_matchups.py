@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# coding: utf-8
+import logging
+import datetime
+import sys
+import os
+import libs.satellite
+import libs.buoy
+import libs.filterhelper
+import libs.matchup
+import libs.backfill
+import libs.metrics
+
+LOG = logging.getLogger(__name__)
+
+
+
+if __name__ == "__main__":
+    import argparse
+
+    def date(date_string):
+        return datetime.datetime.strptime(date_string, '%Y-%m-%d')
+
+    def directory(path):
+        if not os.path.isdir(path):
+            raise argparse.ArgumentTypeError("'%s' does not exist. Please specify save directory!"%(path))
+        return path
+
+    def file(path):
+        if not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+            raise argparse.ArgumentTypeError("Directory for '%s' does not exist. Please specify a valid path!"%(path))
+        return path
+
+    def predicate(predicate_string):
+        try:
+            return libs.buoy.parse_predicates([predicate_string,])[0]
+        except libs.buoy.BuoyException, e:
+            raise argparse.ArgumentTypeError(e.message)
+
+    def filter(filter_element):
+        start_values = ["s:", "b:", "dummy:"]
+        for start_value in start_values:
+            if filter_element.startswith(start_value):
+                return filter_element
+        raise argparse.ArgumentTypeError("Filter element, '%s', must start with '%s'."%(filter_element, "', '".join(start_values)))
+
+    parser = argparse.ArgumentParser(description='Compare the satellite data with the buoy data for many satellite files, e.g. to reprocess years of data. The matchups of each buoy for each satellite file (a unit) are written to their own file, <output dir>/<buoy>/<date>.asc, and the units done are kept in a ledger in the output dir. When the job is run again, e.g. after it was stopped, the units done are skipped. A satellite file that fails is quarantined, with the error, and the job goes on with the next file.')
+
+    parser.add_argument('--data-dir-sat', type=directory, help='Specify the directory where the satellite data files can be found.', default=os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "sat"))
+    parser.add_argument('--data-dir-buoy', type=directory, help='Specify the directory where the buoy data files can be found. %s'%(libs.buoy.DECOMPRESSED_HELP), default=os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "buoy"))
+    parser.add_argument('--buoy-registry', type=file, help="Save what is known about the buoys (headers, first and last dates) in this file, and read it from here the next time.")
+    parser.add_argument('-b', '--buoy', type=str, action="append", help="Only this buoy. Can be given more than once. All the buoys if not given.")
+    parser.add_argument('--output-dir', type=file, required=True, help="The directory of the output, the ledger (%s) and the quarantine (%s). It is created if it does not exist."%(libs.backfill.LEDGER_FILENAME, libs.backfill.QUARANTINE_FILENAME))
+
+    parser.add_argument('-f', '--filter', type=filter, nargs="+", required=True, help="""The values written for each matchup. Example: 's:lat b:WT:2 s:lon b:date:julian'. 's' is the satellite prefix and 'b' is the buoy prefix. See compare_sat_with_bouy.py.""")
+    parser.add_argument('-w', '--where', type=predicate, action="append", help="Only use the buoy data where the values fulfil this predicate, e.g. 'WT:3 not missing' or '0 < WT:3 < 30'. See compare_sat_with_bouy.py.")
+
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--date', type=date, help='Only the satellite files from (including) this date. All the files if no dates are given.')
+    group.add_argument('--date-from', type=date, help='Only the satellite files from (including) this date.')
+
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--date-to', type=date, help='Only the satellite files untill (exclusive) this date.')
+    group.add_argument('--days-forward-in-time', type=int, help='Only the satellite files from --date or --date-from and this number of days forward in time.')
+
+    parser.add_argument('--retry-quarantined', action='store_true', help="Try the quarantined satellite files again. A file is taken out of the quarantine when all its units are done.")
+    parser.add_argument('--print-quarantined', action='store_true', help="Print the quarantined satellite files, with their errors, and exit.")
+    parser.add_argument('--variable-cache-size', type=int, default=libs.satellite.DEFAULT_VARIABLE_CACHE_SIZE//(1024*1024), help="Keep at most this number of megabytes of the variables read from each satellite file, so each variable is only read once. Default: %i."%(libs.satellite.DEFAULT_VARIABLE_CACHE_SIZE//(1024*1024)))
+    parser.add_argument('--subset-dir', type=directory, help="Read the satellite values from the subsets of the satellite files in this directory (see subset_satellite.py), when they have them.")
+    parser.add_argument('--metrics-filename', type=file, help="Write the metrics of the run to this file, in the Prometheus text format. See compare_sat_with_bouy.py.")
+
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('-d', '--debug', action='store_true', help="Output debugging information.")
+    group.add_argument('-v', '--verbose', action='store_true', help="Output info.")
+
+    parser.add_argument('--log-filename', type=str, help="File used to output logging information.")
+
+    # Do the parsing.
+    args = parser.parse_args()
+
+    # Set the log options.
+    if args.debug:
+        logging.basicConfig(filename=args.log_filename, level=logging.DEBUG)
+    elif args.verbose:
+        logging.basicConfig(filename=args.log_filename, level=logging.INFO)
+    else:
+        logging.basicConfig(filename=args.log_filename, level=logging.WARNING)
+
+    # Output what is in the args variable.
+    LOG.debug(args)
+
+    ledger = libs.backfill.Ledger(args.output_dir)
+
+    if args.print_quarantined:
+        for sat_file in sorted(ledger.quarantined):
+            entry = ledger.quarantined[sat_file]
+            print "%s%s: %s"%(sat_file, " (%s)"%(entry["buoy"]) if entry["buoy"] != None else "", entry["error"])
+        sys.exit()
+
+    # The metrics of the run, written to --metrics-filename when the run ends.
+    metrics = libs.metrics.Metrics()
+    success = False
+
+    try:
+        registry = libs.buoy.get_registry(args.data_dir_buoy, args.buoy_registry)
+        buoy_names = registry.get_buoy_names()
+        if args.buoy != None:
+            for buoy_name in args.buoy:
+                if buoy_name not in buoy_names:
+                    raise argparse.ArgumentTypeError("'%s' can not be found. Please specify another buoy data dir (current: '%s') with --data-dir-buoy, or select one of the buoy names: '%s'!"%(buoy_name, args.data_dir_buoy, "', '".join(buoy_names)))
+            buoy_names = args.buoy
+        buoy_names = sorted(buoy_names)
+
+        # Make sure the buoy variables are there, before the job is started.
+        for buoy_name in buoy_names:
+            with registry.get(buoy_name) as b:
+                for f in args.filter:
+                    if f.startswith("b:"):
+                        dummy, buoy_filter = f.split(":", 1)
+                        if buoy_filter.startswith("date:"):
+                            buoy_filter = "date:"
+                        if buoy_filter != "lat" and buoy_filter != "lon" and not b.has_variables(buoy_filter):
+                            raise argparse.ArgumentTypeError("'%s' cannot be found for buoy '%s' ('%s'). Must be one of '%s'."%(buoy_filter, b.name, b.short_name, "', '".join(b.get_header_strings())))
+                for p in args.where or []:
+                    if p.column.split(":")[0] in ("date", "lat", "lon") or not b.has_variables(p.column):
+                        raise argparse.ArgumentTypeError("The column '%s' in the predicate '%s' cannot be found for buoy '%s' ('%s'). Must be one of '%s'."%(p.column, p, b.name, b.short_name, "', '".join(b.get_header_strings())))
+
+        # The units done were made with these options, so they must be the same when the job is restarted.
+        ledger.check_job({"filter": args.filter, "where": [str(p) for p in args.where or []]})
+
+        # All the files, if no dates are given.
+        date_from = args.date_from or args.date or datetime.datetime(1981, 1, 1)
+        if args.days_forward_in_time:
+            date_to = date_from + datetime.timedelta(days = args.days_forward_in_time)
+        elif args.date_to:
+            date_to = args.date_to
+        elif args.date_from or args.date:
+            date_to = date_from + datetime.timedelta(days = 1)
+        else:
+            date_to = datetime.datetime.now() + datetime.timedelta(days = 1)
+        sat_input_filenames = sorted(libs.satellite.get_files_from_datadir(args.data_dir_sat, date_from, date_to))
+        LOG.info("%i satellite files, %i buoys."%(len(sat_input_filenames), len(buoy_names)))
+
+        sat_variable_names = libs.matchup.get_satellite_variable_names(args.filter)
+        number_of_units_done = 0
+        number_of_files_quarantined = 0
+
+        for sat_input_filename in sat_input_filenames:
+            if ledger.is_quarantined(sat_input_filename) and not args.retry_quarantined:
+                LOG.info("Skipping '%s', which is quarantined."%(sat_input_filename))
+                continue
+
+            # The units of the file that are not done yet. Only the buoys with data for the file have units.
+            satellite_date = libs.satellite.get_date_from_filename(sat_input_filename)
+            date_from_including = satellite_date - libs.matchup.DEFAULT_WINDOW
+            date_to_excluding = satellite_date + libs.matchup.DEFAULT_WINDOW
+            unit_buoy_names = [buoy_name for buoy_name in buoy_names
+                               if registry.get_element(buoy_name).covers(date_from_including, date_to_excluding)
+                               and not ledger.is_done(sat_input_filename, buoy_name)]
+            if len(unit_buoy_names) == 0:
+                LOG.debug("All the units of '%s' are done."%(sat_input_filename))
+                ledger.release(sat_input_filename)
+                continue
+
+            # A failing unit quarantines the file, but the other units of the file are done.
+            # A file that can not be read quarantines all its units.
+            quarantined = False
+            buoy_name = None
+            try:
+                with metrics.time("stage_duration_seconds", stage="open_satellite"):
+                    sat = libs.satellite.Satellite(sat_input_filename, args.variable_cache_size*1024*1024, args.subset_dir)
+                with sat:
+                    if not sat.has_variables(sat_variable_names):
+                        raise libs.satellite.SatDataException("'%s' does not have the variables '%s'."%(sat_input_filename, "', '".join(sat_variable_names)))
+
+                    for buoy_name in unit_buoy_names:
+                        try:
+                            with registry.get(buoy_name) as b:
+                                with metrics.time("stage_duration_seconds", stage="satellite_data"):
+                                    sat_data = sat.data(b.lat, b.lon)
+                                with metrics.time("stage_duration_seconds", stage="buoy_read"):
+                                    buoy_series = libs.matchup.aggregate_series(args.filter, b.series(date_from_including, date_to_excluding, args.where), satellite_date)
+                                metrics.inc_once("buoy_file_bytes_total", os.path.getsize(b.data_file), buoy=buoy_name)
+
+                            # The output of the unit is written at once, and then the unit is done.
+                            with metrics.time("stage_duration_seconds", stage="write"):
+                                output = ""
+                                if len(buoy_series) > 0:
+                                    output = libs.filterhelper.format_block(libs.matchup.get_columns(args.filter, sat_data, buoy_series)) + "\n"
+                                unit_filename = libs.backfill.get_unit_filename(args.output_dir, buoy_name, satellite_date)
+                                libs.backfill.write_atomically(unit_filename, output)
+                            ledger.mark_done(sat_input_filename, buoy_name, len(buoy_series), unit_filename)
+                            metrics.inc("rows_written_total", len(buoy_series), buoy=buoy_name)
+                            number_of_units_done += 1
+                        except Exception, e:
+                            LOG.error("Quarantining '%s', which failed for buoy '%s': %s"%(sat_input_filename, buoy_name, e))
+                            ledger.quarantine(sat_input_filename, e, buoy_name)
+                            quarantined = True
+                    buoy_name = None
+
+                    metrics.inc("bytes_read_total", sat.bytes_read, dataset="satellite")
+                    metrics.add_cache_statistics("satellite_variables", sat.get_variable_statistics())
+            except Exception, e:
+                LOG.error("Quarantining '%s': %s"%(sat_input_filename, e))
+                ledger.quarantine(sat_input_filename, e, buoy_name)
+                quarantined = True
+
+            metrics.inc("satellite_files_processed_total")
+            if quarantined:
+                number_of_files_quarantined += 1
+                metrics.inc("satellite_files_quarantined_total")
+            else:
+                ledger.release(sat_input_filename)
+
+        LOG.info("%i units done, %i files quarantined in this run. %i files are quarantined in all."%(number_of_units_done, number_of_files_quarantined, len(ledger.quarantined)))
+        if len(ledger.quarantined) > 0:
+            print "%i satellite files are quarantined. See --print-quarantined, or '%s'."%(len(ledger.quarantined), ledger.quarantine_filename)
+
+        # The elements of the buoy registry made in this run are saved once, at the end.
+        registry.save()
+        success = True
+
+    # If something went wrong.
+    except (argparse.ArgumentTypeError, libs.backfill.BackfillException), e:
+        print("")
+        print("Error: %s"%(e.message))
+        sys.exit(1)
+
+    # The metrics are written also if the run fails, so the failure can be seen.
+    finally:
+        if args.metrics_filename:
+            metrics.finish(success)
+            metrics.write(args.metrics_filename)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# coding: utf-8
+import logging
+import datetime
+import subprocess
+import time
+import sys
+import os
+import libs.buoy
+import libs.satellite
+
+# Define the logger
+LOG = logging.getLogger(__name__)
+
+# The directory with the scripts.
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def get_cases(data_dir_sat, data_dir_buoy):
+    """
+    The invocations to time, as (script, arguments). The metadata-only invocations
+    (e.g. --print-buoy-names) come first, then the ones that read the data files.
+    """
+    data_dir_sat = os.path.abspath(data_dir_sat)
+    data_dir_buoy = os.path.abspath(data_dir_buoy)
+    buoy_names = sorted(libs.buoy.get_registry(data_dir_buoy).get_buoy_names())
+    sat_filenames = sorted(libs.satellite.get_files_from_datadir(data_dir_sat, datetime.datetime(1981, 1, 1), datetime.datetime.now() + datetime.timedelta(days=1)))
+
+    cases = [("print_last_dates.py", ["7"]),
+             ("print_buoy_data.py", ["--data-dir", data_dir_buoy, "--print-buoy-names"]),
+             ("print_sat_data.py", ["--data-dir", data_dir_sat, "--print-dates"]),
+             ("compare_sat_with_bouy.py", ["--data-dir-sat", data_dir_sat, "--data-dir-buoy", data_dir_buoy, "--print-buoy-names"])]
+    for script in ["print_last_dates.py", "print_buoy_data.py", "print_sat_data.py", "compare_sat_with_bouy.py",
+                   "print_statistics.py", "print_availability.py", "ingest_pixels.py", "query_service.py", "query_client.py"]:
+        cases.append((script, ["--help"]))
+
+    if len(buoy_names) > 0:
+        cases.append(("print_buoy_data.py", ["--data-dir", data_dir_buoy, "-b", buoy_names[0], "--print-header"]))
+        cases.append(("print_buoy_data.py", ["--data-dir", data_dir_buoy, "-b", buoy_names[0]]))
+    else:
+        LOG.warning("No buoys in '%s'. The buoy data is not timed."%(data_dir_buoy))
+    if len(sat_filenames) > 0:
+        cases.append(("print_sat_data.py", ["--data-dir", data_dir_sat, "--input-filename", sat_filenames[0], "--print-variables"]))
+    else:
+        LOG.warning("No satellite files in '%s'. The satellite data is not timed."%(data_dir_sat))
+    return cases
+
+def time_invocation(python, script, arguments):
+    """
+    Runs the script and returns the seconds until the first output (on stdout) and
+    until it has finished. The first output is None if it did not output anything.
+    The script is run from its directory, as the default data dirs are relative to it.
+    """
+    start = time.time()
+    process = subprocess.Popen([python, script] + arguments, cwd=SCRIPT_DIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    first_output = None
+    if process.stdout.read(1) != "":
+        first_output = time.time() - start
+    process.stdout.read()
+    process.stderr.read()
+    process.wait()
+    total = time.time() - start
+    if process.returncode != 0:
+        LOG.warning("'%s %s' returned %i."%(script, " ".join(arguments), process.returncode))
+    return first_output, total
+
+def median(values):
+    values = sorted(values)
+    middle = len(values)//2
+    if len(values) % 2 == 1:
+        return values[middle]
+    return (values[middle - 1] + values[middle])/2.0
+
+def format_ms(seconds):
+    if seconds == None:
+        return "-"
+    return "%.0f"%(seconds*1000)
+
+def benchmark(python, cases, repeat):
+    """
+    Times each case repeat times, and prints the minimum and the median in milliseconds.
+    """
+    print "%-26s %9s %9s %9s %9s  %s"%("script", "first min", "first med", "total min", "total med", "arguments")
+    for script, arguments in cases:
+        timings = [time_invocation(python, script, arguments) for i in range(repeat)]
+        first_outputs = [first_output for first_output, total in timings if first_output != None]
+        totals = [total for first_output, total in timings]
+        print "%-26s %9s %9s %9s %9s  %s"%(script,
+                                           format_ms(min(first_outputs) if len(first_outputs) > 0 else None),
+                                           format_ms(median(first_outputs) if len(first_outputs) > 0 else None),
+                                           format_ms(min(totals)), format_ms(median(totals)),
+                                           " ".join(arguments))
+        sys.stdout.flush()
+
+
+
+if __name__ == "__main__":
+    import argparse
+
+    def directory(path):
+        if not os.path.isdir(path):
+            raise argparse.ArgumentTypeError("'%s' does not exist. Please specify save directory!"%(path))
+        return path
+
+    def positive(value):
+        value = int(value)
+        if value < 1:
+            raise argparse.ArgumentTypeError("'%s' must be at least 1."%(value))
+        return value
+
+    parser = argparse.ArgumentParser(description='Time the start-up of the scripts: The milliseconds until the first output, and until they have finished, for each option that only prints metadata (e.g. --print-buoy-names, --help), and for a few that read the data files.')
+    parser.add_argument('--data-dir-sat', type=directory, help='Specify the directory where the satellite data files can be found.', default=os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "sat"))
+    parser.add_argument('--data-dir-buoy', type=directory, help='Specify the directory where the buoy data files can be found. %s'%(libs.buoy.DECOMPRESSED_HELP), default=os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "buoy"))
+    parser.add_argument('--python', type=str, default=sys.executable, help="The python used to run the scripts. Default: %s."%(sys.executable))
+    parser.add_argument('--repeat', type=positive, default=5, help="Run each script this number of times. Default: 5.")
+
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('-d', '--debug', action='store_true', help="Output debugging information.")
+    group.add_argument('-v', '--verbose', action='store_true', help="Output info.")
+
+    parser.add_argument('--log-filename', type=str, help="File used to output logging information.")
+
+    # Do the parsing.
+    args = parser.parse_args()
+
+    # Set the log options.
+    if args.debug:
+        logging.basicConfig(filename=args.log_filename, level=logging.DEBUG)
+    elif args.verbose:
+        logging.basicConfig(filename=args.log_filename, level=logging.INFO)
+    else:
+        logging.basicConfig(filename=args.log_filename, level=logging.WARNING)
+
+    # Output what is in the args variable.
+    LOG.debug(args)
+
+    benchmark(args.python, get_cases(args.data_dir_sat, args.data_dir_buoy), args.repeat)
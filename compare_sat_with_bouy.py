@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 # coding: utf-8
 import logging
+import collections
 import datetime
 import sys
 import os
@@ -8,6 +9,10 @@ import libs.satellite
 import libs.buoy
 import libs.datetimehelper
 import libs.filterhelper
+import libs.matchup
+import libs.validationstatistics
+import libs.pixelstore
+import libs.metrics
 
 LOG = logging.getLogger(__name__)
 
@@ -46,6 +51,12 @@ if __name__ == "__main__":
             raise argparse.ArgumentTypeError("File '%s' does not exist. Please specify a valid input file!"%(path))
         return path
 
+    def predicate(predicate_string):
+        try:
+            return libs.buoy.parse_predicates([predicate_string,])[0]
+        except libs.buoy.BuoyException, e:
+            raise argparse.ArgumentTypeError(e.message)
+
     def filter(filter_element):
         start_values = ["s:", "b:", "dummy:"]
         for start_value in start_values:
@@ -56,14 +67,17 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Compare the satellite data with the buoy data. For each file of satellite data, the specified buoy data is found. Each line in the buoy data is compared with the satellite.')
 
     parser.add_argument('--data-dir-sat', type=directory, help='Specify the directory where the satellite data files can be found.', default=os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "sat"))
-    parser.add_argument('--data-dir-buoy', type=directory, help='Specify the directory where the buoy data files can be found.', default=os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "buoy"))
+    parser.add_argument('--data-dir-buoy', type=directory, help='Specify the directory where the buoy data files can be found. %s'%(libs.buoy.DECOMPRESSED_HELP), default=os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "buoy"))
 
+    parser.add_argument('--buoy-registry', type=file, help="Save what is known about the buoys (headers, first and last dates) in this file, and read it from here the next time.")
     parser.add_argument('--print-buoy-names', action='store_true', help="Print available buoy snort names to use with --buoy.")
     parser.add_argument('-b', '--buoy', type=str, help="Buoy short name. Can be found by calling script with option --print-buoy-names. This is actually a required option, even though an option should be optional, by definition.")
 
 
     parser.add_argument('--print-header', action='store_true', help="Print the header when writing the output.")
-    parser.add_argument('-f', '--filter', type=filter, action="append", nargs="*", help="""Only return a string with some of the values. Example: 's:lat b:WT:2 s:lon b:date:'. 's' is the satellite prefix and 'b' is the buoy prefix. 2 values for each satellite filter element, and 3 values for each buoy filter element.""")
+    parser.add_argument('-f', '--filter', type=filter, action="append", nargs="*", help="""Only return a string with some of the values. Example: 's:lat b:WT:2 s:lon b:date:'. 's' is the satellite prefix and 'b' is the buoy prefix. 2 values for each satellite filter element, and 3 values for each buoy filter element. A buoy value can be aggregated over the window of the satellite file with 'mean', 'median', 'count', 'min', 'max' or 'nearest' (to the satellite date), optionally only for some UTC hours of the day, e.g. 'b:WT:3:mean' or 'b:WT:3:mean:18-06' (night-time). If all the buoy values are aggregated (or are the date, lat or lon), there is one row for each satellite file, with the buoy date nearest to the satellite date.""")
+
+    parser.add_argument('-w', '--where', type=predicate, action="append", help="Only use the buoy data where the values fulfil this predicate, e.g. 'WT:3 not missing' or '0 < WT:3 < 30'. The operators are <, <=, >, >=, == and !=. The missing values (%s) never fulfil a comparison. Can be given more than once."%(libs.buoy.DEFAULT_MISSING_VALUE))
 
     group = parser.add_mutually_exclusive_group()
     group.add_argument('-d', '--debug', action='store_true', help="Output debugging information.")
@@ -85,7 +99,22 @@ if __name__ == "__main__":
 
     parser.add_argument('-o', '--output-filename', type=file, help="Output filename. If not given, a filename will be created.")
     parser.add_argument('--overwrite', action='store_true', help="Overwrite existing files.")
-
+    parser.add_argument('--chunk-size', type=int, help="Read the buoy data this number of lines at a time, to use less memory for large buoy data files.")
+    parser.add_argument('--merge-join', action='store_true', help="Read each buoy data file once for all the satellite files, and assign the rows to the satellite dates in one pass, in place of reading the buoy data again for each satellite file. The rows of the buoy data file must be in time order. Requires --filter.")
+    parser.add_argument('--prefetch', type=int, default=0, help="Open this number of satellite files in the background, while the current file is processed. Default: 0, the files are opened one by one.")
+    parser.add_argument('--variable-cache-size', type=int, default=libs.satellite.DEFAULT_VARIABLE_CACHE_SIZE//(1024*1024), help="Keep at most this number of megabytes of the variables read from each satellite file, so each variable is only read once. Default: %i."%(libs.satellite.DEFAULT_VARIABLE_CACHE_SIZE//(1024*1024)))
+    parser.add_argument('--subset-dir', type=directory, help="Read the satellite values from the subsets of the satellite files in this directory (see subset_satellite.py), when they have them. The files without a subset are read as usual.")
+    parser.add_argument('--nearest-sea-pixel', type=float, metavar="KM", help="When the closest satellite pixel to a buoy is land, take the satellite values from the nearest sea pixel within this distance (km). The satellite variables '%s' are then the position of the pixel used and its distance from the buoy (masked if there is no sea pixel within the distance)."%("', '".join(libs.satellite.VALID_PIXEL_VARIABLES)))
+    parser.add_argument('--nearest-sea-pixel-map-dir', type=file, help="Save the maps of the nearest sea pixels (one for each grid) in this directory, and read them from here the next time. See --nearest-sea-pixel.")
+    parser.add_argument('--pixel-store', type=directory, help="Use the satellite values in the pixel store (see ingest_pixels.py) in place of the satellite files. The netCDF files are not opened. Only the satellite variables in the store can be used: '%s'."%("', '".join(["lat", "lon", "time"] + libs.pixelstore.VARIABLES)))
+    parser.add_argument('--metrics-filename', type=file, help="Write the metrics of the run (rows written per buoy, files processed, bytes read, the time spent in each stage, cache hit ratios) to this file, in the Prometheus text format, e.g. for the textfile collector of the node exporter (the filename must end with '.prom'). The file is replaced when the run ends, also if it fails.")
+    parser.add_argument('--output-format', choices=libs.matchup.OUTPUT_FORMATS, default="asc", help="The format of the output. 'asc' (default) writes the values as text, line by line. 'npz' writes a numpy .npz file with one typed column per filter element, in bulk when all the data has been read. 'sqlite' inserts (or updates) the matchups into the 'matchups' table in a SQLite database, which may exist already. 'npz' and 'sqlite' requires --output-filename and --filter.")
+
+
+    parser.add_argument('--statistics', type=filter, nargs=2, metavar=("SAT", "BUOY"), help="Calculate the statistics (bias, std, rmse) for the satellite value minus the buoy value, while the matchups are written. Example: '--statistics s:analysed_sst b:WT:3'.")
+    parser.add_argument('--statistics-groups', nargs="*", choices=libs.validationstatistics.GROUPS, default=libs.validationstatistics.DEFAULT_GROUPS, help="The statistics are calculated for each of these groups. Default: '%s'."%("', '".join(libs.validationstatistics.DEFAULT_GROUPS)))
+    parser.add_argument('--statistics-state', type=file, help="The statistics are saved to this file, to be merged with other runs. If the file exists, the statistics from the file are merged with the statistics from this run.")
+    parser.add_argument('--statistics-summary', type=file, help="Write the summary of the statistics to this file. If not given, the summary is printed after the matchups.")
      
     # Do the parsing.
     args = parser.parse_args()
@@ -106,7 +135,9 @@ if __name__ == "__main__":
         print ", ".join(libs.buoy.get_buoy_names(args.data_dir_buoy))
         sys.exit()
 
-    buoy_names = libs.buoy.get_buoy_names(args.data_dir_buoy)
+    # The buoys are found once, and reused for all the satellite files.
+    registry = libs.buoy.get_registry(args.data_dir_buoy, args.buoy_registry)
+    buoy_names = registry.get_buoy_names()
     if args.buoy != None:
         if args.buoy not in buoy_names:
             raise argparse.ArgumentTypeError("'%s' can not be found. Please specify another buoy data dir (current: '%s') with --data-dir-buoy, or select one of the buoy names: '%s'!"%(args.buoy, args.data_dir_buoy, "', '".join(buoy_names)))
@@ -114,8 +145,19 @@ if __name__ == "__main__":
     else:
         raise argparse.ArgumentTypeError("Please specify buoy name. Available buoy names for '%s' are: '%s'"%(args.data_dir_buoy, "', '".join(buoy_names)))
 
+    # The satellite values are taken from the pixel store, for the dates in the store.
+    pixel_store = None
+    if args.pixel_store:
+        try:
+            pixel_store = libs.pixelstore.PixelStore(args.pixel_store)
+        except libs.pixelstore.PixelStoreException, e:
+            print "Error: %s"%(e.message)
+            sys.exit(1)
+
     if args.sat_input_filename:
         sat_input_filenames = [args.sat_input_filename,]
+        if pixel_store != None:
+            satellite_dates = [libs.satellite.get_date_from_filename(args.sat_input_filename),]
     else:
         # Date is allways set to the date to start from.
         if args.date_from:
@@ -131,9 +173,22 @@ if __name__ == "__main__":
             # Date is set to five days back in time.
             args.date_to = args.date + datetime.timedelta(days = 1)
 
-        sat_input_filenames = list(libs.satellite.get_files_from_datadir(args.data_dir_sat, args.date, args.date_to))
+        if pixel_store != None:
+            satellite_dates = set()
+            for buoy_name in buoy_names:
+                satellite_dates.update(pixel_store.get_dates(buoy_name, min(args.date, args.date_to), max(args.date, args.date_to)))
+            satellite_dates = sorted(satellite_dates)
+        else:
+            sat_input_filenames = list(libs.satellite.get_files_from_datadir(args.data_dir_sat, args.date, args.date_to))
 
-    if len(sat_input_filenames) == 0:
+    if pixel_store != None and len(satellite_dates) == 0:
+        print "No satellite values in the pixel store. Please specify another date (--date) or date range (--date-from/--date-to), or run ingest_pixels.py."
+        print "Use --help for details."
+        print ""
+        print "Pixel store: '%s'."%(os.path.abspath(args.pixel_store))
+        sys.exit(1)
+
+    if pixel_store == None and len(sat_input_filenames) == 0:
         print "No satellite files to get data from. Please specify another date (--date) or date range (--date-from/--date-to)."
         print "Use --help for details."
         print ""
@@ -142,18 +197,74 @@ if __name__ == "__main__":
 
     LOG.debug("Date from: %s. Date to: %s."%(args.date, args.date_to))
 
+    # The metrics of the run, written to --metrics-filename when the run ends.
+    metrics = libs.metrics.Metrics()
+    success = False
 
     try:
+        # The statistics, satellite minus buoy.
+        statistics = None
+        if args.statistics != None:
+            if not args.statistics[0].startswith("s:") or not args.statistics[1].startswith("b:"):
+                raise argparse.ArgumentTypeError("The statistics must be given as a satellite and a buoy filter element, e.g. '--statistics s:analysed_sst b:WT:3', not '%s'."%(" ".join(args.statistics)))
+            statistics_sat_filter = args.statistics[0].split(":", 1)[1]
+            statistics_buoy_filter = args.statistics[1].split(":", 1)[1]
+            statistics_depth = libs.matchup.get_depth([args.statistics[1],])
+
+            statistics = libs.validationstatistics.GroupedStatistics(args.statistics_groups)
+            if args.statistics_state and os.path.isfile(args.statistics_state):
+                statistics.merge(libs.validationstatistics.GroupedStatistics.load(args.statistics_state))
+
+        # The binary output is written to a file, and the columns are given by the filter.
+        if args.output_format != "asc":
+            if not args.output_filename:
+                raise argparse.ArgumentTypeError("Output format '%s' requires an output filename (--output-filename)."%(args.output_format))
+            if args.filter == None:
+                raise argparse.ArgumentTypeError("Output format '%s' requires a filter (--filter)."%(args.output_format))
+        if args.merge_join and args.filter == None:
+            raise argparse.ArgumentTypeError("--merge-join requires a filter (--filter).")
+        if args.nearest_sea_pixel != None and pixel_store != None:
+            raise argparse.ArgumentTypeError("--nearest-sea-pixel can not be used with --pixel-store, which has the values of the closest pixels only.")
+        if args.filter == None and pixel_store != None and len(pixel_store.get_missing_variable_names()) > 0:
+            raise argparse.ArgumentTypeError("The pixel store does not have the satellite variables '%s', so the values can only be written with a filter (--filter)."%("', '".join(pixel_store.get_missing_variable_names())))
+
         # Make sure the output file does not exist, or deleted if specified.
         if args.output_filename and os.path.isfile(args.output_filename):
             if args.overwrite:
                 os.remove(args.output_filename)
+            elif args.output_format == "sqlite":
+                # The matchups are inserted into the existing SQLite database.
+                pass
             else:
                 raise argparse.ArgumentTypeError("File '%s' may not exist. Please delete first, or use option --overwrite!"%(args.output_filename))
 
+        # The writer for the binary output (None for text). Everything is written when the writer is closed.
+        writer = libs.matchup.get_writer(args.output_format, args.output_filename, args.filter[0] if args.filter != None else None, args.buoy)
+
+        # The satellite variables that are needed. All of them if there are no filter.
+        sat_variable_names = None
+        if args.filter != None:
+            sat_variable_names = libs.matchup.get_satellite_variable_names(args.filter[0] + (args.statistics if statistics != None else []))
+
         # Get the data.
-        for sat_input_filename in sat_input_filenames:
-            with libs.satellite.Satellite(sat_input_filename) as sat:
+        # The next files are opened in the background (--prefetch), while the current one is processed.
+        # With the pixel store, there are no files to open.
+        if pixel_store != None:
+            satellites = pixel_store.satellites(satellite_dates)
+        else:
+            satellite_dates = [libs.satellite.get_date_from_filename(sat_input_filename) for sat_input_filename in sat_input_filenames]
+            satellites = libs.satellite.prefetch(sat_input_filenames, args.prefetch, sat_variable_names, args.variable_cache_size*1024*1024, args.subset_dir,
+                                                 args.nearest_sea_pixel, args.nearest_sea_pixel_map_dir)
+
+        # The buoy series for each satellite date, by buoy name. See --merge-join.
+        # The series for a date are removed when the last file for the date has been processed.
+        joined_series = {}
+        remaining_dates = collections.Counter(satellite_dates)
+
+        # The time spent waiting for each file to be opened.
+        for sat in metrics.time_iteration(satellites, "stage_duration_seconds", stage="open_satellite"):
+            with sat:
+                sat_input_filename = sat.input_filename
                 assert(sat.has_variables(["lat", "lon"]))
 
                 # Make sure the satellite variables are there.
@@ -165,6 +276,9 @@ if __name__ == "__main__":
                                 sat_filter, date_format = sat_filter.split(":",)
                             if not sat.has_variables(sat_filter):
                                 raise argparse.ArgumentTypeError("'%s' cannot be found for satellite data. Must be one of '%s'."%(sat_filter, "', '".join(sat.get_variable_names())))
+
+                if statistics != None and not sat.has_variables(statistics_sat_filter):
+                    raise argparse.ArgumentTypeError("'%s' cannot be found for satellite data. Must be one of '%s'."%(statistics_sat_filter, "', '".join(sat.get_variable_names())))
                                 
 
                 # Get the date from the satellite file.
@@ -172,13 +286,13 @@ if __name__ == "__main__":
                 satellite_date = sat.get_date()
 
                 # Calculate the valid time period for the file.
-                date_from_including = satellite_date - datetime.timedelta(hours=12)
-                date_to_excluding = satellite_date + datetime.timedelta(hours=12)
+                date_from_including = satellite_date - libs.matchup.DEFAULT_WINDOW
+                date_to_excluding = satellite_date + libs.matchup.DEFAULT_WINDOW
 
                 # Loop through the available buoys and write the output.
                 for buoy_name in buoy_names:
                     LOG.debug("Buoy short name: %s. Satellite date: %s."%(buoy_name, satellite_date))
-                    with libs.buoy.Buoy(buoy_name, args.data_dir_buoy) as b:
+                    with registry.get(buoy_name) as b:
                         if args.filter != None: 
                             for f in args.filter[0]:
                                 if f.startswith("b:"):
@@ -189,9 +303,16 @@ if __name__ == "__main__":
                                     if buoy_filter != "lat" and buoy_filter != "lon" and not b.has_variables(buoy_filter):
                                         raise argparse.ArgumentTypeError("'%s' cannot be found for buoy '%s' ('%s'). Must be one of '%s'."%(buoy_filter, b.name, b.short_name, "', '".join(b.get_header_strings())))
 
+                        if args.where != None:
+                            for p in args.where:
+                                if p.column.split(":")[0] in ("date", "lat", "lon") or not b.has_variables(p.column):
+                                    raise argparse.ArgumentTypeError("The column '%s' in the predicate '%s' cannot be found for buoy '%s' ('%s'). Must be one of '%s'."%(p.column, p, b.name, b.short_name, "', '".join(b.get_header_strings())))
+
+                        if statistics != None and not b.has_variables(statistics_buoy_filter):
+                            raise argparse.ArgumentTypeError("'%s' cannot be found for buoy '%s' ('%s'). Must be one of '%s'."%(statistics_buoy_filter, b.name, b.short_name, "', '".join(b.get_header_strings())))
 
-                        # Print the header.
-                        if args.print_header:
+                        # Print the header. The binary output has the filter elements as column names.
+                        if args.print_header and writer == None:
                             # Create the header.
                             if args.filter != None:
                                 header = " ".join(args.filter[0])
@@ -205,38 +326,137 @@ if __name__ == "__main__":
                             else:
                                 print header
                                 
-                        # Selecting the satellite data from the buoy lat/lon values.
-                        sat_data = sat.data(b.lat, b.lon)
+                        # No need to continue if there are no buoy data for the satellite file.
+                        if not registry.get_element(buoy_name).covers(date_from_including, date_to_excluding):
+                            LOG.debug("No data for buoy '%s' between %s and %s."%(buoy_name, date_from_including, date_to_excluding))
+                            continue
 
-                        # Looping over buoy data that correspond to the satellite data.
-                        for buoy_data in b.data(date_from_including, date_to_excluding):
-                            # If the data is not filtered, just write erything.
-                            if args.filter == None:
-                                output = "%s %s"%(buoy_data, sat_data)
-                            else:
-                                output_parts = []
-                                for f in args.filter[0]:
-                                    LOG.debug("FILTER: %s"%(f))
-                                    filter_type, filter_value = f.split(":", 1)
-                                    if filter_type == "s":
-                                        output_parts.append(sat_data.filter(filter_value))
-                                    elif filter_type == "b":
-                                        output_parts.append(buoy_data.filter(filter_value))
-                                    elif filter_type == "dummy":
-                                        output_parts.append(libs.filterhelper.format(filter_value))
-                                output = " ".join(output_parts)
-
-                            # Output the content...
-                            if args.output_filename:
-                                # ...to file.
-                                with open(args.output_filename, 'a') as fp:
-                                    fp.write(output+"\n")
+                        # Selecting the satellite data from the buoy lat/lon values.
+                        with metrics.time("stage_duration_seconds", stage="satellite_data"):
+                            if pixel_store != None:
+                                sat_data = sat.data(b)
                             else:
-                                # ...to screen.
-                                print output
+                                sat_data = sat.data(b.lat, b.lon)
+                        if sat_data == None:
+                            LOG.debug("No values for buoy '%s' in the pixel store for %s."%(buoy_name, satellite_date))
+                            continue
+
+                        # The buoy data that correspond to the satellite data, as columns.
+                        # With --merge-join, the buoy data for all the satellite dates are read the
+                        # first time, and assigned to the dates in one pass.
+                        # With --chunk-size, the buoy data are read, and written, a chunk at a time.
+                        if args.merge_join:
+                            if buoy_name not in joined_series:
+                                # Only the dates that have not been processed yet.
+                                join_dates = [date for date in remaining_dates if remaining_dates[date] > 0]
+                                LOG.debug("Joining the buoy data for '%s' with %i satellite dates."%(buoy_name, len(join_dates)))
+                                join_from = min(join_dates) - libs.matchup.DEFAULT_WINDOW
+                                join_to = max(join_dates) + libs.matchup.DEFAULT_WINDOW
+                                with metrics.time("stage_duration_seconds", stage="buoy_read"):
+                                    if args.chunk_size:
+                                        join_chunks = b.chunks(args.chunk_size, join_from, join_to, predicates=args.where)
+                                    else:
+                                        join_chunks = [b.series(join_from, join_to, args.where),]
+                                    joined_series[buoy_name] = libs.matchup.get_joined_series(join_chunks, join_dates)
+                                metrics.inc_once("buoy_file_bytes_total", os.path.getsize(b.data_file), buoy=buoy_name)
+                            buoy_chunks = joined_series[buoy_name][satellite_date]
+                        elif args.chunk_size:
+                            # The chunks are read while they are iterated.
+                            buoy_chunks = metrics.time_iteration(b.chunks(args.chunk_size, date_from_including, date_to_excluding, predicates=args.where),
+                                                                 "stage_duration_seconds", stage="buoy_read")
+                            metrics.inc_once("buoy_file_bytes_total", os.path.getsize(b.data_file), buoy=buoy_name)
+                        else:
+                            with metrics.time("stage_duration_seconds", stage="buoy_read"):
+                                buoy_chunks = [b.series(date_from_including, date_to_excluding, args.where),]
+                            metrics.inc_once("buoy_file_bytes_total", os.path.getsize(b.data_file), buoy=buoy_name)
+
+                        # The aggregates (e.g. "b:WT:3:mean") are over the whole window, so the chunks are put together.
+                        if args.filter != None and len(libs.matchup.get_aggregated_orders(args.filter[0])) > 0:
+                            buoy_chunks = [buoy_series for buoy_series in buoy_chunks if len(buoy_series) > 0]
+                            if len(buoy_chunks) > 1:
+                                buoy_chunks = [libs.buoy.concatenate_series(buoy_chunks),]
+
+                        for buoy_series in buoy_chunks:
+                            if args.filter != None:
+                                buoy_series = libs.matchup.aggregate_series(args.filter[0], buoy_series, satellite_date)
+
+                            # Update the statistics with the block.
+                            if statistics != None:
+                                statistics.update_matchups(buoy_name, statistics_depth, buoy_series.get_dates(), buoy_series.column(statistics_buoy_filter),
+                                                           sat_data.values(statistics_sat_filter)[0], sat_data.data.get("sea_ice_fraction"),
+                                                           libs.buoy.DEFAULT_MISSING_VALUE)
+
+                            if len(buoy_series) == 0:
+                                continue
+
+                            metrics.inc("rows_written_total", len(buoy_series), buoy=buoy_name)
+                            with metrics.time("stage_duration_seconds", stage="write"):
+                                if args.filter == None:
+                                    # Without a filter, every buoy line is written, followed by all the satellite values.
+                                    sat_output = str(sat_data)
+                                    lines = libs.filterhelper.format_block(buoy_series.columns(), separator="").split("\n")
+                                    output = "\n".join(["%s %s"%(line, sat_output) for line in lines])
+                                else:
+                                    # The filtered values for the whole block.
+                                    columns = libs.matchup.get_columns(args.filter[0], sat_data, buoy_series)
+
+                                    # The binary output gets the values, not the formatted strings.
+                                    if writer != None:
+                                        writer.write(columns, satellite_date, buoy_series.dates)
+                                        continue
+
+                                    # Format all the rows at once.
+                                    output = libs.filterhelper.format_block(columns)
+
+                                # Output the content...
+                                if args.output_filename:
+                                    # ...to file.
+                                    with open(args.output_filename, 'a') as fp:
+                                        fp.write(output+"\n")
+                                else:
+                                    # ...to screen.
+                                    print output
+
+                # The joined buoy series for the date are not needed any more.
+                remaining_dates[satellite_date] -= 1
+                if remaining_dates[satellite_date] <= 0:
+                    for joined in joined_series.values():
+                        joined.pop(satellite_date, None)
+
+                metrics.inc("satellite_files_processed_total")
+                if pixel_store == None:
+                    LOG.debug("Variables read from '%s': %s"%(sat_input_filename, sat.get_variable_statistics()))
+                    metrics.inc("bytes_read_total", sat.bytes_read, dataset="satellite")
+                    metrics.add_cache_statistics("satellite_variables", sat.get_variable_statistics())
+
+        # Write the binary output.
+        if writer != None:
+            with metrics.time("stage_duration_seconds", stage="write"):
+                writer.close()
+
+        # Save and output the statistics.
+        if statistics != None:
+            if args.statistics_state:
+                statistics.save(args.statistics_state)
+
+            if args.statistics_summary:
+                with open(args.statistics_summary, 'w') as fp:
+                    fp.write(statistics.summary()+"\n")
+            else:
+                print statistics.summary()
+
+        # The elements of the buoy registry made in this run are saved once, at the end.
+        registry.save()
+        success = True
 
     # If something went wrong.
-    except argparse.ArgumentTypeError, e:
+    except (argparse.ArgumentTypeError, libs.matchup.MatchupException), e:
         print("")
         print("Error: %s"%(e.message))
         sys.exit(1)
+
+    # The metrics are written also if the run fails, so the failure can be seen.
+    finally:
+        if args.metrics_filename:
+            metrics.finish(success)
+            metrics.write(args.metrics_filename)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# coding: utf-8
+import logging
+import datetime
+import sys
+import os
+import libs.satellite
+import libs.buoy
+import libs.pixelstore
+import libs.metrics
+
+LOG = logging.getLogger(__name__)
+
+
+
+if __name__ == "__main__":
+    import argparse
+
+    def date(date_string):
+        return datetime.datetime.strptime(date_string, '%Y-%m-%d')
+
+    def directory(path):
+        if not os.path.isdir(path):
+            raise argparse.ArgumentTypeError("'%s' does not exist. Please specify save directory!"%(path))
+        return path
+
+    def file(path):
+        if not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+            raise argparse.ArgumentTypeError("Directory for '%s' does not exist. Please specify a valid path!"%(path))
+        return path
+
+    def existing_file(path):
+        if not os.path.isfile(path):
+            raise argparse.ArgumentTypeError("File '%s' does not exist. Please specify a valid input file!"%(path))
+        return path
+
+    parser = argparse.ArgumentParser(description='Append the satellite values at the buoy positions to the pixel store, one file per buoy. The values for %s, lat, lon and time are kept. compare_sat_with_bouy.py --pixel-store can then use the store, without opening the satellite files.'%(", ".join(libs.pixelstore.VARIABLES)))
+
+    parser.add_argument('--data-dir-sat', type=directory, help='Specify the directory where the satellite data files can be found.', default=os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "sat"))
+    parser.add_argument('--data-dir-buoy', type=directory, help='Specify the directory where the buoy data files can be found. %s'%(libs.buoy.DECOMPRESSED_HELP), default=os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "buoy"))
+    parser.add_argument('--buoy-registry', type=file, help="Save what is known about the buoys (headers, first and last dates) in this file, and read it from here the next time.")
+    parser.add_argument('--pixel-store', type=file, required=True, help="The directory of the pixel store. It is created if it does not exist.")
+    parser.add_argument('-b', '--buoy', type=str, help="Only this buoy. All the buoys if not given.")
+
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--sat-input-filename', type=existing_file, help="Input filename. This is a satellite data filename.")
+    group.add_argument('--date', type=date, help='Only the satellite files from (including) this date. All the files if no dates are given.')
+    group.add_argument('--date-from', type=date, help='Only the satellite files from (including) this date.')
+
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--date-to', type=date, help='Only the satellite files untill (exclusive) this date.')
+    group.add_argument('--days-back-in-time', type=int, help='Only the satellite files from --date or --date-from and this number of days back in time.')
+    group.add_argument('--days-forward-in-time', type=int, help='Only the satellite files from --date or --date-from and this number of days forward in time.')
+
+    parser.add_argument('--overwrite', action='store_true', help="Append the values again, for buoys that already have values for the date. The last values are used.")
+    parser.add_argument('--prefetch', type=int, default=0, help="Open this number of satellite files in the background, while the current file is processed. Default: 0, the files are opened one by one.")
+    parser.add_argument('--metrics-filename', type=file, help="Write the metrics of the run (rows written per buoy, files processed, bytes read, the time spent in each stage, cache hit ratios) to this file, in the Prometheus text format, e.g. for the textfile collector of the node exporter (the filename must end with '.prom'). The file is replaced when the run ends, also if it fails.")
+    parser.add_argument('--variable-cache-size', type=int, default=libs.satellite.DEFAULT_VARIABLE_CACHE_SIZE//(1024*1024), help="Keep at most this number of megabytes of the variables read from each satellite file, so each variable is only read once. Default: %i."%(libs.satellite.DEFAULT_VARIABLE_CACHE_SIZE//(1024*1024)))
+
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('-d', '--debug', action='store_true', help="Output debugging information.")
+    group.add_argument('-v', '--verbose', action='store_true', help="Output info.")
+
+    parser.add_argument('--log-filename', type=str, help="File used to output logging information.")
+
+    # Do the parsing.
+    args = parser.parse_args()
+
+    # Set the log options.
+    if args.debug:
+        logging.basicConfig(filename=args.log_filename, level=logging.DEBUG)
+    elif args.verbose:
+        logging.basicConfig(filename=args.log_filename, level=logging.INFO)
+    else:
+        logging.basicConfig(filename=args.log_filename, level=logging.WARNING)
+
+    # Output what is in the args variable.
+    LOG.debug(args)
+
+    # The metrics of the run, written to --metrics-filename when the run ends.
+    metrics = libs.metrics.Metrics()
+    success = False
+
+    try:
+        registry = libs.buoy.get_registry(args.data_dir_buoy, args.buoy_registry)
+        buoy_names = registry.get_buoy_names()
+        if args.buoy != None:
+            if args.buoy not in buoy_names:
+                raise argparse.ArgumentTypeError("'%s' can not be found. Please specify another buoy data dir (current: '%s') with --data-dir-buoy, or select one of the buoy names: '%s'!"%(args.buoy, args.data_dir_buoy, "', '".join(buoy_names)))
+            buoy_names = [args.buoy,]
+        buoys = [registry.get(buoy_name) for buoy_name in sorted(buoy_names)]
+
+        if args.sat_input_filename:
+            sat_input_filenames = [args.sat_input_filename,]
+        else:
+            # All the files, if no dates are given.
+            date_from = args.date_from or args.date or datetime.datetime(1981, 1, 1)
+            if args.days_back_in_time:
+                date_to = date_from - datetime.timedelta(days = args.days_back_in_time)
+            elif args.days_forward_in_time:
+                date_to = date_from + datetime.timedelta(days = args.days_forward_in_time)
+            elif args.date_to:
+                date_to = args.date_to
+            elif args.date_from or args.date:
+                date_to = date_from + datetime.timedelta(days = 1)
+            else:
+                date_to = datetime.datetime.now() + datetime.timedelta(days = 1)
+            sat_input_filenames = sorted(libs.satellite.get_files_from_datadir(args.data_dir_sat, date_from, date_to))
+
+        try:
+            pixel_store = libs.pixelstore.PixelStore(args.pixel_store)
+        except libs.pixelstore.PixelStoreException, e:
+            raise argparse.ArgumentTypeError(e.message)
+
+        # Only open the files that are new for some of the buoys.
+        if not args.overwrite:
+            sat_input_filenames = [sat_input_filename for sat_input_filename in sat_input_filenames
+                                   if not all([pixel_store.has_date(b.short_name, libs.satellite.get_date_from_filename(sat_input_filename)) for b in buoys])]
+        LOG.info("Ingesting %i satellite files."%(len(sat_input_filenames)))
+
+        satellites = libs.satellite.prefetch(sat_input_filenames, args.prefetch, ["lat", "lon", "time"] + libs.pixelstore.VARIABLES, args.variable_cache_size*1024*1024)
+        for sat in metrics.time_iteration(satellites, "stage_duration_seconds", stage="open_satellite"):
+            with sat:
+                with metrics.time("stage_duration_seconds", stage="ingest"):
+                    ingested = pixel_store.ingest(sat, buoys, args.overwrite)
+                LOG.info("'%s': %s"%(sat.input_filename, ", ".join(ingested)))
+                LOG.debug("Variables read from '%s': %s"%(sat.input_filename, sat.get_variable_statistics()))
+                for buoy_name in ingested:
+                    metrics.inc("rows_written_total", buoy=buoy_name)
+                metrics.inc("satellite_files_processed_total")
+                metrics.inc("bytes_read_total", sat.bytes_read, dataset="satellite")
+                metrics.add_cache_statistics("satellite_variables", sat.get_variable_statistics())
+
+        # The elements of the buoy registry made in this run are saved once, at the end.
+        registry.save()
+        success = True
+
+    except argparse.ArgumentTypeError, e:
+        print("")
+        print("Error: %s"%(e.message))
+        sys.exit(1)
+
+    # The metrics are written also if the run fails, so the failure can be seen.
+    finally:
+        if args.metrics_filename:
+            metrics.finish(success)
+            metrics.write(args.metrics_filename)
@@ -0,0 +1,106 @@
+# coding: utf-8
+import logging
+import datetime
+import satellite
+import buoy
+import matchup
+
+# Define the logger
+LOG = logging.getLogger(__name__)
+
+class AvailabilityException(Exception):
+    pass
+
+def get_satellite_dates(data_dir, date_from_including, date_to_excluding):
+    """
+    The dates with a satellite (L4) file, found from the file names only. See satellite.get_files_from_datadir.
+    """
+    return set([satellite.get_date_from_filename(filename)
+                for filename in satellite.get_files_from_datadir(data_dir, date_from_including, date_to_excluding)])
+
+def get_days(date_from_including, date_to_excluding):
+    """
+    The days (datetime, midnight) from date_from_including untill date_to_excluding.
+    """
+    day = datetime.datetime(date_from_including.year, date_from_including.month, date_from_including.day)
+    days = []
+    while day < date_to_excluding:
+        days.append(day)
+        day += datetime.timedelta(days=1)
+    return days
+
+
+class Availability(object):
+    def __init__(self, days, satellite_dates, counts):
+        """
+        What data there are for each day:
+        - satellite_dates: The days with a satellite file (set of datetime).
+        - counts:          The number of buoy rows in the matchup window around each day,
+                           an array with one number for each day, by buoy short name.
+        """
+        self.days = days
+        self.satellite_dates = satellite_dates
+        self.counts = counts
+
+    def get_buoy_names(self):
+        return sorted(self.counts.keys())
+
+    def has_satellite_file(self, day):
+        return day in self.satellite_dates
+
+    def rows(self):
+        """
+        Yields (day, has satellite file, [count for each buoy]), the buoys in the order of get_buoy_names.
+        """
+        buoy_names = self.get_buoy_names()
+        for i, day in enumerate(self.days):
+            yield day, self.has_satellite_file(day), [int(self.counts[buoy_name][i]) for buoy_name in buoy_names]
+
+    def format(self, only_missing=False):
+        """
+        The matrix as text, one line for each day: The date, "yes"/"no" for the satellite
+        file, and the number of rows for each buoy. If only_missing is set, only the days
+        without a satellite file, or without rows for one of the buoys, are included.
+        """
+        buoy_names = self.get_buoy_names()
+        width = max([8] + [len(buoy_name) for buoy_name in buoy_names])
+        lines = ["%-10s %3s %s"%("date", "L4", " ".join(["%*s"%(width, buoy_name) for buoy_name in buoy_names]))]
+        for day, has_file, counts in self.rows():
+            if only_missing and has_file and 0 not in counts:
+                continue
+            lines.append("%-10s %3s %s"%(day.strftime("%Y-%m-%d"), "yes" if has_file else "no", " ".join(["%*i"%(width, count) for count in counts])))
+        return "\n".join(lines)
+
+def get_availability(registry, data_dir_sat, date_from_including=None, date_to_excluding=None, buoy_names=None, window=matchup.DEFAULT_WINDOW):
+    """
+    The availability (Availability) of satellite files and buoy data for each day.
+
+    Nothing is parsed: The satellite files are found from the file names, and the buoy
+    rows are counted in the dates of the data files (Buoy.get_date_index). The window is
+    the same as for the matchups, [day - window, day + window).
+
+    Without dates, all the days from the first to the last satellite file or buoy row are included.
+    """
+    if buoy_names == None:
+        buoy_names = registry.get_buoy_names()
+
+    satellite_dates = get_satellite_dates(data_dir_sat, date_from_including or datetime.datetime(1981, 1, 1),
+                                          date_to_excluding or datetime.datetime.now() + datetime.timedelta(days=1))
+    if date_from_including == None or date_to_excluding == None:
+        elements = [registry.get_element(buoy_name) for buoy_name in buoy_names]
+        first_dates = list(satellite_dates) + [element.first_date for element in elements if element.first_date != None]
+        last_dates = list(satellite_dates) + [element.last_date for element in elements if element.last_date != None]
+        if len(first_dates) == 0:
+            raise AvailabilityException("There are no satellite files and no buoy data. Please specify the dates.")
+        date_from_including = date_from_including or min(first_dates)
+        date_to_excluding = date_to_excluding or max(last_dates) + datetime.timedelta(days=1)
+    if date_to_excluding <= date_from_including:
+        raise AvailabilityException("The first date, %s, must be before the last date, %s."%(date_from_including, date_to_excluding))
+
+    days = get_days(date_from_including, date_to_excluding)
+
+    counts = {}
+    for buoy_name in buoy_names:
+        LOG.debug("Counting the rows for '%s'."%(buoy_name))
+        counts[buoy_name] = buoy.count_dates_in_windows(registry.get(buoy_name).get_date_index(), days, window)
+    return Availability(days, satellite_dates, counts)
@@ -0,0 +1,169 @@
+# coding: utf-8
+import logging
+import datetime
+import json
+import os
+import traceback
+
+# Define the logger
+LOG = logging.getLogger(__name__)
+
+# The files of a backfill, in its output dir.
+# The options of the job, which must be the same when the job is restarted.
+JOB_FILENAME = "job.json"
+# The completed units, one JSON object per line.
+LEDGER_FILENAME = "ledger.jsonl"
+# The failed satellite files (or units), with their errors, one JSON object per line.
+QUARANTINE_FILENAME = "quarantine.jsonl"
+
+class BackfillException(Exception):
+    pass
+
+def get_unit_filename(output_dir, buoy_name, satellite_date):
+    """
+    The output file of a unit (the matchups of one buoy for one satellite file), e.g. '<output_dir>/arko/20130101.asc'.
+    """
+    return os.path.join(output_dir, buoy_name, "%s.asc"%(satellite_date.strftime("%Y%m%d")))
+
+def get_stamp(filename):
+    """
+    The (size, mtime) of the file. A unit is done again if its satellite file has changed.
+    """
+    stat = os.stat(filename)
+    return [stat.st_size, stat.st_mtime]
+
+def write_atomically(filename, content):
+    """
+    Writes the content to the file. It is written to a temporary file first, and then
+    renamed, so the file either has all of the content or does not exist.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    temporary_filename = "%s.%i.tmp"%(filename, os.getpid())
+    with open(temporary_filename, 'w') as fp:
+        fp.write(content)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.rename(temporary_filename, filename)
+
+def read_lines(filename):
+    """
+    The JSON objects in the file, one per line. A line that can not be read, e.g. the
+    last line if the process was killed while writing it, is skipped.
+    """
+    entries = []
+    if not os.path.isfile(filename):
+        return entries
+    with open(filename) as fp:
+        for line_number, line in enumerate(fp, 1):
+            if line.strip() == "":
+                continue
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                LOG.warning("Skipping line %i in '%s', which can not be read."%(line_number, filename))
+    return entries
+
+def append_line(filename, entry):
+    """
+    Appends the entry (JSON) as a line to the file, and waits for it to be on the disk.
+    If the last line was not written to the end, it is ended first, so it does not
+    take the new line with it.
+    """
+    with open(filename, 'a+') as fp:
+        fp.seek(0, os.SEEK_END)
+        if fp.tell() > 0:
+            fp.seek(-1, os.SEEK_END)
+            if fp.read(1) != "\n":
+                fp.write("\n")
+        fp.write(json.dumps(entry, sort_keys=True) + "\n")
+        fp.flush()
+        os.fsync(fp.fileno())
+
+
+class Ledger(object):
+    def __init__(self, output_dir):
+        """
+        The progress of a backfill in output_dir: The completed units, and the quarantined
+        satellite files.
+
+        A unit is the matchups of one buoy for one satellite file. Its output is written
+        (get_unit_filename) before it is marked as done in the ledger, so a unit in the
+        ledger always has its output. A unit that was being processed when the job
+        stopped is done again.
+        """
+        self.output_dir = output_dir
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        self.ledger_filename = os.path.join(output_dir, LEDGER_FILENAME)
+        self.quarantine_filename = os.path.join(output_dir, QUARANTINE_FILENAME)
+
+        # The units done, {(satellite filename, buoy name): entry}. The last entry is used.
+        self.done = {}
+        for entry in read_lines(self.ledger_filename):
+            self.done[(entry["sat_file"], entry["buoy"])] = entry
+
+        # The quarantined files, {satellite filename: entry}. A file is taken out of
+        # the quarantine by a later "released" entry.
+        self.quarantined = {}
+        for entry in read_lines(self.quarantine_filename):
+            if entry.get("released"):
+                self.quarantined.pop(entry["sat_file"], None)
+            else:
+                self.quarantined[entry["sat_file"]] = entry
+        LOG.debug("Ledger '%s': %i units done, %i files quarantined."%(output_dir, len(self.done), len(self.quarantined)))
+
+    def check_job(self, options):
+        """
+        Saves the options (dict) of the job, the first time. When the job is restarted,
+        the options must be the same, as the units done were made with them.
+        """
+        job_filename = os.path.join(self.output_dir, JOB_FILENAME)
+        options = json.loads(json.dumps(options, sort_keys=True))
+        if os.path.isfile(job_filename):
+            with open(job_filename) as fp:
+                job_options = json.load(fp)
+            if job_options != options:
+                raise BackfillException("The backfill in '%s' was started with other options (%s). Please use the same options (%s), or another output dir."%(self.output_dir, json.dumps(job_options, sort_keys=True), json.dumps(options, sort_keys=True)))
+        else:
+            write_atomically(job_filename, json.dumps(options, sort_keys=True, indent=1) + "\n")
+
+    def is_done(self, sat_input_filename, buoy_name):
+        """
+        True if the unit is done, for the satellite file as it is now.
+        """
+        entry = self.done.get((os.path.basename(sat_input_filename), buoy_name))
+        return entry != None and entry["stamp"] == get_stamp(sat_input_filename)
+
+    def mark_done(self, sat_input_filename, buoy_name, rows, output_filename):
+        entry = {"sat_file": os.path.basename(sat_input_filename), "buoy": buoy_name, "stamp": get_stamp(sat_input_filename),
+                 "rows": rows, "output": os.path.relpath(output_filename, self.output_dir),
+                 "time": datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")}
+        append_line(self.ledger_filename, entry)
+        self.done[(entry["sat_file"], buoy_name)] = entry
+
+    def is_quarantined(self, sat_input_filename):
+        return os.path.basename(sat_input_filename) in self.quarantined
+
+    def quarantine(self, sat_input_filename, error, buoy_name=None):
+        """
+        Quarantines the satellite file, with the error (the exception being handled).
+        If buoy_name is given, the error happened for that buoy.
+        """
+        entry = {"sat_file": os.path.basename(sat_input_filename), "path": os.path.abspath(sat_input_filename),
+                 "buoy": buoy_name, "error": "%s: %s"%(error.__class__.__name__, error),
+                 "traceback": traceback.format_exc(),
+                 "time": datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")}
+        append_line(self.quarantine_filename, entry)
+        self.quarantined[entry["sat_file"]] = entry
+
+    def release(self, sat_input_filename):
+        """
+        Takes the satellite file out of the quarantine, e.g. when it has been tried again without errors.
+        """
+        if not self.is_quarantined(sat_input_filename):
+            return
+        append_line(self.quarantine_filename, {"sat_file": os.path.basename(sat_input_filename), "released": True,
+                                               "time": datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")})
+        self.quarantined.pop(os.path.basename(sat_input_filename))
@@ -4,8 +4,21 @@ import glob
 import logging
 import datetime
 import re
+import json
+import hashlib
+import mmap
+import itertools
+import gzip
+import bz2
+import shutil
+import tempfile
+import getpass
+import lazyimport
 import datetimehelper
 import filterhelper
+import predicatehelper
+
+np = lazyimport.LazyModule("numpy")
 
 # Define the logger
 LOG = logging.getLogger(__name__)
@@ -14,9 +27,156 @@ LOG = logging.getLogger(__name__)
 DEFAULT_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "buoy")
 DEFAULT_MISSING_VALUE = -99.0
 
+# Extracting valus from a string of floats with the "fortran format" "F8.3".
+# Remembering the possibility of negative numbers, "-*".
+VALUE_PATTERN = re.compile("-*\d{1,4}\.\d{3}")
+
+# The number of bytes in the beginning of a data file used to find out if the file has been rewritten.
+HEAD_CHECKSUM_SIZE = 4096
+
+# The fixed width data lines: A date, "%Y%m%d%H%M", and values with the "fortran format" "F8.3".
+DATE_WIDTH = 12
+VALUE_WIDTH = 8
+VALUE_DECIMALS = 3
+
+# The default number of lines in each chunk (Buoy.chunks).
+DEFAULT_CHUNK_SIZE = 100000
+
+# The compressed data files (e.g. arko.dat.gz), by extension, and how to open them.
+COMPRESSED_EXTENSIONS = {".gz": gzip.open, ".bz2": bz2.BZ2File}
+
+# The compressed data files are decompressed once to this directory, see get_decompressed_file.
+DEFAULT_DECOMPRESSED_DIR = os.path.join(tempfile.gettempdir(), "buoy-validation-%s"%(getpass.getuser()), "decompressed")
+# The largest size (bytes) of the decompressed copies. The least recently used copies are removed, see trim_decompressed_dir.
+DEFAULT_DECOMPRESSED_DIR_SIZE = 1024*1024*1024
+# The help for the scripts that read the buoy data dir, about the cost of reading compressed data files.
+DECOMPRESSED_HELP = "A compressed data file (<name>.dat.gz, <name>.dat.bz2) is decompressed whole the first time it is read, to '%s', so the dates can be read from any position. This needs the disk space of the decompressed file (the least recently used copies are removed above %i MB), and a full decompression each time the compressed file changes."%(DEFAULT_DECOMPRESSED_DIR, DEFAULT_DECOMPRESSED_DIR_SIZE/(1024*1024))
+
+# The statistics the values can be aggregated with, e.g. the filter element "b:WT:3:mean".
+# "nearest" is the value nearest in time to the center of the bin (e.g. the satellite date).
+AGGREGATIONS = ("mean", "median", "count", "min", "max", "nearest")
+
 class BuoyException(Exception):
     pass
 
+def split_data_filename(filename):
+    """
+    The short name and the compression extension (None if not compressed) of a data file,
+    e.g. ('arko', None) for 'arko.dat' and ('arko', '.gz') for 'arko.dat.gz'. None is
+    returned if the file is not a data file.
+    """
+    name, extension = os.path.splitext(filename)
+    compression = None
+    if extension.lower() in COMPRESSED_EXTENSIONS:
+        compression = extension.lower()
+        name, extension = os.path.splitext(name)
+    if extension.lower() != ".dat" or "head" in filename.lower():
+        return None
+    return name.lower(), compression
+
+def get_compression(filename):
+    """
+    The compression extension of the file (see COMPRESSED_EXTENSIONS), or None if it is not compressed.
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    return extension if extension in COMPRESSED_EXTENSIONS else None
+
+def get_data_filename(data_dir, short_name):
+    """
+    The data file of the buoy in the data dir: '<name>.dat', or if there is none, the
+    compressed '<name>.dat.gz' or '<name>.dat.bz2'. None if there is no data file.
+    """
+    for extension in ["",] + sorted(COMPRESSED_EXTENSIONS):
+        filename = os.path.join(data_dir, "%s.dat%s"%(short_name, extension))
+        if os.path.isfile(filename):
+            return filename
+    return None
+
+def trim_decompressed_dir(decompressed_dir, max_size=DEFAULT_DECOMPRESSED_DIR_SIZE, keep=None):
+    """
+    Removes the least recently used (by mtime, see get_decompressed_file) decompressed
+    copies in the dir, until they are at most max_size bytes. The file keep is not removed.
+    """
+    copies = []
+    for filename in glob.glob(os.path.join(decompressed_dir, "*")):
+        if filename.endswith(".tmp"):
+            continue
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            continue
+        copies.append((stat.st_mtime, stat.st_size, filename))
+
+    size = sum([copy_size for mtime, copy_size, filename in copies])
+    for mtime, copy_size, filename in sorted(copies):
+        if size <= max_size:
+            break
+        if filename == keep:
+            continue
+        LOG.debug("Removing '%s', the decompressed copies are more than %i bytes."%(filename, max_size))
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+        size -= copy_size
+
+def get_decompressed_file(filename, decompressed_dir=None, max_size=DEFAULT_DECOMPRESSED_DIR_SIZE):
+    """
+    The decompressed copy of the compressed data file, so it can be read as a plain data file
+    (memory mapped, read from any position, see e.g. read_data_file).
+
+    The file is decompressed (streamed, a block at a time) the first time, and the copy
+    is used until the compressed file changes (size or mtime). The copy is written to
+    a temporary file and renamed, so processes running at the same time never read a
+    part of it. The copies of older versions of the file are removed, and the least
+    recently used copies are removed when they are more than max_size bytes together
+    (see trim_decompressed_dir). The mtime of a copy is updated each time it is used.
+
+    The whole file is decompressed, also if only a window of dates is read. A gzip or
+    bzip2 stream can not be read from the middle without an index of the compression
+    state at each block, which the standard gzip and bz2 modules do not give. The
+    cost is the disk space of the decompressed file, and one full decompression
+    for each version of the compressed file.
+    """
+    if decompressed_dir == None:
+        decompressed_dir = DEFAULT_DECOMPRESSED_DIR
+    compression = get_compression(filename)
+    name = os.path.splitext(os.path.basename(filename))[0]
+    stat = os.stat(filename)
+    path_key = hashlib.md5(os.path.abspath(filename)).hexdigest()[:8]
+    stamp_key = hashlib.md5(repr((stat.st_size, stat.st_mtime))).hexdigest()[:8]
+    prefix = os.path.join(decompressed_dir, "%s.%s."%(name, path_key))
+    decompressed_filename = "%s%s"%(prefix, stamp_key)
+    if os.path.isfile(decompressed_filename):
+        try:
+            os.utime(decompressed_filename, None)
+        except OSError:
+            pass
+        return decompressed_filename
+
+    LOG.info("Decompressing '%s' to '%s'."%(filename, decompressed_filename))
+    if not os.path.isdir(decompressed_dir):
+        os.makedirs(decompressed_dir)
+    temporary_filename = "%s.%i.tmp"%(decompressed_filename, os.getpid())
+    with open(temporary_filename, 'wb') as output_fp:
+        input_fp = COMPRESSED_EXTENSIONS[compression](filename, 'rb')
+        try:
+            shutil.copyfileobj(input_fp, output_fp, 1024*1024)
+        finally:
+            input_fp.close()
+    os.rename(temporary_filename, decompressed_filename)
+
+    # The copies of the older versions of the file.
+    for old_filename in glob.glob("%s*"%(prefix)):
+        if old_filename != decompressed_filename and not old_filename.endswith(".tmp"):
+            LOG.debug("Removing '%s'."%(old_filename))
+            try:
+                os.remove(old_filename)
+            except OSError:
+                pass
+    trim_decompressed_dir(decompressed_dir, max_size, decompressed_filename)
+    return decompressed_filename
+
 def get_buoy_names(data_dir=None):
     if data_dir==None:
         # One back and into "data".
@@ -27,12 +187,10 @@ def get_buoy_names(data_dir=None):
     # Return a set of all the filenames, with one dot with the .dat extension, in the data directory.
     # "header" files (files with the "header" somewhere in the name) are ignored.
     # E.g. arko.dat arko.dat_head.dat arko.datneu.dat arko.datneu_head.dat dars.dat dars.dat_head.dat
-    # becomes arko, arko.datneu and dars.
+    # becomes arko, arko.datneu and dars. The compressed data files, e.g. arko.dat.gz, are included.
     if os.path.isdir(data_dir):
-        return set([os.path.splitext(filename)[0].lower() \
-                    for filename in os.walk((os.path.abspath(os.path.join(data_dir)))).next()[2] \
-                    if os.path.splitext(filename)[1].lower() == ".dat" \
-                    and "head" not in filename.lower()])
+        data_filenames = [split_data_filename(filename) for filename in os.walk((os.path.abspath(os.path.join(data_dir)))).next()[2]]
+        return set([data_filename[0] for data_filename in data_filenames if data_filename != None])
 
     LOG.error("Missing data dir: '%s'"%(data_dir))
     raise BuoyException("Missing data dir: '%s'"%(data_dir))
@@ -43,6 +201,323 @@ def buoy_factory(name):
     """
     return Buoy(name)
 
+def parse_lines(lines, number_of_headers, value_predicates=None):
+    """
+    Parses the lines from a <buoy_short_name>.dat file into a date array and a value array.
+
+    The dates are datetime64 (minutes), and the values are a float array with one row
+    for each line and one column for each header element. All the dates are parsed
+    at once (see datetimehelper.parse_dates), as are all the values. Empty lines are skipped.
+
+    If value_predicates (see get_value_predicates) are given, only the lines where the
+    values fulfil the predicates are kept. The columns in the predicates are converted
+    first, and the dates and the other values are only converted for the lines kept.
+    """
+    date_strings = []
+    value_strings = []
+    for line in lines:
+        line_parts = line.split(None, 1)
+        if len(line_parts) == 0:
+            continue
+        date_strings.append(line_parts[0])
+        value_strings.append(line_parts[1] if len(line_parts) == 2 else "")
+
+    values = VALUE_PATTERN.findall("\n".join(value_strings))
+    if len(values) != len(date_strings)*number_of_headers:
+        # Find the line that does not match.
+        for date_string, value_string in zip(date_strings, value_strings):
+            number_of_values = len(VALUE_PATTERN.findall(value_string))
+            if number_of_values != number_of_headers:
+                raise BuoyException("The number of values in the data line (%s), %i, does not match the number of header elements, %i."%(date_string, number_of_values, number_of_headers))
+
+    if value_predicates:
+        value_strings = np.array(values).reshape(len(date_strings), number_of_headers)
+        mask = np.ones(len(date_strings), dtype=bool)
+        for column_index, predicate in value_predicates:
+            mask &= predicate.mask(np.array(value_strings[:, column_index].tolist(), dtype=np.float64))
+        date_strings = np.array(date_strings)[mask]
+        values = value_strings[mask].ravel().tolist()
+
+    dates = datetimehelper.parse_dates(date_strings)
+    values = np.array(values, dtype=np.float64).reshape(len(date_strings), number_of_headers)
+    return dates, values
+
+def get_fixed_width_layout(buffer, number_of_headers):
+    """
+    Finds the layout of the fixed width lines from the first line in the buffer.
+
+    Returns (line length, start of the values, end of the values), where the line
+    length includes the newline, or None if the first line can not be a fixed width line.
+    """
+    line_length = buffer.find("\n") + 1
+    if line_length == 0:
+        return None
+
+    # Windows line endings.
+    values_end = line_length - 1
+    if line_length > 1 and buffer[line_length - 2] == "\r":
+        values_end -= 1
+
+    values_start = values_end - number_of_headers*VALUE_WIDTH
+    if values_start < DATE_WIDTH:
+        return None
+    return line_length, values_start, values_end
+
+def parse_fixed_width(buffer, number_of_headers, value_predicates=None):
+    """
+    Parses the lines from a <buoy_short_name>.dat file where all the lines have the same
+    length: A date, spaces and the values, each VALUE_WIDTH characters wide ("F8.3").
+
+    The buffer can be a string or a memory map of the file. It is viewed as an array
+    of bytes, with one row for each line, and the dates and values are decoded
+    directly from the bytes, without making a string for each line.
+
+    Returns the same as parse_lines, or None if the lines are not fixed width (or
+    have characters that are not expected). Then parse_lines must be used. See
+    parse_lines for value_predicates.
+    """
+    if len(buffer) == 0:
+        return np.array([], dtype="M8[m]"), np.zeros((0, number_of_headers), dtype=np.float64)
+
+    layout = get_fixed_width_layout(buffer, number_of_headers)
+    if layout == None:
+        return None
+    line_length, values_start, values_end = layout
+    if len(buffer) % line_length != 0:
+        return None
+
+    lines = np.frombuffer(buffer, dtype=np.uint8).reshape(-1, line_length)
+    try:
+        return parse_fixed_width_lines(lines, number_of_headers, values_start, values_end, value_predicates=value_predicates)
+    finally:
+        # The buffer can not be closed while it is used by the array.
+        del lines
+
+def parse_fixed_width_lines(lines, number_of_headers, values_start, values_end, column_indexes=None, value_predicates=None):
+    """
+    Decodes the lines (2D array of bytes), see parse_fixed_width.
+
+    If column_indexes is given, only those columns are decoded (and returned).
+
+    If value_predicates are given, the columns in the predicates are decoded first, and
+    the lines where the values do not fulfil the predicates are dropped, before the dates
+    and the other columns are decoded.
+    """
+    # The line endings.
+    if (lines[:, -1] != ord("\n")).any() or (values_end != lines.shape[1] - 1 and (lines[:, values_end] != ord("\r")).any()):
+        return None
+
+    # Only the lines where the values fulfil the predicates.
+    if value_predicates:
+        fields = lines[:, values_start:values_end].reshape(len(lines), number_of_headers, VALUE_WIDTH)
+        mask = np.ones(len(lines), dtype=bool)
+        for column_index, predicate in value_predicates:
+            column = decode_fixed_width_values(fields[:, column_index, :])
+            if column is None:
+                return None
+            mask &= predicate.mask(column)
+        lines = lines[mask]
+
+    # The dates, only digits.
+    date_digits = lines[:, :DATE_WIDTH].astype(np.int64) - ord("0")
+    if ((date_digits < 0) | (date_digits > 9)).any():
+        return None
+
+    # The spaces between the date and the values.
+    if (lines[:, DATE_WIDTH:values_start] != ord(" ")).any():
+        return None
+
+    date_numbers = date_digits.dot(10**np.arange(DATE_WIDTH - 1, -1, -1, dtype=np.int64))
+    try:
+        dates = datetimehelper.parse_date_numbers(date_numbers)
+    except ValueError:
+        return None
+
+    if column_indexes == None:
+        column_indexes = range(number_of_headers)
+    fields = lines[:, values_start:values_end].reshape(len(lines), number_of_headers, VALUE_WIDTH)
+    values = np.empty((len(lines), len(column_indexes)), dtype=np.float64)
+    for i, column_index in enumerate(column_indexes):
+        column = decode_fixed_width_values(fields[:, column_index, :])
+        if column is None:
+            return None
+        values[:, i] = column
+    return dates, values
+
+def decode_fixed_width_values(fields):
+    """
+    Decodes a column of values, given as an array of bytes with one row for each value,
+    e.g. " -12.345". None is returned if one of the values is not on the form
+    (spaces)(-)(digits).(VALUE_DECIMALS digits).
+
+    The values are exactly the same as float(string): The digits are read as an
+    integer, which is divided by 10**VALUE_DECIMALS.
+    """
+    integer_width = VALUE_WIDTH - VALUE_DECIMALS - 1
+    digits = fields.astype(np.int64) - ord("0")
+    is_digit = (digits >= 0) & (digits <= 9)
+    is_space = fields == ord(" ")
+    is_minus = fields == ord("-")
+
+    # The decimal point and the decimals.
+    if (fields[:, integer_width] != ord(".")).any() or not is_digit[:, integer_width + 1:].all():
+        return None
+
+    # Spaces, then maybe a minus, then at least one digit before the decimal point.
+    valid = is_digit[:, integer_width - 1].copy()
+    for p in range(integer_width - 1):
+        valid &= (is_space[:, p] & (is_space[:, p + 1] | is_minus[:, p + 1] | is_digit[:, p + 1])) \
+                 | (is_minus[:, p] & is_digit[:, p + 1]) \
+                 | (is_digit[:, p] & is_digit[:, p + 1])
+    if not valid.all():
+        return None
+
+    # All the digits as one integer, e.g. " -12.345" -> 12345.
+    digits = np.where(is_digit, digits, 0)
+    digits = np.delete(digits, integer_width, axis=1)
+    numbers = digits.dot(10**np.arange(VALUE_WIDTH - 2, -1, -1, dtype=np.int64))
+
+    values = numbers.astype(np.float64)/10**VALUE_DECIMALS
+    negative = is_minus.any(axis=1)
+    values[negative] = -values[negative]
+    return values
+
+def read_data_file(data_file, number_of_headers, value_predicates=None):
+    """
+    Reads all the dates and values from a data file.
+
+    The file is memory mapped and parsed as fixed width lines (parse_fixed_width).
+    If the lines are not fixed width, they are parsed with parse_lines. See
+    parse_lines for value_predicates.
+    """
+    with open(data_file, 'rb') as fp:
+        if os.fstat(fp.fileno()).st_size > 0:
+            buffer = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                result = parse_fixed_width(buffer, number_of_headers, value_predicates)
+            finally:
+                buffer.close()
+            if result != None:
+                return result
+            LOG.debug("The lines in '%s' are not fixed width. Parsing the lines one by one."%(data_file))
+        fp.seek(0)
+        return parse_lines(fp, number_of_headers, value_predicates)
+
+def iterate_data_file(data_file, number_of_headers, chunk_size=DEFAULT_CHUNK_SIZE, column_indexes=None, value_predicates=None):
+    """
+    Reads a data file, chunk_size lines at a time, and yields the dates and values for
+    each chunk (as parse_lines). Only one chunk is in memory at a time.
+
+    If column_indexes is given, only those columns of the values are kept. See
+    parse_lines for value_predicates. A chunk can have less than chunk_size rows.
+
+    The file is memory mapped and the chunks are parsed as fixed width lines
+    (parse_fixed_width). If the lines are not fixed width, the rest of the file
+    is read line by line and parsed with parse_lines.
+    """
+    with open(data_file, 'rb') as fp:
+        offset = 0
+        if os.fstat(fp.fileno()).st_size > 0:
+            buffer = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                layout = get_fixed_width_layout(buffer, number_of_headers)
+                if layout != None and len(buffer) % layout[0] == 0:
+                    line_length, values_start, values_end = layout
+                    lines = np.frombuffer(buffer, dtype=np.uint8).reshape(-1, line_length)
+                    for start in range(0, len(lines), chunk_size):
+                        result = parse_fixed_width_lines(lines[start:start + chunk_size], number_of_headers, values_start, values_end, column_indexes, value_predicates)
+                        if result == None:
+                            break
+                        offset = (start + chunk_size)*line_length
+                        yield result
+                    del lines
+            finally:
+                buffer.close()
+
+        if offset >= os.fstat(fp.fileno()).st_size:
+            return
+        if offset > 0:
+            LOG.debug("The lines in '%s' are not fixed width after byte %i. Parsing the lines one by one."%(data_file, offset))
+        fp.seek(offset)
+        while True:
+            lines = list(itertools.islice(fp, chunk_size))
+            if len(lines) == 0:
+                return
+            dates, values = parse_lines(lines, number_of_headers, value_predicates)
+            if column_indexes != None:
+                values = values[:, column_indexes]
+            yield dates, values
+
+def read_data_file_window(arguments):
+    """
+    Reads a data file (read_data_file) and keeps the rows inside the dates.
+
+    The arguments are given as one tuple, (data_file, number_of_headers, date_from_including,
+    date_to_excluding, value_predicates), so it can be used with Pool.map.
+    """
+    data_file, number_of_headers, date_from_including, date_to_excluding, value_predicates = arguments
+    dates, values = read_data_file(data_file, number_of_headers, value_predicates)
+    mask = datetimehelper.get_window_mask(dates, date_from_including, date_to_excluding)
+    return dates[mask], values[mask]
+
+def read_dates(data_file):
+    """
+    Reads only the dates (datetime64, sorted) from a data file, without decoding the values.
+
+    The file is memory mapped and the first DATE_WIDTH bytes of each fixed width
+    line are decoded. If the lines are not fixed width, the first word of each line is used.
+    """
+    with open(data_file, 'rb') as fp:
+        if os.fstat(fp.fileno()).st_size > 0:
+            buffer = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                dates = None
+                layout = get_fixed_width_layout(buffer, 0)
+                if layout != None and len(buffer) % layout[0] == 0:
+                    lines = np.frombuffer(buffer, dtype=np.uint8).reshape(-1, layout[0])
+                    date_digits = lines[:, :DATE_WIDTH].astype(np.int64) - ord("0")
+                    if (lines[:, -1] == ord("\n")).all() and ((date_digits >= 0) & (date_digits <= 9)).all():
+                        try:
+                            dates = datetimehelper.parse_date_numbers(date_digits.dot(10**np.arange(DATE_WIDTH - 1, -1, -1, dtype=np.int64)))
+                        except ValueError:
+                            pass
+                    del lines
+            finally:
+                buffer.close()
+            if dates is not None:
+                return np.sort(dates)
+            LOG.debug("The lines in '%s' are not fixed width. Reading the dates line by line."%(data_file))
+        fp.seek(0)
+        return np.sort(datetimehelper.parse_dates([line.split()[0] for line in fp if line.strip() != ""]))
+
+def count_dates_in_windows(dates, centers, window):
+    """
+    The number of dates (sorted datetime64) in the window [center - window, center + window)
+    around each of the centers (datetime). It is found by a binary search in the dates,
+    not by comparing all the dates.
+    """
+    centers = np.array(centers, dtype="M8[us]")
+    window = np.timedelta64(window, "us")
+    dates = np.asarray(dates).astype("M8[us]")
+    return np.searchsorted(dates, centers + window) - np.searchsorted(dates, centers - window)
+
+def line_matches(line, value_predicates):
+    """
+    True if the values in the data line fulfil the predicates (see get_value_predicates).
+    Only the values in the predicates are converted. If the line does not have the
+    values, True is returned, so the error is found when the line is parsed.
+    """
+    line_parts = line.split(None, 1)
+    if len(line_parts) < 2:
+        return True
+    values = VALUE_PATTERN.findall(line_parts[1])
+    for column_index, predicate in value_predicates:
+        if column_index >= len(values):
+            return True
+        if not predicate.matches(float(values[column_index])):
+            return False
+    return True
+
 def get_header_filename(buoy_short_name):
     if "neu" in buoy_short_name:
         return "%s_head.dat"%(buoy_short_name) # dars.datneu_head.dat
@@ -94,7 +569,7 @@ class BuoyDataElement(object):
         for line_part in line_parts:
             # Extracting valus from a string of floats with the "fortran format" "F8.3".
             # The values end up in a list [val1, val2, ...].
-            values = [float(x) for x in re.findall("-*\d{1,4}\.\d{3}", line_part)]
+            values = [float(x) for x in VALUE_PATTERN.findall(line_part)]
             for value in values:
                 self.__dict__[self.headers[i].type][self.headers[i].value] = value
                 i += 1
@@ -102,13 +577,13 @@ class BuoyDataElement(object):
         if i != len(self.headers):
             raise BuoyException("The number of values in the data line, %i, does not match the number of header elements, %i."%(i, len(self.header)))
 
-    def filter(self, order=None, ):
+    def values(self, order=None):
         """
-        A filter is applied to the data when printing it.
+        The values selected by the order filter, in the order given.
 
         The order filter must correspond to the data in the dat_header.dat file.
         It must be a list of key/values, e.g.: ["WT:3", "WT:6"], or a string
-        with one value, "WT:3".
+        with one value, "WT:3". See filter.
         """
         LOG.debug("Order: '%s'."%(order))
         values = []
@@ -149,10 +624,19 @@ class BuoyDataElement(object):
 
             for header in self.headers:
                 values.append(self.__dict__[header.type][header.value])
+        return values
 
+    def filter(self, order=None, ):
+        """
+        A filter is applied to the data when printing it.
+
+        The order filter must correspond to the data in the dat_header.dat file.
+        It must be a list of key/values, e.g.: ["WT:3", "WT:6"], or a string
+        with one value, "WT:3".
+        """
         # Create a formatted string. 8 numbers for each string element.
         output = ""
-        for value in values:
+        for value in self.values(order):
             output += filterhelper.format(value)
         return output
 
@@ -160,24 +644,361 @@ class BuoyDataElement(object):
         return "%s"%self.filter()
 
 
+def get_header_index(headers, header_type, header_value):
+    """
+    The index of the header with the type and value, e.g. "WT" and "3".
+    If the header is there more than once, the last one is used, as in BuoyDataElement.
+    """
+    index = None
+    for i, header in enumerate(headers):
+        if header.type == header_type and header.value == header_value:
+            index = i
+    if index == None:
+        raise BuoyException("'%s:%s' is not a header in the buoy data."%(header_type, header_value))
+    return index
+
+def get_header_indexes(headers, order=None):
+    """
+    The indexes of the headers needed for the filter elements in order, e.g. ["date:", "WT:3"].
+    All the indexes are returned if order is None.
+    """
+    if order == None:
+        return range(len(headers))
+    if isinstance(order, str):
+        order = [order,]
+    indexes = set()
+    for o in order:
+        if ":" not in o:
+            continue
+        aggregation = parse_aggregation(o)
+        if aggregation != None:
+            o = aggregation[0]
+        header_type, header_value = o.split(":", 1)
+        if header_type not in ("date", "lat", "lon", "dummy"):
+            indexes.add(get_header_index(headers, header_type, header_value))
+    return sorted(indexes)
+
+def get_value_predicates(headers, predicates):
+    """
+    Pairs each predicate (predicatehelper.Predicate) with the index of its column,
+    e.g. "WT:3", in the headers. This is what the parse functions use.
+    """
+    if predicates == None:
+        return None
+    value_predicates = []
+    for predicate in predicates:
+        if ":" not in predicate.column:
+            raise BuoyException("The column in the predicate '%s' must be a header, e.g. 'WT:3'."%(predicate))
+        header_type, header_value = predicate.column.split(":", 1)
+        value_predicates.append((get_header_index(headers, header_type, header_value), predicate))
+    return value_predicates
+
+def parse_predicates(predicate_strings):
+    """
+    Parses the predicates, e.g. ["WT:3 not missing", "0 < WT:3 < 30"], with
+    DEFAULT_MISSING_VALUE as the missing value. See predicatehelper.parse_predicate.
+    """
+    try:
+        return [predicatehelper.parse_predicate(predicate_string, DEFAULT_MISSING_VALUE) for predicate_string in predicate_strings]
+    except predicatehelper.PredicateException, e:
+        raise BuoyException(e.message)
+
+def parse_aggregation(order):
+    """
+    Splits an aggregated filter element, e.g. "WT:3:mean" or "WT:3:mean:18-06", into the
+    column ("WT:3"), the statistic ("mean", see AGGREGATIONS) and the hours ((18, 6) or None).
+    None is returned if the element is not aggregated.
+
+    The hours are the UTC hours of the day, from (including) and to (excluding), of the rows
+    used. They may wrap around midnight, e.g. "18-06" are the night-time rows.
+    """
+    parts = order.split(":")
+    if len(parts) < 3 or parts[0] in ("date", "lat", "lon", "dummy") or parts[2] not in AGGREGATIONS:
+        return None
+    hours = None
+    if len(parts) > 4:
+        raise BuoyException("'%s' must be <type>:<value>:<statistic>[:<from hour>-<to hour>], e.g. 'WT:3:mean:18-06'."%(order))
+    if len(parts) == 4:
+        match = re.match("^(\d{1,2})-(\d{1,2})$", parts[3])
+        if match == None or int(match.group(1)) > 24 or int(match.group(2)) > 24:
+            raise BuoyException("The hours in '%s' must be <from hour>-<to hour>, e.g. '18-06'."%(order))
+        hours = (int(match.group(1)), int(match.group(2)))
+    return "%s:%s"%(parts[0], parts[1]), parts[2], hours
+
+def get_hours_mask(dates, hours):
+    """
+    A mask (array of bools) that is True for the dates (datetime64) with the UTC hour of the day
+    inside the hours, (from including, to excluding). See parse_aggregation.
+    """
+    dates = np.asarray(dates).astype("M8[us]")
+    hours_of_day = (dates - dates.astype("M8[D]")) / np.timedelta64(1, "h")
+    hour_from, hour_to = hours
+    if hour_from <= hour_to:
+        return (hours_of_day >= hour_from) & (hours_of_day < hour_to)
+    return (hours_of_day >= hour_from) | (hours_of_day < hour_to)
+
+def get_bin_indexes(dates, bin_edges):
+    """
+    The index of the bin of each date (datetime64), where bin i is [bin_edges[i], bin_edges[i + 1]).
+    The dates outside the bins get -1.
+    """
+    bin_edges = np.asarray(bin_edges, dtype="M8[us]")
+    indexes = np.searchsorted(bin_edges, np.asarray(dates).astype("M8[us]"), side="right") - 1
+    indexes[indexes >= len(bin_edges) - 1] = -1
+    return indexes
+
+def aggregate_values(values, bin_indexes, number_of_bins, statistic, distances=None):
+    """
+    The values (1d array) aggregated with the statistic (see AGGREGATIONS) for each bin,
+    where bin_indexes is the bin of each value (-1 is no bin). The missing values are left out.
+    A bin without values gets DEFAULT_MISSING_VALUE, or 0 for "count".
+
+    It is vectorised: The values are sorted by bin (and value, or distance), so the
+    median, min, max and nearest are found by their position in each bin.
+    distances (1d array, e.g. seconds from the center of the bin) are needed for "nearest",
+    which is the value with the smallest distance (the first one, if more than one).
+    """
+    if statistic not in AGGREGATIONS:
+        raise BuoyException("Unknown statistic '%s'. Must be one of '%s'."%(statistic, "', '".join(AGGREGATIONS)))
+    values = np.asarray(values, dtype=np.float64)
+    bin_indexes = np.asarray(bin_indexes)
+    valid = (bin_indexes >= 0) & (values != DEFAULT_MISSING_VALUE) & ~np.isnan(values)
+    bins = bin_indexes[valid]
+    values = values[valid]
+    counts = np.bincount(bins, minlength=number_of_bins)
+    if statistic == "count":
+        return counts.astype(np.float64)
+
+    aggregated = np.empty(number_of_bins)
+    aggregated.fill(DEFAULT_MISSING_VALUE)
+    has_values = counts > 0
+    if statistic == "mean":
+        sums = np.bincount(bins, weights=values, minlength=number_of_bins)
+        aggregated[has_values] = sums[has_values]/counts[has_values]
+        return aggregated
+
+    # The first position of each bin in the sorted values.
+    starts = (np.cumsum(counts) - counts)[has_values]
+    counts = counts[has_values]
+    if statistic == "nearest":
+        sorted_values = values[np.lexsort((np.asarray(distances, dtype=np.float64)[valid], bins))]
+        aggregated[has_values] = sorted_values[starts]
+        return aggregated
+
+    sorted_values = values[np.lexsort((values, bins))]
+    if statistic == "min":
+        aggregated[has_values] = sorted_values[starts]
+    elif statistic == "max":
+        aggregated[has_values] = sorted_values[starts + counts - 1]
+    else:
+        aggregated[has_values] = (sorted_values[starts + (counts - 1)//2] + sorted_values[starts + counts//2])/2.0
+    return aggregated
+
+def concatenate_series(series_list):
+    """
+    One series (BuoySeries) with the rows of all the series (e.g. the chunks from Buoy.chunks),
+    which must have the same headers.
+    """
+    first = series_list[0]
+    return BuoySeries(np.concatenate([series.dates for series in series_list]),
+                      np.concatenate([series.values for series in series_list]),
+                      first.headers, first.lat, first.lon)
+
+class BuoySeries(object):
+    def __init__(self, dates, values, headers, lat, lon):
+        """
+        The data from a buoy, as columns.
+
+        The dates are an array of datetime64, and the values an array with one
+        row for each date and one column for each of the headers (BuoyHeaderElements).
+        """
+        self.dates = dates
+        self.values = values
+        self.headers = headers
+        self.lat = lat
+        self.lon = lon
+
+    def __len__(self):
+        return len(self.dates)
+
+    def select(self, mask):
+        """
+        A new series with the rows where the mask (array of bools or indexes, or a slice) is True.
+        """
+        return BuoySeries(self.dates[mask], self.values[mask], self.headers, self.lat, self.lon)
+
+    def window(self, date_from_including=None, date_to_excluding=None):
+        """
+        A new series with the rows inside the dates. See datetimehelper.get_window_mask.
+        """
+        return self.select(datetimehelper.get_window_mask(self.dates, date_from_including, date_to_excluding))
+
+    def where(self, predicates=None):
+        """
+        A new series with the rows where the values fulfil the predicates (predicatehelper.Predicate).
+        """
+        if not predicates:
+            return self
+        mask = np.ones(len(self), dtype=bool)
+        for column_index, predicate in get_value_predicates(self.headers, predicates):
+            mask &= predicate.mask(self.values[:, column_index])
+        return self.select(mask)
+
+    def get_dates(self):
+        """
+        The dates as a list of datetime objects.
+        """
+        return datetimehelper.datetime64_2_dates(self.dates)
+
+    def get_column_index(self, header_type, header_value):
+        """
+        The index of the column for the header type and value, e.g. "WT" and "3".
+        See get_header_index.
+        """
+        return get_header_index(self.headers, header_type, header_value)
+
+    def has_column(self, order):
+        """
+        True if the series has a column for the filter element, e.g. "WT:3" or "WT:3:mean" (see with_aggregates).
+        """
+        header_type, header_value = order.split(":", 1)
+        return any([header.type == header_type and header.value == header_value for header in self.headers])
+
+    def aggregate(self, statistic, bin_edges=None, centers=None, hours=None, column_indexes=None):
+        """
+        The values aggregated with the statistic (see AGGREGATIONS) in bins of time, as a
+        new series with one row for each bin, e.g. the daily means.
+
+        bin_edges are the dates (datetime or datetime64, in time order) of the bins, where
+        bin i is [bin_edges[i], bin_edges[i + 1]). If None, all the rows are in one bin.
+        The dates of the new rows are the centers (one for each bin), which are also the
+        dates used by "nearest". By default, they are the middle of the bins.
+
+        If hours are given, e.g. (18, 6), only the rows in those UTC hours of the day are
+        used (see get_hours_mask). If column_indexes are given, only those columns are aggregated.
+        The missing values are left out, see aggregate_values.
+        """
+        headers = self.headers
+        values = self.values
+        if column_indexes != None:
+            headers = [self.headers[i] for i in column_indexes]
+            values = self.values[:, column_indexes]
+
+        dates = self.dates.astype("M8[us]")
+        if bin_edges is None:
+            if len(self) == 0:
+                return BuoySeries(dates, values, headers, self.lat, self.lon)
+            bin_edges = [dates.min(), dates.max() + np.timedelta64(1, "us")]
+        bin_edges = np.asarray(bin_edges, dtype="M8[us]")
+        number_of_bins = len(bin_edges) - 1
+        if number_of_bins < 1 or (bin_edges[1:] < bin_edges[:-1]).any():
+            raise BuoyException("There must be at least two bin edges, in time order.")
+        if centers is None:
+            centers = bin_edges[:-1] + (bin_edges[1:] - bin_edges[:-1])//2
+        centers = np.asarray(centers, dtype="M8[us]")
+        if len(centers) != number_of_bins:
+            raise BuoyException("There must be one center for each bin, %i, not %i."%(number_of_bins, len(centers)))
+
+        bin_indexes = get_bin_indexes(dates, bin_edges)
+        if hours != None:
+            bin_indexes[~get_hours_mask(dates, hours)] = -1
+        distances = None
+        if statistic == "nearest":
+            distances = np.abs((dates - centers[np.maximum(bin_indexes, 0)]).astype(np.float64))
+
+        aggregated = np.empty((number_of_bins, len(headers)))
+        for i in range(len(headers)):
+            aggregated[:, i] = aggregate_values(values[:, i], bin_indexes, number_of_bins, statistic, distances)
+        return BuoySeries(centers, aggregated, headers, self.lat, self.lon)
+
+    def with_aggregates(self, orders, center=None):
+        """
+        A new series with a column for each of the aggregated filter elements in orders,
+        e.g. "WT:3:mean" (see parse_aggregation), with the aggregate over all the rows
+        (e.g. the window of a satellite date) in every row. The new headers have the type
+        and the rest of the element as the value, e.g. "WT" and "3:mean", so they are
+        found by column. center is the date used by "nearest", e.g. the satellite date.
+        """
+        headers = list(self.headers)
+        aggregates = []
+        for order in orders:
+            if order in ["%s:%s"%(header.type, header.value) for header in headers]:
+                continue
+            column_order, statistic, hours = parse_aggregation(order)
+            aggregated = self.aggregate(statistic, centers=None if center == None else [center], hours=hours,
+                                        column_indexes=[self.get_column_index(*column_order.split(":", 1))])
+            header_type, header_value = order.split(":", 1)
+            headers.append(BuoyHeaderElement("%s %s"%(header_value, header_type)))
+            aggregates.append(aggregated.values[0, 0] if len(aggregated) > 0 else DEFAULT_MISSING_VALUE)
+
+        if len(aggregates) == 0:
+            return self
+        values = np.hstack([self.values, np.repeat(np.array([aggregates]), len(self), axis=0)])
+        return BuoySeries(self.dates, values, headers, self.lat, self.lon)
+
+    def column(self, order):
+        """
+        The values for one filter element, e.g. "WT:3", "date:julian" or "lat",
+        for all the rows. See BuoyDataElement.values. An aggregated element, e.g.
+        "WT:3:mean", is the aggregate over all the rows, see with_aggregates.
+        """
+        if order in ("date", "lat", "lon"):
+            order = "%s:"%(order)
+
+        if parse_aggregation(order) != None and not self.has_column(order):
+            return self.with_aggregates([order]).column(order)
+
+        header_type, header_value = order.split(":", 1)
+        if header_type == "date":
+            if header_value == "julian":
+                return datetimehelper.dates2julian(self.dates)
+            elif header_value != "":
+                return datetimehelper.format_dates(self.dates, header_value)
+            return datetimehelper.format_dates(self.dates)
+        elif header_type == "lat":
+            return np.repeat(self.lat, len(self))
+        elif header_type == "lon":
+            return np.repeat(self.lon, len(self))
+        elif header_type == "dummy":
+            return [header_value]*len(self)
+        return self.values[:, self.get_column_index(header_type, header_value)]
+
+    def columns(self, order=None):
+        """
+        The values for each filter element in order, as columns. If order is None, the
+        date and all the header values are returned, as in BuoyDataElement.values.
+        """
+        if order == None:
+            return [self.column("date:")] + [self.values[:, i] for i in range(len(self.headers))]
+        if isinstance(order, str):
+            order = [order,]
+        return [self.column(o) for o in order]
+
+
 class Buoy:
-    def __init__(self, short_buoy_name, data_dir=None, data_file=None, data_header_file=None):
+    def __init__(self, short_buoy_name, data_dir=None, data_file=None, data_header_file=None, buoy_names=None, decompressed_dir=None):
         """
         Initiates the buoy.
 
         Based on the input name, it sets the data file and the corresponding header file.
 
-        The data file must be named:   <name>.dat
+        The data file must be named:   <name>.dat (or <name>.dat.gz, <name>.dat.bz2)
         The header file must be named: <name>.dat_head.dat
 
+        A compressed data file is read from a decompressed copy in decompressed_dir (see
+        get_decompressed_file), so it is only decompressed once, and is read as fast as a
+        plain data file. source_file is the file in the data dir, and data_file is the file read.
+
         They must both exist in the data_dir, which can be specified. If not,
         the "data" directory is used.
 
         The header types are read (from the header file) into a list of BuoyHeaderElements.
+
+        buoy_names are the available buoy names. If not given, they are found with get_buoy_names.
         """
         LOG.debug("Buoy short name (used to find data and header files): '%s'."%(short_buoy_name))
 
-        buoys = get_buoy_names(data_dir)
+        buoys = buoy_names if buoy_names != None else get_buoy_names(data_dir)
         if short_buoy_name not in buoys:
             raise BuoyException("The input name of the buoy, %s, must be one of '%s'. Or the data file is missing?"%( \
                     short_buoy_name, "', '".join(buoys)))
@@ -190,9 +1011,10 @@ class Buoy:
 
         # Specify the data file, or use the default.
         if data_file == None:
-            self.data_file = os.path.join(data_dir, "%s.dat"%(short_buoy_name))
+            self.source_file = get_data_filename(data_dir, short_buoy_name) or os.path.join(data_dir, "%s.dat"%(short_buoy_name))
         else:
-            self.data_file = data_file
+            self.source_file = data_file
+        self.decompressed_dir = decompressed_dir
 
         # Specify data header file, or use the default for that name.
         if data_header_file == None:
@@ -201,7 +1023,7 @@ class Buoy:
             self.data_header_file = data_header_file
 
         # Make sure the files exist.
-        assert(os.path.isfile(self.data_file))
+        assert(os.path.isfile(self.source_file))
         assert(os.path.isfile(self.data_header_file))
 
         LOG.debug("Building header.")
@@ -217,12 +1039,27 @@ class Buoy:
 
         LOG.debug("Number of header elements: %i"%len(self.headers))
 
+        # Where the last read_new stopped. See read_new.
+        self.tail_state = None
+
+        # The dates of the rows, with the stamp of the data file. See get_date_index.
+        self.date_index = None
+
     def __enter__(self):
         return self
 
     def __exit__(self, type, value, traceback):
         pass
 
+    @property
+    def data_file(self):
+        """
+        The data file to read: The source file, or the decompressed copy of it, if it is compressed.
+        """
+        if get_compression(self.source_file) == None:
+            return self.source_file
+        return get_decompressed_file(self.source_file, self.decompressed_dir)
+
     def has_variables(self, required_variables):
         """
         Makes sure that the variables in the "required_variables"
@@ -233,6 +1070,14 @@ class Buoy:
 
         LOG.debug("Required variables: %s"%(required_variables))
         for required_variable in required_variables:
+            # An aggregated variable, e.g. "WT:3:mean", needs the variable, "WT:3".
+            try:
+                aggregation = parse_aggregation(required_variable)
+            except BuoyException, e:
+                LOG.warning(e)
+                return False
+            if aggregation != None:
+                required_variable = aggregation[0]
             LOG.debug("Checking variable if '%s' is in '%s'"%(required_variable, "', '".join(self.get_header_strings())))
             if required_variable not in self.get_header_strings():
                 LOG.warning("The buoy, '%s', must have the variable (filter) '%s'."%(self.name, required_variable))
@@ -249,12 +1094,16 @@ class Buoy:
         header_strings.insert(0, "lon:")
         return header_strings
 
-    def data(self, date_from_including=None, date_to_excluding=None):
+    def data(self, date_from_including=None, date_to_excluding=None, predicates=None):
         """
         Getting the data for the specific buoy (self).
         A generator is created, yielding each line of the data. The data line
         is turned into a buoy object, which is what is being returned.
 
+        If predicates (predicatehelper.Predicate) are given, only the lines where the values
+        fulfil them are returned. The predicates are checked on the values in the line,
+        before the buoy object is made.
+
         If the data is outside the dates specified, it just moves on to the next line in the
         data file. It is possible to only specifiy date_from_including, or only
         date_to_excluding.
@@ -262,8 +1111,13 @@ class Buoy:
         Excluding is chosen to be able to do from the 1st in a month, to the 1st in another month,
         without knowing the number of days in the month.
         """
+        value_predicates = get_value_predicates(self.headers, predicates)
         with open(self.data_file) as fp:
             for line in fp:
+                # Skip the line if the values does not fulfil the predicates.
+                if value_predicates and not line_matches(line, value_predicates):
+                    continue
+
                 # Read in the data from the line.
                 b = BuoyDataElement(line, self.headers, self.lat, self.lon)
                 
@@ -280,6 +1134,116 @@ class Buoy:
                 # Return the buoy object.
                 yield b
 
+    def read_new(self):
+        """
+        Reads the lines that have been appended to the data file since the last call, as a BuoySeries.
+
+        The first time, the whole file is read. After that only the new lines are parsed. The
+        position (byte offset), the last date and a checksum of the beginning of the file are
+        kept in tail_state. If the file has become smaller, or the beginning of the file has
+        changed, the file has been rewritten, and the whole file is read again. A last line
+        without a newline is not read until it is complete.
+
+        The state can be saved (get_tail_state) and set again (set_tail_state), e.g. for the next run.
+        """
+        state = self.tail_state
+        with open(self.data_file, 'rb') as fp:
+            fp.seek(0, os.SEEK_END)
+            size = fp.tell()
+
+            if state != None:
+                fp.seek(0)
+                head = fp.read(state["head_size"])
+                if size < state["offset"] or hashlib.md5(head).hexdigest() != state["head_checksum"]:
+                    LOG.info("The data file '%s' has been truncated or rewritten. Reading the whole file."%(self.data_file))
+                    state = None
+
+            offset = 0 if state == None else state["offset"]
+            fp.seek(offset)
+            content = fp.read(size - offset)
+
+            # Only the complete lines.
+            content = content[:content.rfind("\n") + 1]
+            offset += len(content)
+
+            # The checksum of the beginning of the file.
+            head_size = min(offset, HEAD_CHECKSUM_SIZE)
+            fp.seek(0)
+            head_checksum = hashlib.md5(fp.read(head_size)).hexdigest()
+
+        dates, values = parse_lines(content.split("\n"), len(self.headers))
+        last_date = state["last_date"] if state != None else None
+        if len(dates) > 0:
+            last_date = datetimehelper.format_dates(dates[-1:])[0]
+
+        self.tail_state = {"offset": offset, "head_size": head_size, "head_checksum": head_checksum, "last_date": last_date}
+        LOG.debug("Read %i new lines from '%s'."%(len(dates), self.data_file))
+        return BuoySeries(dates, values, self.headers, self.lat, self.lon)
+
+    def get_tail_state(self):
+        """
+        The state of read_new: the byte offset, the checksum of the beginning of the
+        file and the last date read. None if nothing has been read.
+        """
+        return self.tail_state
+
+    def set_tail_state(self, state):
+        """
+        Sets the state of read_new, e.g. from a previous run (get_tail_state).
+        """
+        self.tail_state = state
+
+    def series(self, date_from_including=None, date_to_excluding=None, predicates=None):
+        """
+        Getting the data for the specific buoy (self), as columns (BuoySeries).
+
+        The whole data file is parsed at once (see read_data_file), and the rows
+        outside the dates are removed with a mask. See data for the dates and the predicates.
+        """
+        dates, values = read_data_file_window((self.data_file, len(self.headers), date_from_including, date_to_excluding,
+                                               get_value_predicates(self.headers, predicates)))
+        return BuoySeries(dates, values, self.headers, self.lat, self.lon)
+
+    def aggregate(self, statistic, bin_edges, centers=None, hours=None, predicates=None):
+        """
+        The data for the buoy (self) aggregated with the statistic in the bins of time,
+        e.g. the daily means. See BuoySeries.aggregate.
+        """
+        return self.series(bin_edges[0], bin_edges[-1], predicates).aggregate(statistic, bin_edges, centers, hours)
+
+    def get_date_index(self):
+        """
+        The dates (datetime64, sorted) of the rows in the data file, see read_dates.
+        They are read again only if the data file has changed.
+        """
+        stamps = get_file_stamps(self.data_file)
+        if self.date_index == None or self.date_index[0] != stamps:
+            self.date_index = (stamps, read_dates(self.data_file))
+        return self.date_index[1]
+
+    def chunks(self, chunk_size=DEFAULT_CHUNK_SIZE, date_from_including=None, date_to_excluding=None, order=None, predicates=None):
+        """
+        Yields the data for the buoy (self) as series (BuoySeries) of at most chunk_size
+        rows, so that only one chunk is in memory at a time, whatever the size of the file.
+        See iterate_data_file.
+
+        Only the rows inside the dates are yielded, and chunks without such rows are skipped.
+        If order (filter elements, e.g. ["date:", "WT:3"]) is given, only the header
+        columns needed for them are read, and the series only have those headers.
+        See data for the predicates.
+        """
+        column_indexes = None
+        headers = self.headers
+        if order != None:
+            column_indexes = get_header_indexes(self.headers, order)
+            headers = [self.headers[i] for i in column_indexes]
+
+        value_predicates = get_value_predicates(self.headers, predicates)
+        for dates, values in iterate_data_file(self.data_file, len(self.headers), chunk_size, column_indexes, value_predicates):
+            chunk = BuoySeries(dates, values, headers, self.lat, self.lon).window(date_from_including, date_to_excluding)
+            if len(chunk) > 0:
+                yield chunk
+
     @staticmethod
     def short_name_2_lat_lon(short_name):
         """
@@ -314,3 +1278,282 @@ class Buoy:
                 'arko':        (54.0 + 53/60.0,  13 + 52/60.0),
                 'arko.datneu': (54.0 + 53/60.0,  13 + 52/60.0),
                 }[short_name]
+
+
+def read_series(buoys, date_from_including=None, date_to_excluding=None, processes=None, predicates=None):
+    """
+    The series (Buoy.series) for each of the buoys, in the same order as the buoys.
+
+    The data files are parsed in parallel by a pool of processes (processes=None
+    means one for each core). The processes send back the dates and values as arrays,
+    which are cheap to transfer, and the series are put together here. With one
+    process, or one buoy, the files are parsed here, one by one.
+    """
+    arguments = [(b.data_file, len(b.headers), date_from_including, date_to_excluding, get_value_predicates(b.headers, predicates)) for b in buoys]
+    if processes == 1 or len(buoys) < 2:
+        results = map(read_data_file_window, arguments)
+    else:
+        # Only imported here, as it is not needed to e.g. print the buoy names.
+        import multiprocessing
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(read_data_file_window, arguments, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    return [BuoySeries(dates, values, b.headers, b.lat, b.lon) for b, (dates, values) in zip(buoys, results)]
+
+def get_first_and_last_line(filename, block_size=4096):
+    """
+    Gets the first and the last (non empty) line in a file, without reading the whole file.
+    None is returned for both lines if the file is empty.
+    """
+    with open(filename, 'rb') as fp:
+        first_line = fp.readline()
+        while first_line != "" and first_line.strip() == "":
+            first_line = fp.readline()
+        if first_line == "":
+            return None, None
+
+        # Read backwards from the end, until a whole line has been read.
+        fp.seek(0, os.SEEK_END)
+        position = fp.tell()
+        tail = ""
+        while position > 0:
+            read_size = min(block_size, position)
+            position -= read_size
+            fp.seek(position)
+            tail = fp.read(read_size) + tail
+            lines = tail.strip().split("\n")
+            if len(lines) > 1 or position == 0:
+                return first_line.strip(), lines[-1].strip()
+    return first_line.strip(), first_line.strip()
+
+def count_lines(filename, block_size=1024*1024):
+    """
+    Counts the lines in a file, by counting the newlines block by block.
+    A last line without a newline is also counted.
+    """
+    number_of_lines = 0
+    last_block = ""
+    with open(filename, 'rb') as fp:
+        while True:
+            block = fp.read(block_size)
+            if not block:
+                break
+            number_of_lines += block.count("\n")
+            last_block = block
+    if last_block != "" and not last_block.endswith("\n"):
+        number_of_lines += 1
+    return number_of_lines
+
+
+class BuoyRegistryElement(object):
+    def __init__(self, short_name, name, lat, lon, headers, first_date, last_date, number_of_rows, data_file, data_header_file, file_stamps):
+        """
+        What is known about a buoy, without parsing its data file.
+
+        The headers are a list of BuoyHeaderElements. The first and last
+        dates are datetime objects (None if there are no data). The file
+        stamps, (size, mtime) for the data file and the header file, are used
+        to find out if the files have changed since the element was made.
+        """
+        self.short_name = short_name
+        self.name = name
+        self.lat = lat
+        self.lon = lon
+        self.headers = headers
+        self.first_date = first_date
+        self.last_date = last_date
+        self.number_of_rows = number_of_rows
+        self.data_file = data_file
+        self.data_header_file = data_header_file
+        self.file_stamps = file_stamps
+
+    def covers(self, date_from_including, date_to_excluding=None):
+        """
+        Is there data (between first and last date) for the date, or for some of the period?
+        """
+        if self.first_date == None:
+            return False
+        if date_to_excluding == None:
+            return self.first_date <= date_from_including <= self.last_date
+        return self.first_date < date_to_excluding and date_from_including <= self.last_date
+
+    def to_dict(self):
+        return {"short_name": self.short_name,
+                "name": self.name,
+                "lat": self.lat,
+                "lon": self.lon,
+                "headers": ["%s %s"%(header.value, header.type) for header in self.headers],
+                "first_date": None if self.first_date == None else self.first_date.strftime(datetimehelper.DEFAULT_DATE_FORMAT_MIN),
+                "last_date": None if self.last_date == None else self.last_date.strftime(datetimehelper.DEFAULT_DATE_FORMAT_MIN),
+                "number_of_rows": self.number_of_rows,
+                "data_file": self.data_file,
+                "data_header_file": self.data_header_file,
+                "file_stamps": self.file_stamps}
+
+    @staticmethod
+    def from_dict(d):
+        def date(date_string):
+            if date_string == None:
+                return None
+            return datetime.datetime.strptime(date_string, datetimehelper.DEFAULT_DATE_FORMAT_MIN)
+        return BuoyRegistryElement(str(d["short_name"]), str(d["name"]), d["lat"], d["lon"],
+                                   [BuoyHeaderElement(str(header)) for header in d["headers"]],
+                                   date(d["first_date"]), date(d["last_date"]), d["number_of_rows"],
+                                   str(d["data_file"]), str(d["data_header_file"]), d["file_stamps"])
+
+
+def get_file_stamps(*filenames):
+    """
+    The (size, mtime) for each of the files.
+    """
+    stamps = []
+    for filename in filenames:
+        stat = os.stat(filename)
+        stamps.append([stat.st_size, stat.st_mtime])
+    return stamps
+
+# The version of the registry cache file. A cache file with another version is made again.
+REGISTRY_VERSION = 2
+
+class BuoyRegistry(object):
+    def __init__(self, data_dir=None, cache_filename=None):
+        """
+        The buoys in a data dir, found once.
+
+        For each buoy the registry knows the name, the position, the headers,
+        the first and last date and the number of rows (BuoyRegistryElement),
+        without parsing the whole data file. The elements and the Buoy objects are
+        made when they are needed (get_element, get), and reused, so only the buoys
+        used are read (or decompressed).
+
+        If cache_filename is given, the elements are saved to that file (see save), and
+        read from it the next time. An element from the file is only used if the
+        data file and the header file have not changed.
+        """
+        if data_dir == None:
+            data_dir = DEFAULT_DATA_DIR
+        self.data_dir = data_dir
+        self.cache_filename = cache_filename
+        self.buoy_names = get_buoy_names(data_dir)
+        self.buoys = {}
+
+        # The elements from the cache file, not checked yet, by short name.
+        self.cached_elements = {}
+        if cache_filename != None and os.path.isfile(cache_filename):
+            LOG.debug("Reading buoy registry from '%s'."%(cache_filename))
+            try:
+                with open(cache_filename) as fp:
+                    cache = json.load(fp)
+                if cache.get("version") != REGISTRY_VERSION:
+                    raise ValueError("version %s, not %s"%(cache.get("version"), REGISTRY_VERSION))
+                for d in cache["buoys"]:
+                    element = BuoyRegistryElement.from_dict(d)
+                    self.cached_elements[element.short_name] = element
+            except (ValueError, KeyError), e:
+                LOG.warning("Could not read the buoy registry from '%s': %s"%(cache_filename, e))
+
+        # The elements checked (or made), by short name. See get_element.
+        self.elements = {}
+        # True if an element has been made since the cache file was read or saved.
+        self.dirty = False
+
+    def build_element(self, short_name):
+        """
+        Makes the element for a buoy, from the header file and the dates of the data file.
+        The dates are sorted (see Buoy.get_date_index), so the first and last date are right
+        even if the lines of the data file are not in time order.
+        The element has the source file (e.g. a compressed data file), which is checked for changes.
+        """
+        LOG.debug("Building registry element for '%s'."%(short_name))
+        b = self.get(short_name)
+        dates = b.get_date_index()
+        first_date = None
+        last_date = None
+        if len(dates) > 0:
+            first_date, last_date = datetimehelper.datetime64_2_dates(dates[[0, -1]])
+        return BuoyRegistryElement(short_name, b.name, b.lat, b.lon, b.headers, first_date, last_date,
+                                   len(dates), b.source_file, b.data_header_file,
+                                   get_file_stamps(b.source_file, b.data_header_file))
+
+    def save(self, cache_filename=None):
+        """
+        Saves the elements to the file, the cache file if not given. Nothing is saved
+        to the cache file if no element has been made since it was read (or saved).
+
+        The file is written to a temporary file, and then renamed, so a run that is
+        stopped, or another run reading the file, never sees half a file.
+        """
+        if cache_filename == None:
+            if self.cache_filename == None or not self.dirty:
+                return
+            cache_filename = self.cache_filename
+        LOG.debug("Saving buoy registry to '%s'."%(cache_filename))
+        # The elements not used in this run are kept as they were.
+        elements = dict([(short_name, element) for short_name, element in self.cached_elements.iteritems() if short_name in self.buoy_names])
+        elements.update(self.elements)
+        temporary_filename = "%s.%i.tmp"%(cache_filename, os.getpid())
+        with open(temporary_filename, 'w') as fp:
+            json.dump({"version": REGISTRY_VERSION,
+                       "data_dir": os.path.abspath(self.data_dir),
+                       "buoys": [elements[short_name].to_dict() for short_name in sorted(elements)]},
+                      fp, indent=1)
+        os.rename(temporary_filename, cache_filename)
+        if cache_filename == self.cache_filename:
+            self.dirty = False
+
+    def get_buoy_names(self):
+        """
+        The short names of the buoys, as get_buoy_names.
+        """
+        return self.buoy_names
+
+    def get_element(self, short_name):
+        """
+        The element for the short name. The element from the cache file is used if the
+        files have not changed, otherwise it is made (build_element). The cache file is not
+        saved here, but once, when save is called (e.g. at the end of a script).
+        """
+        if short_name not in self.buoy_names:
+            raise BuoyException("The input name of the buoy, %s, must be one of '%s'. Or the data file is missing?"%( \
+                    short_name, "', '".join(self.buoy_names)))
+        if short_name not in self.elements:
+            element = self.cached_elements.get(short_name)
+            if element == None or not os.path.isfile(element.data_file) or not os.path.isfile(element.data_header_file) \
+                    or get_file_stamps(element.data_file, element.data_header_file) != element.file_stamps:
+                element = self.build_element(short_name)
+                self.dirty = True
+            self.elements[short_name] = element
+        return self.elements[short_name]
+
+    def get(self, short_name):
+        """
+        The Buoy object for the short name. It is made the first time, and then reused.
+        """
+        if short_name not in self.buoys:
+            self.buoys[short_name] = Buoy(short_name, self.data_dir, buoy_names=self.buoy_names)
+        return self.buoys[short_name]
+
+    def get_buoy_names_covering(self, date_from_including, date_to_excluding=None):
+        """
+        The short names of the buoys with data for the date, or for some of the period.
+        """
+        return set([short_name for short_name in self.buoy_names
+                    if self.get_element(short_name).covers(date_from_including, date_to_excluding)])
+
+# The registries made by get_registry, by data dir and cache file.
+_REGISTRIES = {}
+
+def get_registry(data_dir=None, cache_filename=None):
+    """
+    The registry for the data dir and the cache file. It is only made once for each of them.
+    """
+    if data_dir == None:
+        data_dir = DEFAULT_DATA_DIR
+    key = (os.path.abspath(data_dir), None if cache_filename == None else os.path.abspath(cache_filename))
+    if key not in _REGISTRIES:
+        _REGISTRIES[key] = BuoyRegistry(data_dir, cache_filename)
+    return _REGISTRIES[key]
+
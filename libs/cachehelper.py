@@ -0,0 +1,108 @@
+# coding: utf-8
+import logging
+import collections
+
+# Define the logger
+LOG = logging.getLogger(__name__)
+
+class LRUCache(object):
+    def __init__(self, max_size, sizeof=None, on_evict=None):
+        """
+        A cache that keeps the values used most recently.
+
+        The size of the cache is the sum of sizeof(value) for the values in it, or
+        the number of values if sizeof is None. When a value is put in the cache, the
+        least recently used values are evicted until the size is at most max_size.
+        on_evict(key, value) is called for each evicted value, e.g. to close a file.
+
+        The number of hits and misses (get) are counted.
+        """
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.on_evict = on_evict
+        self.values = collections.OrderedDict()
+        self.sizes = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.values)
+
+    def __contains__(self, key):
+        return key in self.values
+
+    def get(self, key, default=None):
+        """
+        The value for the key, or default if it is not in the cache.
+        The value becomes the most recently used.
+        """
+        if key not in self.values:
+            self.misses += 1
+            return default
+        self.hits += 1
+        value = self.values.pop(key)
+        self.values[key] = value
+        return value
+
+    def put(self, key, value):
+        """
+        Puts the value in the cache, and evicts the least recently used values if the cache is full.
+
+        A value larger than max_size is not kept (it is evicted at once).
+        """
+        if key in self.values:
+            self.remove(key)
+        size = self.sizeof(value) if self.sizeof != None else 1
+        self.values[key] = value
+        self.sizes[key] = size
+        self.size += size
+        while self.size > self.max_size and len(self.values) > 0:
+            self.evict(iter(self.values).next())
+
+    def get_or_put(self, key, create):
+        """
+        The value for the key. If it is not in the cache, it is made by create() and put in the cache.
+        """
+        if key in self.values:
+            return self.get(key)
+        self.misses += 1
+        value = create()
+        self.put(key, value)
+        return value
+
+    def remove(self, key):
+        """
+        Removes the value, without calling on_evict, and returns it.
+        """
+        value = self.values.pop(key)
+        self.size -= self.sizes.pop(key)
+        return value
+
+    def evict(self, key):
+        """
+        Removes the value and calls on_evict.
+        """
+        LOG.debug("Evicting '%s' from the cache."%(key,))
+        value = self.remove(key)
+        if self.on_evict != None:
+            self.on_evict(key, value)
+
+    def clear(self):
+        """
+        Evicts all the values.
+        """
+        while len(self.values) > 0:
+            self.evict(iter(self.values).next())
+
+    def hit_ratio(self):
+        """
+        The share of the gets that were hits, or None if there have been no gets.
+        """
+        if self.hits + self.misses == 0:
+            return None
+        return float(self.hits)/(self.hits + self.misses)
+
+    def statistics(self):
+        return {"size": self.size, "max_size": self.max_size, "length": len(self.values),
+                "hits": self.hits, "misses": self.misses, "hit_ratio": self.hit_ratio()}
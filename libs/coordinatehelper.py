@@ -1,8 +1,10 @@
 # coding: utf-8
-import numpy as np
+import math
+import lazyimport
+np = lazyimport.LazyModule("numpy")
 
 EARTH_MEAN_RADIUS_KM=6371
-EARTH_MEAN_DIAMETER_KM=2*np.pi*EARTH_MEAN_RADIUS_KM
+EARTH_MEAN_DIAMETER_KM=2*math.pi*EARTH_MEAN_RADIUS_KM
 EARTH_ONE_MEAN_DEG_KM=EARTH_MEAN_DIAMETER_KM/360.0
 
 def length_of_one_mean_degree_at_latitude_km(latitude):
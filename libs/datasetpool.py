@@ -0,0 +1,149 @@
+# coding: utf-8
+import logging
+import os
+import re
+import threading
+import lazyimport
+import cachehelper
+
+netCDF4 = lazyimport.LazyModule("netCDF4")
+
+# Define the logger
+LOG = logging.getLogger(__name__)
+
+# The default number of netCDF files kept open by a pool.
+DEFAULT_MAX_OPEN_FILES = 8
+
+# The pool used by the Satellite objects, when they are not given one. See get_default_pool.
+_DEFAULT_POOL = None
+
+def get_key(filename):
+    """
+    The key of the opened file, (path, mtime, size). A file that has been changed gets another key.
+    """
+    stat = os.stat(filename)
+    return (os.path.abspath(filename), stat.st_mtime, stat.st_size)
+
+def is_thread_safe():
+    """
+    True if the netCDF files can be opened and read in another thread while the main thread
+    reads a file. The netCDF (HDF5) library is not thread safe, but netCDF4-python before 1.6
+    holds the python GIL while calling it, so two calls are never run at the same time.
+    Later versions release the GIL.
+    """
+    version = re.match("(\d+)\.(\d+)", netCDF4.__version__)
+    return version != None and (int(version.group(1)), int(version.group(2))) < (1, 6)
+
+def open_dataset(filename):
+    LOG.debug("Opening '%s'."%(filename))
+    return netCDF4.Dataset(filename, 'r')
+
+def close_dataset(key, dataset):
+    LOG.debug("Closing '%s'."%(key[0]))
+    dataset.close()
+
+
+class DatasetPool(object):
+    def __init__(self, max_open_files=DEFAULT_MAX_OPEN_FILES, opener=open_dataset):
+        """
+        Open netCDF files (netCDF4.Dataset), reused when the same file is opened again,
+        so the file is not opened, and its metadata is not read, again.
+
+        A file is taken from the pool (acquire) and given back (release) when it is no
+        longer used. The files that are not used are kept open, and the least recently
+        used is closed when more than max_open_files files would be open. The files in
+        use are never closed by the pool. If more than max_open_files are in use, they
+        are all open, and closed when they are given back.
+
+        The files are found by path, mtime and size (get_key), so a file that has
+        been changed is opened again. The pool can be used from more than one thread.
+        """
+        self.max_open_files = max_open_files
+        self.opener = opener
+        self.lock = threading.RLock()
+        # The files not in use, by key.
+        self.idle = cachehelper.LRUCache(max(max_open_files, 0), on_evict=close_dataset)
+        # The keys of the files in use, by id of the dataset.
+        self.in_use = {}
+        self.number_of_opens = 0
+
+    def acquire(self, filename):
+        """
+        The open file. It must be given back with release.
+        """
+        key = get_key(filename)
+        with self.lock:
+            # The file has been changed since it was opened.
+            for idle_key in list(self.idle.values):
+                if idle_key[0] == key[0] and idle_key != key:
+                    self.idle.evict(idle_key)
+
+            dataset = self.idle.get(key)
+            if dataset is not None:
+                self.idle.remove(key)
+            else:
+                dataset = self.opener(filename)
+                self.number_of_opens += 1
+            self.in_use[id(dataset)] = key
+            self.trim()
+            return dataset
+
+    def release(self, dataset):
+        """
+        Gives the file back to the pool. It is kept open, unless there are too many open files.
+        """
+        with self.lock:
+            key = self.in_use.pop(id(dataset), None)
+            if key == None:
+                # Not from this pool (e.g. the pool has been cleared).
+                dataset.close()
+                return
+            if key in self.idle or self.max_open_files < 1:
+                # The same file was in use twice. Only one is kept.
+                close_dataset(key, dataset)
+                return
+            self.idle.put(key, dataset)
+            self.trim()
+
+    def trim(self):
+        """
+        Closes the least recently used files, which are not in use, until at most max_open_files are open.
+        """
+        while len(self.idle) > 0 and len(self.idle) + len(self.in_use) > self.max_open_files:
+            self.idle.evict(iter(self.idle.values).next())
+
+    def clear(self):
+        """
+        Closes the files that are not in use.
+        """
+        with self.lock:
+            self.idle.clear()
+
+    def statistics(self):
+        """
+        The number of open files (idle and in use), and the hits and misses of the files not in use.
+        """
+        with self.lock:
+            statistics = self.idle.statistics()
+            statistics.update({"max_open_files": self.max_open_files, "idle": len(self.idle),
+                               "in_use": len(self.in_use), "opens": self.number_of_opens})
+            return statistics
+
+def get_default_pool():
+    """
+    The pool shared by the Satellite objects in the process, with DEFAULT_MAX_OPEN_FILES files.
+    """
+    global _DEFAULT_POOL
+    if _DEFAULT_POOL == None:
+        _DEFAULT_POOL = DatasetPool()
+    return _DEFAULT_POOL
+
+def set_default_max_open_files(max_open_files):
+    """
+    Sets the number of files kept open by the default pool, e.g. from a command line option.
+    """
+    pool = get_default_pool()
+    with pool.lock:
+        pool.max_open_files = max_open_files
+        pool.idle.max_size = max(max_open_files, 0)
+        pool.trim()
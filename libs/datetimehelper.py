@@ -1,5 +1,8 @@
 # coding: utf-8
 import datetime
+import lazyimport
+
+np = lazyimport.LazyModule("numpy")
 
 SECONDS_IN_A_DAY = 24*60*60.0
 DEFAULT_JULIAN_DAY_EPOC = datetime.datetime(1950, 1, 1)
@@ -18,3 +21,101 @@ def julian2date(julian_day, epoc = DEFAULT_JULIAN_DAY_EPOC):
     """
     julian_seconds = julian_day * SECONDS_IN_A_DAY
     return epoc + datetime.timedelta(seconds=julian_seconds)
+
+def dates2julian(dates, epoc = DEFAULT_JULIAN_DAY_EPOC):
+    """
+    The same as date2julian, but for an array of dates (datetime64).
+
+    The values are exactly the same as the ones from date2julian. As in
+    date2julian, parts of a second are not included.
+    """
+    microseconds = (np.asarray(dates).astype("M8[us]") - np.datetime64(epoc, "us")).astype(np.int64)
+
+    # Like timedelta: The days are rounded down and the seconds are allways positive.
+    seconds = np.floor_divide(microseconds, 1000000)
+    days = np.floor_divide(seconds, 24*60*60)
+    seconds = seconds - days*24*60*60
+    return days.astype(np.float64) + seconds.astype(np.float64)/SECONDS_IN_A_DAY
+
+def julian2dates(julian_days, epoc = DEFAULT_JULIAN_DAY_EPOC):
+    """
+    The same as julian2date, but for an array of julian days. The dates are
+    returned as datetime64, with microseconds as the unit.
+    """
+    microseconds = np.round(np.asarray(julian_days, dtype=np.float64) * SECONDS_IN_A_DAY * 1e6).astype(np.int64)
+    return np.datetime64(epoc, "us") + microseconds.astype("m8[us]")
+
+def seconds2dates(seconds, epoc):
+    """
+    Seconds since epoc to dates (datetime64), e.g. for the time variable in the satellite files.
+    """
+    return np.datetime64(epoc, "s") + np.asarray(seconds).astype(np.int64).astype("m8[s]")
+
+def parse_dates(date_strings):
+    """
+    Parses an array of dates on the form DEFAULT_DATE_FORMAT_MIN, "%Y%m%d%H%M",
+    into an array of datetime64 (minutes).
+
+    All the dates are parsed at once, as numbers. As with strptime, a ValueError
+    is raised if one of the strings is not a valid date.
+    """
+    date_strings = np.asarray(date_strings)
+    if len(date_strings) == 0:
+        return np.array([], dtype="M8[m]")
+
+    if date_strings.dtype.kind in "SU" and (np.char.str_len(date_strings) != 12).any():
+        raise ValueError("The dates must match the format '%s'."%(DEFAULT_DATE_FORMAT_MIN))
+
+    return parse_date_numbers(date_strings.astype(np.int64))
+
+def parse_date_numbers(numbers):
+    """
+    Converts numbers on the form YYYYmmddHHMM, e.g. 201501011200, into an array of datetime64 (minutes).
+    """
+    numbers = np.asarray(numbers, dtype=np.int64)
+    years = numbers // 100000000
+    months = numbers // 1000000 % 100
+    days = numbers // 10000 % 100
+    hours = numbers // 100 % 100
+    minutes = numbers % 100
+
+    first_in_month = ((years - 1970)*12 + months - 1).astype("M8[M]")
+    dates = first_in_month.astype("M8[D]") + (days - 1).astype("m8[D]")
+
+    # The day must be in the month.
+    if ((months < 1) | (months > 12) | (days < 1) | (dates.astype("M8[M]") != first_in_month) | (hours > 23) | (minutes > 59)).any():
+        raise ValueError("The dates must be valid dates on the format '%s'."%(DEFAULT_DATE_FORMAT_MIN))
+
+    return dates.astype("M8[m]") + (hours*60 + minutes).astype("m8[m]")
+
+def format_dates(dates, date_format = DEFAULT_DATE_FORMAT_MIN):
+    """
+    Formats an array of dates (datetime64). The default format is done
+    on the whole array at once. Other formats use strftime on each date.
+    """
+    dates = np.asarray(dates)
+    if date_format == DEFAULT_DATE_FORMAT_MIN:
+        date_strings = np.datetime_as_string(dates.astype("M8[m]"), unit="m")
+        for c in "-T:":
+            date_strings = np.char.replace(date_strings, c, "")
+        return date_strings.astype(str)
+    return np.array([date.strftime(date_format) for date in datetime64_2_dates(dates)])
+
+def datetime64_2_dates(dates):
+    """
+    Converts an array of datetime64 to a list of datetime objects.
+    """
+    return np.asarray(dates).astype("M8[us]").astype(datetime.datetime).tolist()
+
+def get_window_mask(dates, date_from_including=None, date_to_excluding=None):
+    """
+    A mask (array of bools) that is True for the dates (datetime64) inside the window.
+    It is possible to only specify date_from_including, or only date_to_excluding.
+    """
+    dates = np.asarray(dates)
+    mask = np.ones(len(dates), dtype=bool)
+    if date_from_including != None:
+        mask &= dates >= np.datetime64(date_from_including, "us")
+    if date_to_excluding != None:
+        mask &= dates < np.datetime64(date_to_excluding, "us")
+    return mask
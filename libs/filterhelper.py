@@ -1,4 +1,9 @@
 # coding: utf-8
+import lazyimport
+import datetimehelper
+
+np = lazyimport.LazyModule("numpy")
+
 def format(value):
     try:
         return "%8.3f"%(float(value))
@@ -7,3 +12,84 @@ def format(value):
             return "%8i"%(int(value))
         except:
             return "%8s"%str(value)
+
+def get_column_format(column):
+    """
+    Gets the format for a whole column of values, and the values converted for that format.
+
+    The values are converted the same way as in format. If all the values
+    can be converted to floats, "%8.3f" is used for all of them. Else each
+    value is formatted by itself with format, and "%s" is used for the
+    formatted strings.
+    """
+    # Numeric (masked) arrays are converted in one go. Masked values becomes nan,
+    # as they do with float(numpy.ma.masked).
+    if isinstance(column, np.ndarray) and column.dtype.kind in "fiub":
+        if isinstance(column, np.ma.MaskedArray):
+            column = column.astype(np.float64).filled(np.nan)
+        return "%8.3f", column.astype(np.float64).tolist()
+
+    try:
+        return "%8.3f", [float(value) for value in column]
+    except:
+        # Not all the values are floats.
+        return "%s", [format(value) for value in column]
+
+def format_block(columns, kinds=None, separator=" "):
+    """
+    Formats a block of values, given as columns, into lines of text.
+
+    Each column is a list (or array) of values, and all the columns must have
+    the same length. The result is the same as formatting each value with
+    format and joining the values in each row with the separator, but
+    every row is formatted at once.
+
+    The kinds are the types of the columns, one for each column:
+    - "f": floats, "%8.3f".
+    - "i": ints, "%8i".
+    - "s": strings, "%8s".
+    - "j": dates, converted to julian days, "%8.3f".
+    - None: the format is found from the values (see get_column_format).
+
+    The lines are returned as one string, separated by newlines. There are no
+    newline after the last line.
+    """
+    columns = list(columns)
+    if len(columns) == 0:
+        return ""
+
+    if kinds == None:
+        kinds = [None for column in columns]
+
+    if len(kinds) != len(columns):
+        raise ValueError("The number of kinds, %i, does not match the number of columns, %i."%(len(kinds), len(columns)))
+
+    formats = []
+    converted_columns = []
+    for column, kind in zip(columns, kinds):
+        if kind == "f":
+            column_format, values = "%8.3f", [float(value) for value in column]
+        elif kind == "i":
+            column_format, values = "%8i", [int(value) for value in column]
+        elif kind == "s":
+            column_format, values = "%8s", [str(value) for value in column]
+        elif kind == "j":
+            column_format, values = "%8.3f", [datetimehelper.date2julian(value) for value in column]
+        elif kind == None:
+            column_format, values = get_column_format(column)
+        else:
+            raise ValueError("Unknown column kind '%s'."%(kind))
+        formats.append(column_format)
+        converted_columns.append(values)
+
+    number_of_rows = len(converted_columns[0])
+    if number_of_rows == 0:
+        return ""
+
+    # The format for a whole row, and for all the rows.
+    row_format = separator.replace("%", "%%").join(formats)
+    block_format = "\n".join([row_format]*number_of_rows)
+
+    # The values, row by row.
+    values = [value for row in zip(*converted_columns) for value in row]
+    return block_format%tuple(values)
@@ -0,0 +1,28 @@
+# coding: utf-8
+import importlib
+
+class LazyModule(object):
+    def __init__(self, name):
+        """
+        A module that is imported the first time one of its attributes is used.
+
+        Used for the large modules (numpy, netCDF4), so that the scripts start fast
+        when they do not need them, e.g. when only printing the buoy names:
+
+            np = lazyimport.LazyModule("numpy")
+        """
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def _load(self):
+        if self._module is None:
+            self.__dict__["_module"] = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __repr__(self):
+        if self._module is None:
+            return "<lazy module '%s' (not imported)>"%(self._name)
+        return repr(self._module)
@@ -0,0 +1,414 @@
+# coding: utf-8
+import logging
+import datetime
+import re
+import sqlite3
+import lazyimport
+import datetimehelper
+import buoy
+
+np = lazyimport.LazyModule("numpy")
+
+# Define the logger
+LOG = logging.getLogger(__name__)
+
+# The buoy data is valid 12 hours before and 12 hours after the satellite date.
+DEFAULT_WINDOW = datetime.timedelta(hours=12)
+
+# The output formats that can be written.
+OUTPUT_FORMATS = ["asc", "npz", "sqlite"]
+
+# The format of the dates in the SQLite database.
+SQLITE_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+class MatchupException(Exception):
+    pass
+
+def get_depth(filters):
+    """
+    Gets the depth from the filter elements, e.g. "b:WT:3" (or "b:WT:3:mean") gives "3".
+
+    The depth is the value of the first buoy "WT" filter element.
+    None is returned if there are no such element.
+    """
+    for f in filters:
+        parts = f.split(":")
+        if len(parts) >= 3 and parts[0] == "b" and parts[1] == "WT":
+            return parts[2]
+    return None
+
+def get_satellite_variable_names(filters):
+    """
+    Gets the names of the satellite variables in the filter elements,
+    e.g. "s:time:julian" gives "time". "lat" and "lon" are allways included.
+    """
+    variable_names = ["lat", "lon"]
+    for f in filters:
+        if f.startswith("s:"):
+            variable_name = f.split(":")[1]
+            if variable_name not in variable_names:
+                variable_names.append(variable_name)
+    return variable_names
+
+def get_aggregated_orders(filters):
+    """
+    The aggregated buoy filter elements, e.g. "b:WT:3:mean" gives "WT:3:mean". See buoy.parse_aggregation.
+    """
+    return [f.split(":", 1)[1] for f in filters if f.startswith("b:") and buoy.parse_aggregation(f.split(":", 1)[1]) != None]
+
+def is_aggregated(filters):
+    """
+    True if there are aggregated buoy filter elements, and the other buoy elements are the
+    date, lat or lon. The matchups are then one row for each satellite date, e.g. the daily means.
+    """
+    if len(get_aggregated_orders(filters)) == 0:
+        return False
+    for f in filters:
+        if f.startswith("b:") and buoy.parse_aggregation(f.split(":", 1)[1]) == None \
+                and f.split(":")[1] not in ("date", "lat", "lon"):
+            return False
+    return True
+
+def aggregate_series(filters, buoy_series, center=None):
+    """
+    The buoy series (BuoySeries) with the aggregated filter elements, e.g. "b:WT:3:mean",
+    over all its rows, which must be all the rows in the window of the satellite date.
+    center is the satellite date. See BuoySeries.with_aggregates.
+
+    If is_aggregated, only the row nearest to the center is kept, so the aggregates are
+    written once for the satellite date, with the date of that row. Otherwise, the
+    aggregates are written in every row.
+    """
+    orders = get_aggregated_orders(filters)
+    if len(orders) == 0 or len(buoy_series) == 0:
+        return buoy_series
+    buoy_series = buoy_series.with_aggregates(orders, center)
+    if is_aggregated(filters):
+        row = 0
+        if center != None:
+            row = np.abs((buoy_series.dates.astype("M8[us]") - np.datetime64(center, "us")).astype(np.float64)).argmin()
+        buoy_series = buoy_series.select(slice(row, row + 1))
+    return buoy_series
+
+def check_columns(columns, filters, buoy_dates):
+    """
+    Makes sure that there are one column for each filter element,
+    and one value in each column for each buoy date.
+    """
+    if len(columns) != len(filters):
+        raise MatchupException("The number of columns, %i, does not match the number of filter elements, %i."%(len(columns), len(filters)))
+    for column in columns:
+        if len(column) != len(buoy_dates):
+            raise MatchupException("The number of values, %i, does not match the number of buoy dates, %i."%(len(column), len(buoy_dates)))
+
+def get_writer(output_format, output_filename, filters, buoy_name):
+    """
+    Creates the writer for the output format. None is returned for
+    the text output (asc), which is written as it is formatted.
+    """
+    if output_format == "npz":
+        return NpzWriter(output_filename, filters, buoy_name, get_depth(filters))
+    if output_format == "sqlite":
+        return SqliteWriter(output_filename, filters, buoy_name, get_depth(filters))
+    return None
+
+def to_column(values):
+    """
+    Converts a list of values into a typed numpy array.
+
+    The values are converted the same way as in filterhelper.format.
+    If all the values can be converted to floats, the column is
+    a float column. Else it is a string column.
+    """
+    try:
+        return np.array([float(value) for value in values], dtype=np.float64)
+    except (TypeError, ValueError):
+        return np.array([str(value) for value in values])
+
+def get_columns(filters, sat_data, buoy_series):
+    """
+    Gets the values for a block of matchups, as columns, one column for each filter element.
+
+    The satellite values are the same for all the rows, and the buoy values are
+    taken from the buoy series (BuoySeries). See get_values.
+    """
+    columns = []
+    for f in filters:
+        LOG.debug("FILTER: %s"%(f))
+        filter_type, filter_value = f.split(":", 1)
+        if filter_type == "s":
+            columns.append(sat_data.values(filter_value)*len(buoy_series))
+        elif filter_type == "b":
+            columns.append(buoy_series.column(filter_value))
+        elif filter_type == "dummy":
+            columns.append([filter_value]*len(buoy_series))
+    return columns
+
+def get_values(filters, sat_data, buoy_data):
+    """
+    Gets the values for one matchup row, one value for each filter element.
+
+    The filter elements starts with "s:" (satellite), "b:" (buoy)
+    or "dummy:" (the value itself).
+    """
+    values = []
+    for f in filters:
+        LOG.debug("FILTER: %s"%(f))
+        filter_type, filter_value = f.split(":", 1)
+        if filter_type == "s":
+            values.extend(sat_data.values(filter_value))
+        elif filter_type == "b":
+            values.extend(buoy_data.values(filter_value))
+        elif filter_type == "dummy":
+            values.append(filter_value)
+    return values
+
+def merge_join(buoy_chunks, satellite_dates, window=DEFAULT_WINDOW):
+    """
+    Assigns the buoy rows to the satellite dates, in one pass over the buoy data.
+
+    buoy_chunks are the buoy data as series (BuoySeries), e.g. from Buoy.chunks, with the
+    rows in time order. Each row is assigned to the satellite dates with the row inside
+    [satellite date - window, satellite date + window), as in the matchups.
+
+    The satellite windows are sorted, and both the rows and the windows are only passed
+    once, so the cost is O(rows + satellite dates). The rows for a window are found by
+    a binary search in the chunk.
+
+    Yields (satellite date, series) for each chunk and window with rows, in time order.
+    The rows for a satellite date can be yielded in more than one series.
+    """
+    satellite_dates = sorted(set(satellite_dates))
+    starts = np.array([satellite_date - window for satellite_date in satellite_dates], dtype="M8[us]")
+    ends = np.array([satellite_date + window for satellite_date in satellite_dates], dtype="M8[us]")
+
+    # The first window that can have rows in the next chunks.
+    first = 0
+    last_date = None
+    for chunk in buoy_chunks:
+        if len(chunk) == 0:
+            continue
+        dates = chunk.dates.astype("M8[us]")
+        if (dates[1:] < dates[:-1]).any() or (last_date != None and dates[0] < last_date):
+            raise MatchupException("The buoy rows must be in time order to be joined with the satellite dates.")
+        last_date = dates[-1]
+
+        # The windows that end before the chunk are done.
+        while first < len(satellite_dates) and ends[first] <= dates[0]:
+            first += 1
+
+        i = first
+        while i < len(satellite_dates) and starts[i] <= dates[-1]:
+            row_from, row_to = np.searchsorted(dates, [starts[i], ends[i]])
+            if row_to > row_from:
+                yield satellite_dates[i], chunk.select(slice(row_from, row_to))
+            i += 1
+
+def get_joined_series(buoy_chunks, satellite_dates, window=DEFAULT_WINDOW):
+    """
+    The buoy series for each satellite date, as a list of series (possibly empty) by
+    satellite date. See merge_join.
+    """
+    joined = dict([(satellite_date, []) for satellite_date in satellite_dates])
+    for satellite_date, series in merge_join(buoy_chunks, satellite_dates, window):
+        joined[satellite_date].append(series)
+    return joined
+
+
+class NpzWriter(object):
+    def __init__(self, output_filename, filters, buoy_name, depth=None, window=DEFAULT_WINDOW):
+        """
+        Writes the matchups into a numpy .npz file.
+
+        The rows are collected in memory and written in bulk when the writer
+        is closed. The file contains:
+        - matchups:     A structured array with one typed column per filter element.
+        - filters:      The filter elements, in the same order as the columns.
+        - sat_date:     The satellite date (julian) for each row.
+        - buoy_date:    The buoy date (julian) for each row.
+        - buoy, depth:  The buoy short name and the depth.
+        - window_hours: The valid time period, +/- hours, around the satellite date.
+        """
+        self.output_filename = output_filename
+        self.filters = list(filters)
+        self.buoy_name = buoy_name
+        self.depth = depth
+        self.window = window
+
+        # One list per filter element.
+        self.columns = [[] for f in self.filters]
+        self.sat_dates = []
+        self.buoy_dates = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        # Only write the file if everything went well.
+        if type == None:
+            self.close()
+
+    def write(self, columns, satellite_date, buoy_dates):
+        """
+        Appends a block of values, given as columns. The columns must be in the same order
+        as the filter elements. The buoy dates (datetime64) are the dates for each row.
+        """
+        check_columns(columns, self.filters, buoy_dates)
+        for column, values in zip(self.columns, columns):
+            column.extend(values)
+        self.sat_dates.extend([datetimehelper.date2julian(satellite_date)]*len(buoy_dates))
+        self.buoy_dates.extend(datetimehelper.dates2julian(buoy_dates))
+
+    def get_field_names(self):
+        """
+        The names of the columns in the structured array.
+
+        The field names are the filter elements. As the field names
+        must be unique, an index is appended to repeated elements,
+        e.g. "dummy:-99.0" and "dummy:-99.0:1".
+        """
+        field_names = []
+        for f in self.filters:
+            field_name = f
+            i = 1
+            while field_name in field_names:
+                field_name = "%s:%i"%(f, i)
+                i += 1
+            field_names.append(field_name)
+        return field_names
+
+    def close(self):
+        """
+        Writes all the rows to the output file.
+        """
+        LOG.debug("Writing %i rows to '%s'."%(len(self.sat_dates), self.output_filename))
+        columns = [to_column(column) for column in self.columns]
+        matchups = np.empty(len(self.sat_dates), dtype=[(field_name, column.dtype) for field_name, column in zip(self.get_field_names(), columns)])
+        for field_name, column in zip(matchups.dtype.names, columns):
+            matchups[field_name] = column
+
+        # np.savez appends .npz to the filename if it is not there. Using a file object keeps the name.
+        with open(self.output_filename, 'wb') as fp:
+            np.savez(fp,
+                     matchups=matchups,
+                     filters=np.array(self.filters),
+                     sat_date=np.array(self.sat_dates, dtype=np.float64),
+                     buoy_date=np.array(self.buoy_dates, dtype=np.float64),
+                     buoy=np.array(self.buoy_name),
+                     depth=np.array("" if self.depth == None else self.depth),
+                     window_hours=np.array(self.window.total_seconds()/3600.0))
+
+
+class SqliteWriter(object):
+    def __init__(self, output_filename, filters, buoy_name, depth=None):
+        """
+        Writes the matchups into a SQLite database.
+
+        The matchups are written to the "matchups" table. The key is (buoy, depth,
+        buoy_date, sat_date), and a row with the same key as an existing row updates
+        the columns written (see write). The dates are written as text, "YYYY-MM-DD HH:MM:SS", which can be used
+        with the SQLite date functions. Each filter element gets a column, with the
+        name from get_column_name, e.g. "b:WT:3" becomes "b_WT_3". Missing columns
+        are added to an existing table.
+
+        The database can then be queried, e.g.:
+        SELECT * FROM matchups WHERE buoy = 'arko' AND s_sea_ice_fraction > 0 AND sat_date LIKE '2013-%';
+        """
+        self.output_filename = output_filename
+        self.filters = list(filters)
+        self.buoy_name = buoy_name
+        self.depth = "" if depth == None else depth
+
+        # A repeated filter element gives the same column.
+        self.column_names = []
+        for f in self.filters:
+            column_name = get_column_name(f)
+            if column_name not in self.column_names:
+                self.column_names.append(column_name)
+
+        self.connection = sqlite3.connect(self.output_filename)
+        self.create_table()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def create_table(self):
+        """
+        Creates the table and the indexes, if they are not there, and adds the missing columns.
+        """
+        with self.connection:
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS matchups (
+                                           buoy TEXT NOT NULL,
+                                           depth TEXT NOT NULL,
+                                           buoy_date TEXT NOT NULL,
+                                           sat_date TEXT NOT NULL,
+                                           PRIMARY KEY (buoy, depth, buoy_date, sat_date))""")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS matchups_buoy ON matchups (buoy)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS matchups_buoy_date ON matchups (buoy_date)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS matchups_sat_date ON matchups (sat_date)")
+
+            existing_column_names = [row[1] for row in self.connection.execute("PRAGMA table_info(matchups)")]
+            for column_name in self.column_names:
+                if column_name not in existing_column_names:
+                    LOG.debug("Adding column '%s' to '%s'."%(column_name, self.output_filename))
+                    self.connection.execute('ALTER TABLE matchups ADD COLUMN "%s"'%(column_name))
+
+    def write(self, columns, satellite_date, buoy_dates):
+        """
+        Inserts a block of values, given as columns, in one transaction. The columns must be in
+        the same order as the filter elements. The buoy dates (datetime64) are the dates for each row.
+
+        A row with the same key as an existing row updates only the columns of the filter
+        elements, so the columns written by other runs (with other filters) are kept.
+        It is an UPDATE followed by an INSERT OR IGNORE, which works with all SQLite versions.
+        """
+        check_columns(columns, self.filters, buoy_dates)
+        key_names = ["buoy", "depth", "buoy_date", "sat_date"]
+        update_statement = 'UPDATE matchups SET %s WHERE %s'%(
+            ", ".join(['"%s" = ?'%(column_name) for column_name in self.column_names]),
+            " AND ".join(['"%s" = ?'%(key_name) for key_name in key_names]))
+        insert_statement = 'INSERT OR IGNORE INTO matchups (%s) VALUES (%s)'%(
+            ", ".join(['"%s"'%(column_name) for column_name in key_names + self.column_names]),
+            ", ".join(["?" for column_name in key_names + self.column_names]))
+
+        sat_date = satellite_date.strftime(SQLITE_DATE_FORMAT)
+        keys = []
+        rows = []
+        for values, buoy_date in zip(zip(*columns), datetimehelper.datetime64_2_dates(buoy_dates)):
+            row = dict(zip([get_column_name(f) for f in self.filters], [to_sqlite_value(value) for value in values]))
+            keys.append([self.buoy_name, self.depth, buoy_date.strftime(SQLITE_DATE_FORMAT), sat_date])
+            rows.append([row[column_name] for column_name in self.column_names])
+
+        with self.connection:
+            self.connection.executemany(update_statement, [row + key for key, row in zip(keys, rows)])
+            self.connection.executemany(insert_statement, [key + row for key, row in zip(keys, rows)])
+
+    def close(self):
+        if self.connection != None:
+            self.connection.close()
+            self.connection = None
+
+def get_column_name(filter_element):
+    """
+    The SQLite column name for a filter element.
+    Everything that is not a letter, a number or _ is replaced by _, e.g.
+    "b:WT:3" becomes "b_WT_3" and "s:time:julian" becomes "s_time_julian".
+    """
+    return re.sub("[^0-9a-zA-Z_]", "_", filter_element)
+
+def to_sqlite_value(value):
+    """
+    Converts a value to something that can be inserted into SQLite.
+    Numbers are inserted as floats, and missing (masked or nan) values as NULL.
+    Everything else is inserted as text.
+    """
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return str(value)
+    if np.isnan(value):
+        return None
+    return value
@@ -0,0 +1,189 @@
+# coding: utf-8
+import logging
+import contextlib
+import os
+import time
+
+# Define the logger
+LOG = logging.getLogger(__name__)
+
+# All the metric names start with this.
+PREFIX = "buoy_validation_"
+
+# The upper bounds (seconds) of the buckets of the histograms.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+# The metrics of the matchup runs, name: (type, help).
+METRICS = {"rows_written_total": ("counter", "The number of rows written, by buoy."),
+           "satellite_files_processed_total": ("counter", "The number of satellite files (or dates in the pixel store) processed."),
+           "satellite_files_quarantined_total": ("counter", "The number of satellite files quarantined, because they failed (see backfill_matchups.py)."),
+           "bytes_read_total": ("counter", "The number of bytes of the variables read from the satellite files, by dataset (satellite)."),
+           "buoy_file_bytes_total": ("counter", "The size of the buoy data files used, by buoy. Each file is counted once in a run, however many windows are read from it."),
+           "stage_duration_seconds": ("histogram", "The time spent in each stage of the run."),
+           "cache_hits_total": ("counter", "The number of lookups found in a cache, by cache."),
+           "cache_misses_total": ("counter", "The number of lookups not found in a cache, by cache."),
+           "cache_hit_ratio": ("gauge", "The share of the lookups found in a cache, by cache."),
+           "run_duration_seconds": ("gauge", "The duration of the run."),
+           "last_run_timestamp_seconds": ("gauge", "The time (unix) the run ended."),
+           "last_run_success": ("gauge", "1 if the run ended without errors, otherwise 0.")}
+
+class MetricsException(Exception):
+    pass
+
+def format_labels(labels):
+    """
+    The labels (tuple of (name, value)) as in the text format, e.g. '{buoy="arko"}'.
+    """
+    if len(labels) == 0:
+        return ""
+    return "{%s}"%(",".join(['%s="%s"'%(name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+                             for name, value in labels]))
+
+def format_value(value):
+    if isinstance(value, (int, long)):
+        return str(value)
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metrics(object):
+    def __init__(self, metrics=METRICS, prefix=PREFIX, buckets=DEFAULT_BUCKETS):
+        """
+        Counters, gauges and histograms, written in the Prometheus text format (write),
+        e.g. for the textfile collector of the node exporter.
+
+        metrics are the metrics that can be used, {name: (type, help)}, where type is
+        "counter", "gauge" or "histogram". The names are prefixed with prefix when written.
+        The histograms have the buckets (upper bounds).
+        """
+        self.metrics = metrics
+        self.prefix = prefix
+        self.buckets = tuple(sorted(buckets))
+        self.started = time.time()
+        # The values, {name: {labels: value}}. For the histograms, the value is
+        # [count in each bucket, sum, count].
+        self.values = {}
+
+    def get_values(self, name, metric_type):
+        if name not in self.metrics:
+            raise MetricsException("Unknown metric '%s'. Must be one of '%s'."%(name, "', '".join(sorted(self.metrics))))
+        if self.metrics[name][0] != metric_type:
+            raise MetricsException("The metric '%s' is a %s, not a %s."%(name, self.metrics[name][0], metric_type))
+        return self.values.setdefault(name, {})
+
+    def inc(self, name, value=1, **labels):
+        """
+        Adds value to the counter.
+        """
+        values = self.get_values(name, "counter")
+        key = tuple(sorted(labels.items()))
+        values[key] = values.get(key, 0) + value
+
+    def inc_once(self, name, value=1, **labels):
+        """
+        Adds value to the counter, only the first time for the labels, e.g. the size of a file used more than once.
+        """
+        if tuple(sorted(labels.items())) not in self.values.get(name, {}):
+            self.inc(name, value, **labels)
+
+    def set(self, name, value, **labels):
+        """
+        Sets the gauge.
+        """
+        self.get_values(name, "gauge")[tuple(sorted(labels.items()))] = value
+
+    def observe(self, name, value, **labels):
+        """
+        Adds the value to the histogram.
+        """
+        values = self.get_values(name, "histogram")
+        key = tuple(sorted(labels.items()))
+        if key not in values:
+            values[key] = [[0]*len(self.buckets), 0.0, 0]
+        histogram = values[key]
+        for i, bucket in enumerate(self.buckets):
+            if value <= bucket:
+                histogram[0][i] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, name, **labels):
+        """
+        Adds the time (seconds) spent in the with statement to the histogram.
+        """
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - started, **labels)
+
+    def time_iteration(self, iterable, name, **labels):
+        """
+        Iterates over the iterable, and adds the time spent getting each item to
+        the histogram, e.g. the time spent reading each chunk of a file.
+        """
+        iterator = iter(iterable)
+        while True:
+            started = time.time()
+            try:
+                item = iterator.next()
+            except StopIteration:
+                return
+            self.observe(name, time.time() - started, **labels)
+            yield item
+
+    def add_cache_statistics(self, cache_name, statistics):
+        """
+        Adds the hits and misses from the statistics of a cache (see cachehelper.LRUCache.statistics),
+        and updates the hit ratio.
+        """
+        self.inc("cache_hits_total", statistics["hits"], cache=cache_name)
+        self.inc("cache_misses_total", statistics["misses"], cache=cache_name)
+        key = (("cache", cache_name),)
+        hits = self.values["cache_hits_total"][key]
+        lookups = hits + self.values["cache_misses_total"][key]
+        if lookups > 0:
+            self.set("cache_hit_ratio", float(hits)/lookups, cache=cache_name)
+
+    def finish(self, success):
+        """
+        Sets the duration, the end time and the success of the run.
+        """
+        now = time.time()
+        self.set("run_duration_seconds", now - self.started)
+        self.set("last_run_timestamp_seconds", now)
+        self.set("last_run_success", 1 if success else 0)
+
+    def format(self):
+        """
+        The metrics in the Prometheus text format. Only the metrics with values are included.
+        """
+        lines = []
+        for name in sorted(self.values):
+            metric_type, help_text = self.metrics[name]
+            full_name = self.prefix + name
+            lines.append("# HELP %s %s"%(full_name, help_text.replace("\\", "\\\\").replace("\n", "\\n")))
+            lines.append("# TYPE %s %s"%(full_name, metric_type))
+            for labels, value in sorted(self.values[name].items()):
+                if metric_type != "histogram":
+                    lines.append("%s%s %s"%(full_name, format_labels(labels), format_value(value)))
+                    continue
+                bucket_counts, total, count = value
+                for bucket, bucket_count in zip(self.buckets + (float("inf"),), bucket_counts + [count,]):
+                    lines.append("%s_bucket%s %i"%(full_name, format_labels(labels + (("le", format_value(bucket)),)), bucket_count))
+                lines.append("%s_sum%s %s"%(full_name, format_labels(labels), format_value(total)))
+                lines.append("%s_count%s %i"%(full_name, format_labels(labels), count))
+        return "\n".join(lines) + "\n"
+
+    def write(self, filename):
+        """
+        Writes the metrics to the file. The file is written to a temporary file in the
+        same directory, and then renamed, so a collector never reads a part of it.
+        """
+        temporary_filename = "%s.%i.tmp"%(filename, os.getpid())
+        with open(temporary_filename, 'w') as fp:
+            fp.write(self.format())
+        os.rename(temporary_filename, filename)
+        LOG.debug("Wrote the metrics to '%s'."%(filename))
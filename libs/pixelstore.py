@@ -0,0 +1,285 @@
+# coding: utf-8
+import logging
+import collections
+import datetime
+import json
+import os
+import glob
+import lazyimport
+import satellite
+import datetimehelper
+
+np = lazyimport.LazyModule("numpy")
+ma = lazyimport.LazyModule("numpy.ma")
+
+# Define the logger
+LOG = logging.getLogger(__name__)
+
+# The satellite variables kept for each buoy. lat, lon and time are also kept.
+VARIABLES = ["analysed_sst", "analysed_sst_smooth", "sea_ice_fraction", "dist2ice", "analysis_error", "mask"]
+
+# One record for each satellite file and buoy.
+# - date:               The date of the satellite file (from the filename).
+# - time:               The time variable in the satellite file.
+# - buoy_lat, buoy_lon: The position of the buoy, when the values were found.
+# - lat, lon:           The center of the pixel closest to the buoy.
+# Missing values are written as nan.
+RECORD_FIELDS = ([("date", "<M8[s]"), ("time", "<M8[s]"),
+                  ("buoy_lat", "<f8"), ("buoy_lon", "<f8"),
+                  ("lat", "<f8"), ("lon", "<f8")] +
+                 [(variable_name, "<f8") for variable_name in VARIABLES])
+
+# The file with the records for a buoy, e.g. "arko.pixels".
+FILENAME_EXTENSION = ".pixels"
+
+# The file, in the store dir, with the version of the records and the names of the
+# satellite variables, in the order Satellite.data gives them (see PixelStore.data).
+INFO_FILENAME = "store.json"
+# The version of the records. A store with another version must be made again.
+VERSION = 2
+
+class PixelStoreException(Exception):
+    pass
+
+def get_record_dtype():
+    """
+    The numpy dtype of the records (RECORD_FIELDS). Made when it is used, so numpy is
+    not imported with the module.
+    """
+    return np.dtype(RECORD_FIELDS)
+
+def to_record_value(value):
+    """
+    Converts a value from a SatelliteDataPoint to a float. Missing (masked) values become nan.
+    """
+    if value is ma.masked or (isinstance(value, ma.MaskedArray) and value.mask.any()):
+        return np.nan
+    return float(value)
+
+def to_point_value(value):
+    """
+    Converts a float from a record back to a value in a SatelliteDataPoint. nan becomes masked.
+    """
+    if np.isnan(value):
+        return ma.masked
+    return float(value)
+
+
+class PixelStore(object):
+    def __init__(self, store_dir):
+        """
+        The satellite values at the buoy positions, one file for each buoy.
+
+        The values for a satellite file are appended to the file for each buoy when
+        the satellite file arrives (ingest). They can then be used in place of the
+        satellite file (data), without opening the netCDF file.
+
+        The file for a buoy is an array of records (RECORD_FIELDS), in the order they
+        were appended. If the values for a date are appended more than once, the last
+        ones are used.
+        """
+        self.store_dir = store_dir
+
+        # The records read from the files, with the size and the modification time of the files.
+        self.records = {}
+
+        # The version and the variable names of the store. None if nothing has been ingested.
+        self.info = None
+        info_filename = os.path.join(store_dir, INFO_FILENAME)
+        if os.path.isfile(info_filename):
+            with open(info_filename) as fp:
+                self.info = json.load(fp)
+        if (self.info == None and len(glob.glob(os.path.join(store_dir, "*%s"%(FILENAME_EXTENSION)))) > 0) \
+                or (self.info != None and self.info.get("version") != VERSION):
+            raise PixelStoreException("The pixel store '%s' was made by another version, with other records. Please run ingest_pixels.py again, with a new pixel store."%(store_dir))
+
+    def save_info(self, variable_names):
+        """
+        Saves the version and the variable names (in the order Satellite.data gives them).
+        The file is written to a temporary file, and then renamed.
+        """
+        self.info = {"version": VERSION, "variable_names": [str(variable_name) for variable_name in variable_names]}
+        info_filename = os.path.join(self.store_dir, INFO_FILENAME)
+        temporary_filename = "%s.%i.tmp"%(info_filename, os.getpid())
+        with open(temporary_filename, 'w') as fp:
+            json.dump(self.info, fp, indent=1)
+        os.rename(temporary_filename, info_filename)
+
+    def get_variable_names(self):
+        """
+        The satellite variable names, in the order Satellite.data gives them, when the first
+        values were ingested. They may include variables that are not kept (see get_missing_variable_names).
+        """
+        if self.info == None:
+            return ["lat", "lon", "time"] + VARIABLES
+        return [str(variable_name) for variable_name in self.info["variable_names"]]
+
+    def get_missing_variable_names(self):
+        """
+        The variables in the satellite files that are not kept in the store.
+        """
+        return [variable_name for variable_name in self.get_variable_names() if variable_name not in ["lat", "lon", "time"] + VARIABLES]
+
+    def get_filename(self, buoy_name):
+        return os.path.join(self.store_dir, "%s%s"%(buoy_name, FILENAME_EXTENSION))
+
+    def read(self, buoy_name):
+        """
+        The records for the buoy, sorted by date, with one record for each date.
+
+        The file is only read again if it has been changed. An incomplete record at the end
+        of the file (e.g. if the writing was stopped) is ignored.
+        """
+        filename = self.get_filename(buoy_name)
+        if not os.path.isfile(filename):
+            return np.zeros(0, dtype=get_record_dtype())
+
+        stat = os.stat(filename)
+        stamp = (stat.st_size, stat.st_mtime)
+        if buoy_name in self.records and self.records[buoy_name][0] == stamp:
+            return self.records[buoy_name][1]
+
+        LOG.debug("Reading the pixel store for '%s' from '%s'."%(buoy_name, filename))
+        record_dtype = get_record_dtype()
+        number_of_records = stat.st_size // record_dtype.itemsize
+        if stat.st_size % record_dtype.itemsize != 0:
+            LOG.warning("'%s' ends with an incomplete record, which is ignored."%(filename))
+        records = np.fromfile(filename, dtype=record_dtype, count=number_of_records)
+
+        # The last record for each date. The sort is stable, so the records for a date
+        # are in the order they were appended.
+        records = records[np.argsort(records["date"], kind="mergesort")]
+        if len(records) > 0:
+            last = np.append(records["date"][1:] != records["date"][:-1], True)
+            records = records[last]
+
+        self.records[buoy_name] = (stamp, records)
+        return records
+
+    def get_dates(self, buoy_name, date_from_including=None, date_to_excluding=None):
+        """
+        The dates (datetime) with values for the buoy.
+        """
+        dates = self.read(buoy_name)["date"]
+        return datetimehelper.datetime64_2_dates(dates[datetimehelper.get_window_mask(dates, date_from_including, date_to_excluding)])
+
+    def has_date(self, buoy_name, date):
+        dates = self.read(buoy_name)["date"]
+        i = np.searchsorted(dates, np.datetime64(date, "s"))
+        return i < len(dates) and dates[i] == np.datetime64(date, "s")
+
+    def append(self, buoy_name, date, buoy_lat, buoy_lon, data_point):
+        """
+        Appends the values in the data point (SatelliteDataPoint) for the satellite file with the date.
+        The record is written at once, so a reader sees all of it or nothing.
+        """
+        record = np.zeros(1, dtype=get_record_dtype())
+        record["date"] = np.datetime64(date, "s")
+        record["time"] = np.datetime64(data_point.data["time"], "s")
+        record["buoy_lat"] = buoy_lat
+        record["buoy_lon"] = buoy_lon
+        for name in ["lat", "lon"] + VARIABLES:
+            record[name] = to_record_value(data_point.data.get(name, ma.masked))
+
+        if not os.path.isdir(self.store_dir):
+            os.makedirs(self.store_dir)
+        if self.info == None:
+            self.save_info(data_point.data.keys())
+        with open(self.get_filename(buoy_name), 'ab') as fp:
+            fp.write(record.tostring())
+
+    def ingest(self, sat, buoys, overwrite=False):
+        """
+        Appends the values from the satellite file (Satellite) for each buoy (Buoy).
+
+        Buoys that already have values for the date of the file are skipped, unless
+        overwrite is set. Returns the short names of the buoys that got values.
+        """
+        date = sat.get_date()
+        ingested = []
+        for b in buoys:
+            if not overwrite and self.has_date(b.short_name, date):
+                LOG.debug("'%s' already has the values for %s."%(b.short_name, date))
+                continue
+            try:
+                data_point = sat.data(b.lat, b.lon)
+            except satellite.SatDataException, e:
+                LOG.warning("No values for '%s' in '%s': %s"%(b.short_name, sat.input_filename, e.message))
+                continue
+            self.append(b.short_name, date, b.lat, b.lon, data_point)
+            ingested.append(b.short_name)
+        return ingested
+
+    def data(self, buoy_name, date, lat, lon):
+        """
+        The values for the buoy and the satellite date, as a SatelliteDataPoint, as
+        Satellite.data would give them. None is returned if there are no values for the
+        date, or if the values were found for another position of the buoy.
+        """
+        records = self.read(buoy_name)
+        i = np.searchsorted(records["date"], np.datetime64(date, "s"))
+        if i == len(records) or records["date"][i] != np.datetime64(date, "s"):
+            return None
+
+        record = records[i]
+        if record["buoy_lat"] != lat or record["buoy_lon"] != lon:
+            LOG.warning("The values for '%s' (%s) were found for %s/%s, not %s/%s."%(buoy_name, date, record["buoy_lat"], record["buoy_lon"], lat, lon))
+            return None
+
+        # The values are in the same order as from Satellite.data, so the output without a filter is the same.
+        data_point = satellite.SatelliteDataPoint()
+        data_point.data = collections.OrderedDict()
+        for variable_name in self.get_variable_names():
+            if variable_name == "time":
+                data_point.append("time", datetimehelper.datetime64_2_dates(records["time"][i:i + 1])[0])
+            elif variable_name in ["lat", "lon"] + VARIABLES:
+                data_point.append(variable_name, to_point_value(record[variable_name]))
+        return data_point
+
+    def satellites(self, dates):
+        """
+        Yields a StoredSatellite for each date, to be used in place of the satellite files.
+        """
+        for date in dates:
+            yield StoredSatellite(self, date)
+
+
+class StoredSatellite(object):
+    def __init__(self, pixel_store, date):
+        """
+        The values in the pixel store for a satellite date. It can be used in place of
+        a Satellite, but the values are found for a buoy (data) and not for a lat/lon.
+        """
+        self.pixel_store = pixel_store
+        self.date = date
+        self.input_filename = "%s (%s)"%(pixel_store.store_dir, date.strftime(datetimehelper.DEFAULT_DATE_FORMAT_MIN))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        pass
+
+    def get_date(self):
+        return self.date
+
+    def get_variable_names(self):
+        return set(["lat", "lon", "time"] + VARIABLES)
+
+    def has_variables(self, required_variables):
+        if isinstance(required_variables, str):
+            required_variables = (required_variables,)
+        for required_variable in required_variables:
+            if required_variable not in self.get_variable_names():
+                LOG.warning("The pixel store, '%s', does not have the variable '%s'."%(self.pixel_store.store_dir, required_variable))
+                return False
+        return True
+
+    def data(self, b):
+        """
+        The values for the buoy (Buoy), or None if there are none. See PixelStore.data.
+        """
+        return self.pixel_store.data(b.short_name, self.date, b.lat, b.lon)
@@ -0,0 +1,107 @@
+# coding: utf-8
+import logging
+import operator
+import re
+import lazyimport
+
+np = lazyimport.LazyModule("numpy")
+
+# Define the logger
+LOG = logging.getLogger(__name__)
+
+# The comparison operators in a predicate. The longest first, as they are matched in that order.
+OPERATORS = [("<=", operator.le), (">=", operator.ge), ("==", operator.eq), ("!=", operator.ne),
+             ("<", operator.lt), (">", operator.gt)]
+OPERATOR_PATTERN = re.compile("(%s)"%("|".join([re.escape(o) for o, f in OPERATORS])))
+
+# The operator when the operands are swapped, e.g. "0 < WT:3" is "WT:3 > 0".
+SWAPPED_OPERATORS = {"<=": ">=", ">=": "<=", "==": "==", "!=": "!=", "<": ">", ">": "<"}
+
+class PredicateException(Exception):
+    pass
+
+def is_number(string):
+    try:
+        float(string)
+        return True
+    except ValueError:
+        return False
+
+
+class Predicate(object):
+    def __init__(self, column, comparisons=None, not_missing=False, missing_value=None):
+        """
+        A condition on the values in one column, e.g. "WT:3".
+
+        A value fulfils the predicate if all the comparisons, a list of (operator, value)
+        e.g. [(">", 0.0), ("<", 30.0)], are true for it. If not_missing is set, the value
+        must also not be missing: Not nan, and not missing_value (if given).
+        A missing value never fulfils a comparison.
+        """
+        self.column = column
+        self.comparisons = list(comparisons or [])
+        self.not_missing = not_missing
+        self.missing_value = missing_value
+
+    def mask(self, values):
+        """
+        An array of bools, True for the values (array of floats) that fulfil the predicate.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        mask = ~np.isnan(values)
+        if (self.not_missing or len(self.comparisons) > 0) and self.missing_value != None:
+            mask &= values != self.missing_value
+        # nan is never true in a comparison, and it is allready False in the mask.
+        with np.errstate(invalid="ignore"):
+            for operator_string, value in self.comparisons:
+                mask &= dict(OPERATORS)[operator_string](values, value)
+        return mask
+
+    def matches(self, value):
+        """
+        True if the value (float) fulfils the predicate.
+        """
+        return bool(self.mask([value])[0])
+
+    def __str__(self):
+        if self.not_missing and len(self.comparisons) == 0:
+            return "%s not missing"%(self.column)
+        return " and ".join(["%s %s %s"%(self.column, operator_string, value) for operator_string, value in self.comparisons])
+
+def parse_predicate(string, missing_value=None):
+    """
+    Parses a predicate, e.g.:
+    - "WT:3 not missing":  The value is not missing_value (or nan).
+    - "0 < WT:3 < 30":     The value is between 0 and 30 (and not missing).
+    - "WT:3 >= 4":         The value is at least 4 (and not missing).
+    The operators are <, <=, >, >=, == and !=. The column is the part that is not a number.
+    """
+    string = string.strip()
+    if string.endswith(" not missing"):
+        column = string[:-len(" not missing")].strip()
+        if column == "" or OPERATOR_PATTERN.search(column):
+            raise PredicateException("Invalid predicate: '%s'. Example: 'WT:3 not missing'."%(string))
+        return Predicate(column, not_missing=True, missing_value=missing_value)
+
+    # Operands and operators, e.g. ["0", "<", "WT:3", "<", "30"].
+    parts = [part.strip() for part in OPERATOR_PATTERN.split(string)]
+    if len(parts) < 3 or "" in parts:
+        raise PredicateException("Invalid predicate: '%s'. Examples: 'WT:3 not missing', '0 < WT:3 < 30'."%(string))
+    operands = parts[0::2]
+    operators = parts[1::2]
+
+    columns = [operand for operand in operands if not is_number(operand)]
+    if len(columns) != 1:
+        raise PredicateException("The predicate '%s' must have exactly one column (e.g. 'WT:3'), not %i."%(string, len(columns)))
+    column = columns[0]
+
+    # Each operator compares the operands on each side of it.
+    comparisons = []
+    for left, operator_string, right in zip(operands[:-1], operators, operands[1:]):
+        if left == column:
+            comparisons.append((operator_string, float(right)))
+        elif right == column:
+            comparisons.append((SWAPPED_OPERATORS[operator_string], float(left)))
+        else:
+            raise PredicateException("Each comparison in the predicate '%s' must be with the column '%s'."%(string, column))
+    return Predicate(column, comparisons, missing_value=missing_value)
@@ -0,0 +1,37 @@
+# coding: utf-8
+import logging
+import urllib
+import urllib2
+
+# Define the logger
+LOG = logging.getLogger(__name__)
+
+# The same as in queryservice. They are repeated here, so the client
+# does not have to import numpy and netCDF4.
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+class QueryClientException(Exception):
+    pass
+
+def query(query_name, parameters, host=DEFAULT_HOST, port=DEFAULT_PORT, output_format="text", timeout=None):
+    """
+    Sends a query to the service (see queryservice.QueryService) and returns the answer.
+
+    The parameters is a list of (name, value) tuples, where a name can be given more
+    than once, e.g. [("filter", "lat"), ("filter", "lon")]. The answer is text,
+    or json if output_format is "json".
+    """
+    parameters = [(name, value) for name, value in parameters if value != None] + [("format", output_format)]
+    url = "http://%s:%i/%s?%s"%(host, port, query_name, urllib.urlencode(parameters))
+    LOG.debug("Query: %s"%(url))
+    try:
+        response = urllib2.urlopen(url, timeout=timeout)
+    except urllib2.HTTPError, e:
+        raise QueryClientException(e.read().strip())
+    except urllib2.URLError, e:
+        raise QueryClientException("Could not connect to the query service on %s:%i (%s). Is it running (query_service.py)?"%(host, port, e.reason))
+    try:
+        return response.read()
+    finally:
+        response.close()
@@ -0,0 +1,417 @@
+# coding: utf-8
+import logging
+import datetime
+import time
+import os
+import bisect
+import json
+import urlparse
+import BaseHTTPServer
+import lazyimport
+import satellite
+import buoy
+import matchup
+import filterhelper
+import datetimehelper
+import cachehelper
+import datasetpool
+
+np = lazyimport.LazyModule("numpy")
+ma = lazyimport.LazyModule("numpy.ma")
+
+# Define the logger
+LOG = logging.getLogger(__name__)
+
+# The service only listens on the local machine.
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# The queries the service answers, e.g. http://127.0.0.1:8765/point?date=2015-03-10&lat=55.0&lon=11.0
+QUERIES = ["point", "buoy", "matchup", "status"]
+
+# The format of the dates in the query parameters.
+DATE_FORMAT = "%Y-%m-%d"
+
+# The default number of objects kept warm.
+DEFAULT_MAX_OPEN_FILES = 16
+DEFAULT_MAX_BUOY_SERIES = 64
+DEFAULT_MAX_POINTS = 4096
+
+# The satellite files are found again if the list of files is older than this (seconds).
+DEFAULT_CATALOG_MAX_AGE = 60
+
+class QueryException(Exception):
+    pass
+
+def get_parameter(parameters, name, parameter_type=str, default=None, required=False):
+    """
+    Gets a parameter from the parsed query string (urlparse.parse_qs). If the
+    parameter is given more than once, the last one is used.
+    """
+    if name not in parameters:
+        if required:
+            raise QueryException("The parameter '%s' must be given."%(name))
+        return default
+    value = parameters[name][-1]
+    try:
+        return parameter_type(value)
+    except ValueError:
+        raise QueryException("The parameter '%s' has an invalid value: '%s'."%(name, value))
+
+def get_filter(parameters):
+    """
+    The filter elements, given as "filter=lat&filter=lon". None is returned if there are no filter.
+    """
+    if "filter" not in parameters:
+        return None
+    return [f for f in parameters["filter"] if f != ""]
+
+def get_predicates(parameters):
+    """
+    The predicates for the buoy data, given as "where=WT:3 not missing". None is returned if there are none.
+    """
+    if "where" not in parameters:
+        return None
+    try:
+        return buoy.parse_predicates(parameters["where"])
+    except buoy.BuoyException, e:
+        raise QueryException(e.message)
+
+def date(date_string):
+    return datetime.datetime.strptime(date_string, DATE_FORMAT)
+
+def flag(value):
+    return value.lower() in ("1", "true", "yes", "")
+
+def get_dates(parameters):
+    """
+    The dates from the parameters, as in print_sat_data.py and compare_sat_with_bouy.py:
+    "date" or "date_from", and "date_to" or one day after the date.
+    """
+    date_from = get_parameter(parameters, "date_from", date)
+    if date_from == None:
+        date_from = get_parameter(parameters, "date", date, datetime.datetime.combine(datetime.date.today(), datetime.time()))
+    date_to = get_parameter(parameters, "date_to", date)
+    if date_to == None:
+        date_to = date_from + datetime.timedelta(days=1)
+    return min(date_from, date_to), max(date_from, date_to)
+
+def is_missing(value):
+    return value is ma.masked or (isinstance(value, ma.MaskedArray) and value.mask.any())
+
+def to_json_value(value):
+    """
+    Converts a value to something that can be written as json.
+    Missing (masked or nan) values become null and dates become strings.
+    """
+    if isinstance(value, datetime.datetime):
+        return value.strftime(datetimehelper.DEFAULT_DATE_FORMAT_MIN)
+    if is_missing(value):
+        return None
+    if isinstance(value, np.ndarray) and value.ndim == 0:
+        value = value.item()
+    if isinstance(value, (int, long, float, np.number)):
+        value = float(value)
+        if np.isnan(value):
+            return None
+        return value
+    return str(value)
+
+
+class QueryService(object):
+    def __init__(self, data_dir_sat, data_dir_buoy, buoy_registry_filename=None,
+                 max_open_files=DEFAULT_MAX_OPEN_FILES, max_buoy_series=DEFAULT_MAX_BUOY_SERIES,
+                 max_points=DEFAULT_MAX_POINTS, catalog_max_age=DEFAULT_CATALOG_MAX_AGE):
+        """
+        Answers the queries (see QUERIES), and keeps what is needed to answer them warm:
+        - The list of satellite files (the catalog), found again after catalog_max_age seconds.
+        - The open satellite files (Satellite), at most max_open_files. The least recently
+          used file is closed when another file must be opened. The netCDF files are kept in
+          a pool (datasetpool.DatasetPool) of max_open_files, so a file is not opened again
+          when it is used again soon after it was closed.
+        - The satellite data points (SatelliteDataPoint) for a file and a lat/lon.
+        - The buoy registry, made again if a file is added or removed from the buoy data dir.
+        - The parsed buoy data files (BuoySeries), at most max_buoy_series.
+
+        The satellite files and the buoy data files are read again if they have been changed.
+        """
+        self.data_dir_sat = data_dir_sat
+        self.data_dir_buoy = data_dir_buoy
+        self.buoy_registry_filename = buoy_registry_filename
+        self.catalog_max_age = catalog_max_age
+
+        self.catalog = None
+        self.catalog_time = None
+        self.registry = None
+        self.registry_stamp = None
+
+        self.pool = datasetpool.DatasetPool(max_open_files)
+        self.satellites = cachehelper.LRUCache(max_open_files, on_evict=lambda key, sat: sat.close())
+        self.points = cachehelper.LRUCache(max_points)
+        self.series = cachehelper.LRUCache(max_buoy_series)
+
+        self.start_time = time.time()
+        self.number_of_queries = 0
+
+    def close(self):
+        """
+        Closes the open satellite files.
+        """
+        self.satellites.clear()
+        self.pool.clear()
+
+    def get_sat_filenames(self, date_from_including, date_to_excluding):
+        """
+        The satellite files in the date range, sorted by date. See satellite.get_files_from_datadir.
+        """
+        if self.catalog == None or time.time() - self.catalog_time > self.catalog_max_age:
+            LOG.debug("Finding the satellite files in '%s'."%(self.data_dir_sat))
+            filenames = satellite.get_files_from_datadir(self.data_dir_sat, datetime.datetime(1981, 1, 1), datetime.datetime.now() + datetime.timedelta(days=1))
+            self.catalog = sorted([(satellite.get_date_from_filename(filename), filename) for filename in filenames])
+            self.catalog_time = time.time()
+        dates = [d for d, filename in self.catalog]
+        return [filename for d, filename in self.catalog[bisect.bisect_left(dates, date_from_including):bisect.bisect_left(dates, date_to_excluding)]]
+
+    def get_satellite(self, filename):
+        """
+        The open satellite file. It is opened again if the file has been changed.
+        """
+        key = (filename, os.path.getmtime(filename))
+        return self.satellites.get_or_put(key, lambda: satellite.Satellite(filename, pool=self.pool))
+
+    def get_point(self, filename, lat, lon):
+        """
+        The satellite data point for the lat/lon in the file. See Satellite.data.
+        """
+        key = (filename, os.path.getmtime(filename), lat, lon)
+        try:
+            return self.points.get_or_put(key, lambda: self.get_satellite(filename).data(lat, lon))
+        except satellite.SatDataException, e:
+            raise QueryException(e.message)
+
+    def get_registry(self):
+        """
+        The buoy registry. It is made again if the buoy data dir has been changed.
+        """
+        stamp = os.path.getmtime(self.data_dir_buoy)
+        if self.registry == None or stamp != self.registry_stamp:
+            LOG.debug("Making the buoy registry for '%s'."%(self.data_dir_buoy))
+            self.registry = buoy.BuoyRegistry(self.data_dir_buoy, self.buoy_registry_filename)
+            self.registry_stamp = stamp
+        return self.registry
+
+    def get_buoy(self, buoy_name):
+        registry = self.get_registry()
+        if buoy_name not in registry.get_buoy_names():
+            raise QueryException("'%s' must be one of '%s'!"%(buoy_name, "', '".join(sorted(registry.get_buoy_names()))))
+        return registry.get(buoy_name)
+
+    def get_series(self, b, date_from_including=None, date_to_excluding=None):
+        """
+        The buoy data, for the dates. The whole data file is parsed, and kept, the
+        first time. It is parsed again if the data file or the header file have been changed.
+        """
+        key = (b.short_name, tuple([tuple(stamp) for stamp in buoy.get_file_stamps(b.data_file, b.data_header_file)]))
+        return self.series.get_or_put(key, lambda: b.series()).window(date_from_including, date_to_excluding)
+
+    def query(self, query_name, parameters):
+        """
+        Answers a query. Returns the answer as text, the same as the scripts would print,
+        and as something that can be written as json.
+        """
+        if query_name not in QUERIES:
+            raise QueryException("Unknown query '%s'. Must be one of '%s'."%(query_name, "', '".join(QUERIES)))
+        self.number_of_queries += 1
+        try:
+            return getattr(self, "query_%s"%(query_name))(parameters)
+        finally:
+            # The elements of the buoy registry made for the query are saved (if any).
+            if self.registry != None:
+                self.registry.save()
+
+    def query_point(self, parameters):
+        """
+        The satellite values for a lat/lon, for each satellite file in the date range,
+        as print_sat_data.py. Parameters: lat, lon, date or date_from, date_to, filter and ignore_if_missing.
+        """
+        lat = get_parameter(parameters, "lat", float, required=True)
+        lon = get_parameter(parameters, "lon", float, required=True)
+        date_from, date_to = get_dates(parameters)
+        variables = get_filter(parameters)
+        ignore_if_missing = get_parameter(parameters, "ignore_if_missing", flag, False)
+
+        lines = []
+        points = []
+        for filename in self.get_sat_filenames(date_from, date_to):
+            sat = self.get_satellite(filename)
+            if variables != None and not sat.has_variables(list(variables)):
+                raise QueryException("The variables '%s' must be some of '%s'."%("', '".join(variables), "', '".join(sorted(sat.get_variable_names()))))
+
+            # Without a filter, all the values in the point are used.
+            point = self.get_point(filename, lat, lon)
+            variables_to_print = variables if variables != None else list(point.data)
+            values = point.values(variables)
+            if ignore_if_missing and any([is_missing(value) for value in values]):
+                continue
+
+            lines.append("# %s"%(" ".join(variables_to_print)))
+            lines.append("".join([filterhelper.format(value) for value in values]))
+            points.append({"filename": filename,
+                           "date": sat.get_date().strftime(datetimehelper.DEFAULT_DATE_FORMAT_MIN),
+                           "values": dict(zip(variables_to_print, [to_json_value(value) for value in values]))})
+        return "\n".join(lines), points
+
+    def query_buoy(self, parameters):
+        """
+        The buoy data, as print_buoy_data.py. Parameters: buoy (all buoys if
+        not given), date_from, date_to, filter (e.g. "WT:3") and where (e.g. "WT:3 not missing").
+        """
+        buoy_name = get_parameter(parameters, "buoy")
+        date_from = get_parameter(parameters, "date_from", date)
+        date_to = get_parameter(parameters, "date_to", date)
+        order = get_filter(parameters)
+        predicates = get_predicates(parameters)
+
+        if buoy_name != None:
+            buoys = [self.get_buoy(buoy_name)]
+        else:
+            buoys = [self.get_buoy(buoy_name) for buoy_name in sorted(self.get_registry().get_buoy_names())]
+
+        lines = []
+        series_list = []
+        for b in buoys:
+            header_strings = b.get_header_strings()
+            if order != None:
+                for f in order:
+                    if f not in header_strings:
+                        raise QueryException("The filter option '%s' does not exist for buoy '%s'. Available filter options for %s: '%s'!"%(f, b.name, b.name, "', '".join(header_strings)))
+
+            series = self.get_series(b, date_from, date_to).where(predicates)
+            columns = series.columns(order)
+            lines.append("")
+            lines.append("# %s ('%s')"%(b.name, b.short_name))
+            lines.append("# '%s'"%("', '".join(order if order != None else header_strings)))
+            if len(series) > 0:
+                lines.append(filterhelper.format_block(columns, separator=""))
+            series_list.append({"buoy": b.short_name, "name": b.name, "lat": b.lat, "lon": b.lon,
+                                "columns": order if order != None else ["date:"] + header_strings,
+                                "rows": [[to_json_value(value) for value in row] for row in zip(*columns)]})
+        return "\n".join(lines), series_list
+
+    def query_matchup(self, parameters):
+        """
+        The matchups for a buoy, as compare_sat_with_bouy.py with a filter. Parameters: buoy,
+        filter (e.g. "s:analysed_sst", "b:WT:3"), date or date_from, date_to, where and print_header.
+        """
+        b = self.get_buoy(get_parameter(parameters, "buoy", required=True))
+        filters = get_filter(parameters)
+        if filters == None or len(filters) == 0:
+            raise QueryException("The filter must be given for the matchups, e.g. 'filter=s:analysed_sst&filter=b:WT:3'.")
+        date_from, date_to = get_dates(parameters)
+        print_header = get_parameter(parameters, "print_header", flag, False)
+        predicates = get_predicates(parameters)
+
+        for f in filters:
+            if f.split(":")[0] not in ("s", "b", "dummy"):
+                raise QueryException("Filter element, '%s', must start with 's:', 'b:', 'dummy:'."%(f))
+            if f.startswith("b:"):
+                buoy_filter = f.split(":", 1)[1]
+                if buoy_filter.startswith("date:"):
+                    buoy_filter = "date:"
+                if buoy_filter != "lat" and buoy_filter != "lon" and not b.has_variables(buoy_filter):
+                    raise QueryException("'%s' cannot be found for buoy '%s' ('%s'). Must be one of '%s'."%(buoy_filter, b.name, b.short_name, "', '".join(b.get_header_strings())))
+
+        # As compare_sat_with_bouy.py, the satellite variables are checked in all the files
+        # before anything is sent, and it is an error if there are no files.
+        filenames = self.get_sat_filenames(date_from, date_to)
+        if len(filenames) == 0:
+            raise QueryException("No satellite files between %s and %s. Please give another date or date range."%(date_from.strftime("%Y-%m-%d"), date_to.strftime("%Y-%m-%d")))
+        for filename in filenames:
+            sat = self.get_satellite(filename)
+            for f in filters:
+                if f.startswith("s:") and not sat.has_variables(f.split(":")[1]):
+                    raise QueryException("'%s' cannot be found for satellite data. Must be one of '%s'."%(f.split(":")[1], "', '".join(sat.get_variable_names())))
+
+        lines = []
+        if print_header:
+            lines.append(" ".join(filters))
+        rows = []
+        for filename in filenames:
+            sat = self.get_satellite(filename)
+
+            satellite_date = sat.get_date()
+            buoy_series = self.get_series(b, satellite_date - matchup.DEFAULT_WINDOW, satellite_date + matchup.DEFAULT_WINDOW).where(predicates)
+            if len(buoy_series) == 0:
+                continue
+
+            buoy_series = matchup.aggregate_series(filters, buoy_series, satellite_date)
+            columns = matchup.get_columns(filters, self.get_point(filename, b.lat, b.lon), buoy_series)
+            lines.append(filterhelper.format_block(columns))
+            rows.extend([[to_json_value(value) for value in row] for row in zip(*columns)])
+        return "\n".join(lines), {"filters": filters, "rows": rows}
+
+    def query_status(self, parameters):
+        """
+        How long the service has been running, and the state of the caches.
+        """
+        status = {"uptime": time.time() - self.start_time,
+                  "queries": self.number_of_queries,
+                  "satellites": self.satellites.statistics(),
+                  "points": self.points.statistics(),
+                  "series": self.series.statistics(),
+                  "datasets": self.pool.statistics()}
+        lines = ["uptime: %.1f s"%(status["uptime"]), "queries: %i"%(status["queries"])]
+        for name in ("satellites", "points", "series", "datasets"):
+            lines.append("%s: %s"%(name, " ".join(["%s=%s"%(key, value) for key, value in sorted(status[name].iteritems())])))
+        return "\n".join(lines), status
+
+
+class QueryRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Answers GET requests, e.g. "/point?lat=55.0&lon=11.0&date=2015-03-10&format=json".
+    The answer is text (as the scripts would print), or json if format=json.
+    """
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        parameters = urlparse.parse_qs(url.query, keep_blank_values=True)
+        output_format = get_parameter(parameters, "format", default="text")
+
+        start_time = time.time()
+        try:
+            text, data = self.server.service.query(url.path.strip("/"), parameters)
+            status = 200
+        except (QueryException, buoy.BuoyException, matchup.MatchupException), e:
+            text, data = e.message, {"error": e.message}
+            status = 400
+        except Exception, e:
+            LOG.exception("Query '%s' failed."%(self.path))
+            text, data = str(e), {"error": str(e)}
+            status = 500
+        LOG.info("%s: %i (%.3f s)"%(self.path, status, time.time() - start_time))
+
+        if output_format == "json":
+            body = json.dumps(data)
+            content_type = "application/json"
+        else:
+            body = text + "\n"
+            content_type = "text/plain"
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        LOG.debug(format%args)
+
+
+class QueryServer(BaseHTTPServer.HTTPServer):
+    def __init__(self, service, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        """
+        The HTTP server for the service.
+
+        The requests are answered one at a time, as the netCDF library is not thread safe.
+        """
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), QueryRequestHandler)
+        self.service = service
@@ -1,19 +1,54 @@
 # coding: utf-8
 import logging
 import datetime
-import numpy as np
-import numpy.ma as ma
-import netCDF4
 import os
 import datetimehelper
 import filterhelper
 import coordinatehelper
 import math
+import sys
+import threading
+import Queue
+import lazyimport
+import cachehelper
+import satellitesubset
+import seapixel
+import datasetpool
+
+# numpy and netCDF4 (see datasetpool) are imported when they are first used, so the
+# scripts start fast when they only print e.g. the dates of the files.
+np = lazyimport.LazyModule("numpy")
+ma = lazyimport.LazyModule("numpy.ma")
 
 # Define the logger
 LOG = logging.getLogger(__name__)
 ZERO_CELCIUS_IN_KELVIN = 273.15
 
+# The time variable is seconds since 1981-01-01.
+TIME_EPOC = datetime.datetime(1981, 1, 1)
+
+# The variables in the file needed to calculate the calculated variables.
+CALCULATED_VARIABLE_SOURCES = {"analysed_sst_smooth": ["lat", "lon", "mask", "analysed_sst"],
+                               "dist2ice": ["lat", "lon", "mask", "sea_ice_fraction"],
+                               "valid_pixel_lat": ["lat", "lon", "mask"],
+                               "valid_pixel_lon": ["lat", "lon", "mask"],
+                               "valid_pixel_distance_km": ["lat", "lon", "mask"]}
+
+# The variables with the pixel the values are taken from, when the nearest sea pixel is used. See Satellite.data.
+VALID_PIXEL_VARIABLES = ["valid_pixel_lat", "valid_pixel_lon", "valid_pixel_distance_km"]
+
+# The sea bit in the mask variable.
+SEA_MASK_BIT = 1
+
+# The size of the blocks read when reading a file ahead.
+READ_AHEAD_BLOCK_SIZE = 4*1024*1024
+
+# The radius (km) of the square analysed_sst_smooth is the mean of.
+DEFAULT_SMOOTH_RADIUS_KM = 25
+
+# The default number of bytes of variables, read from a file, kept by each Satellite. See Satellite.variable.
+DEFAULT_VARIABLE_CACHE_SIZE = 256*1024*1024
+
 class SatDataException(Exception):
     pass
 
@@ -45,7 +80,7 @@ def get_files_from_datadir(data_dir, date_from_including, date_to_excluding):
         for filename in [f for f in files
                          if f.endswith(".nc")
                          and "-DMI-L4" in f
-                         and date_from_including <= _get_date_from_filename(f) < date_to_excluding]:
+                         and date_from_including <= get_date_from_filename(f) < date_to_excluding]:
             abs_filename = os.path.abspath(os.path.join(root, filename))
             LOG.debug("Found file '%s'."%(abs_filename))
             yield abs_filename
@@ -62,10 +97,13 @@ def get_available_dates(data_dir):
     date_from = datetime.datetime(1981, 1, 1)
     date_to = datetime.datetime.now() + datetime.timedelta(days = 1)
     for filename in get_files_from_datadir(data_dir, date_from, date_to):
-        yield _get_date_from_filename(filename)
+        yield get_date_from_filename(filename)
 
 
-def _get_date_from_filename(filename):
+def get_date_from_filename(filename):
+    """
+    The date (datetime) of a satellite file, from the start of its name, e.g. '20130101000000-...nc'.
+    """
     FILENAME_DATE_FORMAT = "%Y%m%d%H%M%S"
     return datetime.datetime.strptime(os.path.basename(filename).split("-")[0], FILENAME_DATE_FORMAT)
 
@@ -80,19 +118,13 @@ class SatelliteDataPoint(object):
         """
         self.data[key] = value
 
-    def filter(self, order=None, ignore_point_if_missing=False):
+    def values(self, order=None):
         """
-        Returns a string with the values corresponding to what is given in order.
-        If order is None, all the values are written.
+        Returns a list with the values corresponding to what is given in order.
+        If order is None, all the values are returned.
 
         Order can be either a list ["lat", "lon"] or a string with one key "lat".
         """
-        # If one of the values are missing, and the filter is to ignore the missing values,
-        # None is returned at once.
-        for key, value in self.data.iteritems():
-            if ignore_point_if_missing and hasattr(variable, "mask"):
-                if variable.mask:
-                    return None
         values = []
 
         # If the datapoint is actually filtered.
@@ -116,17 +148,32 @@ class SatelliteDataPoint(object):
                 else:
                     values.append(self.data[key])
 
-        # No filtering. All data is written.
+        # No filtering. All data is returned.
         else:
             for key in self.data:
                 if key == "time":
                     values.append(self.data[key].strftime(datetimehelper.DEFAULT_DATE_FORMAT_MIN))
                 else:
                     values.append((self.data[key]))
+        return values
+
+    def filter(self, order=None, ignore_point_if_missing=False):
+        """
+        Returns a string with the values corresponding to what is given in order.
+        If order is None, all the values are written.
+
+        Order can be either a list ["lat", "lon"] or a string with one key "lat".
+        """
+        # If one of the values are missing, and the filter is to ignore the missing values,
+        # None is returned at once.
+        for key, value in self.data.iteritems():
+            if ignore_point_if_missing and hasattr(variable, "mask"):
+                if variable.mask:
+                    return None
 
         # Return a string with all the values.
         output = ""
-        for value in values:
+        for value in self.values(order):
             output += filterhelper.format(value)
         return output
 
@@ -136,19 +183,203 @@ class SatelliteDataPoint(object):
 
 
 class Satellite(object):
-    def __init__(self, input_filename):
+    def __init__(self, input_filename, variable_cache_size=DEFAULT_VARIABLE_CACHE_SIZE, subset_dir=None,
+                 nearest_sea_pixel_km=None, nearest_sea_pixel_map_dir=None, pool=None):
+        """
+        Opens the satellite file.
+
+        The file is taken from the pool of open files (datasetpool.DatasetPool), and given
+        back when the Satellite is closed, so a file used again is not opened again. The
+        pool shared in the process (datasetpool.get_default_pool) is used if pool is None.
+
+        The variables read from the file are kept (see variable), up to
+        variable_cache_size bytes. The least recently used are thrown away first.
+
+        If subset_dir is given, and it has a subset of the file (see make_subset), the
+        values are read from the subset when it has them. The file itself is then only
+        opened if some values are not in the subset.
+
+        If nearest_sea_pixel_km is given, the values are taken from the nearest sea pixel
+        within that distance, when the closest pixel is not sea, see data. The maps of the
+        nearest sea pixels are saved in nearest_sea_pixel_map_dir, if given.
+        """
         self.input_filename = input_filename
-        self.nc = netCDF4.Dataset(self.input_filename, 'r')
-        
+        self.pool = pool if pool != None else datasetpool.get_default_pool()
+        self.nearest_sea_pixel_km = nearest_sea_pixel_km
+        self.nearest_sea_pixel_map_dir = nearest_sea_pixel_map_dir
+        self.nearest_sea_pixel_map = None
+        self.variables = cachehelper.LRUCache(variable_cache_size, sizeof=get_nbytes)
+        # The number of bytes of the variables read from the file.
+        self.bytes_read = 0
+        self.subset = None
+        if subset_dir != None:
+            self.subset = satellitesubset.load_if_current(subset_dir, input_filename)
+        self._nc = None
+        if self.subset == None:
+            self._nc = self.pool.acquire(self.input_filename)
+
+    @property
+    def nc(self):
+        """
+        The netCDF file. Opened when it is first used, if there is a subset.
+        """
+        if self._nc == None:
+            self._nc = self.pool.acquire(self.input_filename)
+        return self._nc
+
     def __enter__(self):
         return self
 
     def __exit__(self, type, value, traceback):
-        if self.nc and self.nc != None:
-            self.nc.close()
+        self.close()
+
+    def close(self):
+        if self._nc != None:
+            self.pool.release(self._nc)
+            self._nc = None
+        self.variables.clear()
+
+    def variable(self, variable_name, index=None):
+        """
+        The values of the variable in the file, as read by netCDF4 (masked array).
+
+        If index is given (an int or a tuple of ints), only that part (hyperslab) of the
+        variable is read, e.g. index 0 gives the (lat, lon) grid for the first time.
+
+        Each variable (or part) is only read and decoded once, and then kept in memory,
+        see __init__. The arrays are shared, so they must not be changed.
+        """
+        if index == None and self.subset != None and variable_name in self.subset.variables:
+            return self.subset.variables[variable_name]
+
+        key = (variable_name, index)
+        values = self.variables.get(key)
+        if values is None:
+            LOG.debug("Reading '%s' (%s) from '%s'."%(variable_name, index, self.input_filename))
+            if index == None:
+                values = self.nc.variables[variable_name][:]
+            else:
+                values = self.nc.variables[variable_name][index]
+            self.bytes_read += get_nbytes(values)
+            self.variables.put(key, values)
+        return values
+
+    def grid(self, variable_name):
+        """
+        The (lat, lon) grid of a variable with the dimensions (time, lat, lon), for the first
+        (only) time in the file. See variable.
+        """
+        return self.variable(variable_name, 0)
+
+    def get_grid_value(self, variable_name, lat_index, lon_index):
+        """
+        The value of a (time, lat, lon) variable at the indexes, as grid(variable_name)[lat_index][lon_index].
+        The value is taken from the subset, if the subset has it.
+        """
+        if self.subset != None:
+            value = self.subset.get_grid_value(variable_name, lat_index, lon_index)
+            if value is not None:
+                return value
+        return self.grid(variable_name)[lat_index][lon_index]
+
+    def get_nearest_sea_pixel_indexes(self, lat_index, lon_index):
+        """
+        The (lat index, lon index) of the nearest sea pixel to the pixel, within
+        nearest_sea_pixel_km, or None if there is none. The pixel itself, if it is sea.
+
+        The nearest sea pixels are looked up in a map, made once for the grid, see seapixel.get_map.
+        """
+        mask = self.get_grid_value("mask", lat_index, lon_index)
+        if mask is not ma.masked and int(mask) & SEA_MASK_BIT:
+            return lat_index, lon_index
+
+        if self.nearest_sea_pixel_map == None:
+            mask = self.grid("mask")
+            sea_mask = np.asarray(ma.getdata(mask) & SEA_MASK_BIT, dtype=bool) & ~ma.getmaskarray(mask)
+            self.nearest_sea_pixel_map = seapixel.get_map(ma.getdata(self.variable("lat")), ma.getdata(self.variable("lon")),
+                                                          sea_mask, self.nearest_sea_pixel_km, self.nearest_sea_pixel_map_dir)
+        return self.nearest_sea_pixel_map.get(lat_index, lon_index)
+
+    def make_subset(self, positions, radius_km=DEFAULT_SMOOTH_RADIUS_KM):
+        """
+        Makes the subset (satellitesubset.SatelliteSubset) of the file for the positions,
+        e.g. the (lat, lon) of the buoys. Positions outside the grid are skipped.
+
+        For each position, the subset has a window of the (time, lat, lon) variables
+        with the pixels within radius_km (and one more pixel), with the original indexes,
+        and the calculated values (analysed_sst_smooth and dist2ice) for the position.
+        The coordinate variables are kept whole, they are small.
+        """
+        lats = self.variable('lat')
+        lons = self.variable('lon')
+        grid_names = sorted([str(name) for name, variable in self.nc.variables.items() if len(variable.dimensions) == 3])
+        subset_positions = []
+        windows = []
+        grids = []
+        analysed_sst_smooth = []
+        dist2ice = []
+        for lat, lon in positions:
+            if (lat, lon) in subset_positions:
+                continue
+            try:
+                self.get_closest_lat_lon_indexes(lat, lon)
+            except SatDataException, e:
+                LOG.info("No subset for %s/%s in '%s': %s"%(lat, lon, self.input_filename, e.message))
+                continue
+
+            # The pixels within the radius, and one more pixel on each side.
+            radius_lat_deg = coordinatehelper.km_2_lats(radius_km) + self.nc.geospatial_lat_resolution
+            radius_lon_deg = coordinatehelper.km_2_lons(radius_km, lat) + self.nc.geospatial_lon_resolution
+            lat_indexes = np.nonzero(np.abs(ma.getdata(lats) - lat) <= radius_lat_deg)[0]
+            lon_indexes = np.nonzero(np.abs(ma.getdata(lons) - lon) <= radius_lon_deg)[0]
+            window = (int(lat_indexes.min()), int(lat_indexes.max()) + 1, int(lon_indexes.min()), int(lon_indexes.max()) + 1)
+
+            subset_positions.append((lat, lon))
+            windows.append(window)
+            grids.append(dict([(name, self.grid(name)[window[0]:window[1], window[2]:window[3]].copy()) for name in grid_names]))
+            analysed_sst_smooth.append(self.calculate_analysed_sst_smooth(lat, lon, radius_km))
+            dist2ice.append(self.calculate_distance_to_ice(lat, lon))
+
+        return satellitesubset.SatelliteSubset(satellitesubset.get_source_stamp(self.input_filename),
+                                               [str(name) for name in self.nc.variables],
+                                               dict([(name, self.variable(name)) for name in satellitesubset.COORDINATE_VARIABLES]),
+                                               float(self.nc.geospatial_lat_resolution), float(self.nc.geospatial_lon_resolution),
+                                               radius_km, subset_positions, windows, grids,
+                                               ma.array(analysed_sst_smooth, dtype=np.float64), dist2ice)
+
+    def get_variable_statistics(self):
+        """
+        The size, hits and misses of the variables kept in memory. See cachehelper.LRUCache.statistics.
+        """
+        return self.variables.statistics()
+
+    def warm(self, variable_names=None):
+        """
+        Reads the variables from the file, to have them ready (see variable) when they are needed.
+
+        The calculated variables (e.g. analysed_sst_smooth) are replaced by the
+        variables needed to calculate them. If variable_names is None, all the
+        variables are read.
+        """
+        # The values are read from the subset.
+        if self.subset != None:
+            return
+
+        if variable_names == None:
+            variable_names = self.get_variable_names()
+        if isinstance(variable_names, str):
+            variable_names = (variable_names,)
+
+        for variable_name in get_source_variable_names(variable_names):
+            if variable_name in self.nc.variables:
+                LOG.debug("Warming '%s' in '%s'."%(variable_name, self.input_filename))
+                if len(self.nc.variables[variable_name].dimensions) == 3:
+                    self.grid(variable_name)
+                else:
+                    self.variable(variable_name)
 
     def get_date(self):
-        return _get_date_from_filename(self.input_filename)
+        return get_date_from_filename(self.input_filename)
 
     def has_variables(self, required_variables):
         """
@@ -199,8 +430,8 @@ class Satellite(object):
         lat_index = self.get_index_of_closest_float_value('lat', lat) 
         lon_index = self.get_index_of_closest_float_value('lon', lon)
 
-        LOG.debug("Lat index: %i. Lat: %f."%(lat_index, self.nc.variables['lat'][lat_index]))
-        LOG.debug("Lon index: %i. Lon: %f."%(lon_index, self.nc.variables['lon'][lon_index]))
+        LOG.debug("Lat index: %i. Lat: %f."%(lat_index, self.variable('lat')[lat_index]))
+        LOG.debug("Lon index: %i. Lon: %f."%(lon_index, self.variable('lon')[lon_index]))
         return lat_index, lon_index
 
     def data(self, lat, lon):
@@ -216,23 +447,31 @@ class Satellite(object):
 
         LOG.debug("The lat/lo indexes for %f/%f were: %i, %i"%(lat, lon, lat_index, lon_index))
 
+        # The pixel the grid values are taken from. The nearest sea pixel, if the closest pixel is land.
+        value_lat_index, value_lon_index = lat_index, lon_index
+        valid_pixel = None
+        if self.nearest_sea_pixel_km != None:
+            valid_pixel = self.get_nearest_sea_pixel_indexes(lat_index, lon_index)
+            if valid_pixel != None:
+                value_lat_index, value_lon_index = valid_pixel
+                if valid_pixel != (lat_index, lon_index):
+                    LOG.debug("Using the nearest sea pixel for %f/%f: %i, %i"%(lat, lon, value_lat_index, value_lon_index))
+
         data_point = SatelliteDataPoint()
         # Add the values to the datapoint.
         for variable_name in self.get_variable_names():
             LOG.debug("Adding variable name: %s."%(variable_name))
             if variable_name == "lat":
-                variable_value = self.nc.variables[variable_name][lat_index]
+                variable_value = self.variable(variable_name)[lat_index]
 
             elif variable_name == "lon":
-                variable_value = self.nc.variables[variable_name][lon_index]
+                variable_value = self.variable(variable_name)[lon_index]
 
             elif variable_name == "time":
-                # The time variable is seconds since 1981-01-01.
-                start_date = datetime.datetime(1981, 1, 1)
-                variable_value = (start_date + datetime.timedelta(seconds=int(self.nc.variables['time'][0])))
+                variable_value = datetimehelper.datetime64_2_dates(self.get_times()[:1])[0]
 
             elif variable_name == "analysed_sst":
-                variable_value = float(self.nc.variables[variable_name][0][lat_index][lon_index]) - ZERO_CELCIUS_IN_KELVIN
+                variable_value = float(self.get_grid_value(variable_name, value_lat_index, value_lon_index)) - ZERO_CELCIUS_IN_KELVIN
 
             elif variable_name == "analysed_sst_smooth":
                 variable_value = self.calculate_analysed_sst_smooth(lat, lon) - ZERO_CELCIUS_IN_KELVIN
@@ -240,14 +479,31 @@ class Satellite(object):
             elif variable_name == "dist2ice":
                 variable_value = self.calculate_distance_to_ice(lat, lon)
 
+            elif variable_name in VALID_PIXEL_VARIABLES:
+                if valid_pixel == None:
+                    variable_value = ma.masked
+                elif variable_name == "valid_pixel_lat":
+                    variable_value = self.variable("lat")[value_lat_index]
+                elif variable_name == "valid_pixel_lon":
+                    variable_value = self.variable("lon")[value_lon_index]
+                else:
+                    variable_value = float(seapixel.get_distances_km(lat, lon, float(self.variable("lat")[value_lat_index]),
+                                                                     float(self.variable("lon")[value_lon_index])))
+
             else:
-                variable_value = self.nc.variables[variable_name][0][lat_index][lon_index]
+                variable_value = self.get_grid_value(variable_name, value_lat_index, value_lon_index)
             # Append the value to the datapoint.
             data_point.append(variable_name, variable_value)
 
         # All values has been inserted. Return the point.
         return data_point
 
+    def get_times(self):
+        """
+        The times in the file, as an array of datetime64.
+        """
+        return datetimehelper.seconds2dates(self.variable('time'), TIME_EPOC)
+
     def get_lat_index(self, lat):
         """
         Gets the index of the closest lat value.
@@ -264,9 +520,9 @@ class Satellite(object):
         """
         Gets the index of the closest float value.
         """
-        return int(abs((self.nc.variables[variable_name] - np.float32(value))).argmin())
+        return int(abs((self.variable(variable_name) - np.float32(value))).argmin())
 
-    def calculate_analysed_sst_smooth(self, lat, lon, analysed_sst_smooth_radius_km=25):
+    def calculate_analysed_sst_smooth(self, lat, lon, analysed_sst_smooth_radius_km=DEFAULT_SMOOTH_RADIUS_KM):
         """
         Gets the average analysed_sst within a squared grid (km).
 
@@ -280,7 +536,13 @@ class Satellite(object):
         |  x  |  x  |  x  |  x  |  x  |  x  |
         +-----+-----+-----+-----+-----+-----+
 
+        The value is taken from the subset, if it was calculated for the position.
         """
+        if self.subset != None and self.subset.radius_km == analysed_sst_smooth_radius_km:
+            i = self.subset.get_position_index(lat, lon)
+            if i != None:
+                return self.subset.analysed_sst_smooth[i]
+
         # The smooth radius (km) in degrees.
         # For latitudes.
         smooth_radius_lat_deg = coordinatehelper.km_2_lats(analysed_sst_smooth_radius_km)
@@ -291,11 +553,13 @@ class Satellite(object):
 
         # Mask everything outside latitude interval.
         # Everything inside the interval is True.
-        lat_mask = (self.nc.variables['lat'][:] >= lat-smooth_radius_lat_deg) & (self.nc.variables['lat'][:] <= lat+smooth_radius_lat_deg)
+        lats = self.variable('lat')
+        lat_mask = (lats >= lat-smooth_radius_lat_deg) & (lats <= lat+smooth_radius_lat_deg)
 
         # The same for the longitude interval.
         # True inside interval.
-        lon_mask = (self.nc.variables['lon'][:] > lon-smooth_radius_lon_deg) & (self.nc.variables['lon'][:] < lon+smooth_radius_lon_deg)
+        lons = self.variable('lon')
+        lon_mask = (lons > lon-smooth_radius_lon_deg) & (lons < lon+smooth_radius_lon_deg)
         
         # Combine the lat mask with the lon mask.
         # Reshape the two arrays into a matrix with the same dimmensions as the analysed_sst matrix.
@@ -304,19 +568,20 @@ class Satellite(object):
         # The values must be from water. That means that bit 1 must be set in the land/sea-mask.
         # The result is an array with 1s and 0s. It is converted to an array of bools.
         # Again, if it is sea, the value is True.
-        sea_mask = np.array((self.nc.variables['mask'][0] & 1), dtype=bool)
+        sea_mask = np.array((self.grid('mask') & 1), dtype=bool)
 
         # The resulting mask. Both True values from lat_lon and True values from the land/sea mask.
         resulting_mask = lat_lon_mask & sea_mask
 
         # Get the values
-        data = self.nc.variables['analysed_sst'][0]
+        data = self.grid('analysed_sst')
 
         # Add the original mask.
         # When the mask is on applied to the variable, True means that the
         # variable is not to be used. It is "masked". The valid values should
         # therefore be False. Hence: ~resulting_mask.
-        data.mask = ~resulting_mask | data.mask
+        # A new masked array, as the values read from the file are shared (see variable).
+        data = ma.masked_array(data, mask=~resulting_mask | data.mask)
 
         # Calculate the mean of the valid values.
         return data.mean()
@@ -335,7 +600,13 @@ class Satellite(object):
         |  x  |  x  |  x  |  x  |  x  |  x  |
         +-----+-----+-----+-----+-----+-----+
 
+        The value is taken from the subset, if it was calculated for the position.
         """
+        if self.subset != None and not output_ice_point_to_log_info:
+            i = self.subset.get_position_index(lat, lon)
+            if i != None:
+                return self.subset.dist2ice[i]
+
         # The maximum allowed distance to ice. If the ice is found further out,
         # the value should be set to the NO_ICE_DISTANCE_KM
         MAX_DISTANCE_KM=500
@@ -349,11 +620,11 @@ class Satellite(object):
 
         # Create a mask for all the points where the ice is greater than the sea ice fraction.
         LOG.debug("Icemask where sea ice fraction is > %f "%(MIN_SEA_ICE_FRACTION))
-        sea_ice_fraction_mask = self.nc.variables['sea_ice_fraction'][0] > MIN_SEA_ICE_FRACTION
+        sea_ice_fraction_mask = self.grid('sea_ice_fraction') > MIN_SEA_ICE_FRACTION
 
         # Create a mask for all the values that are sea (first bit is set).
         LOG.debug("The sea mask: Where the first bit in the 'mask' variable (nc file) is set")
-        sea_mask = np.array((self.nc.variables['mask'][0] & 1), dtype=bool)
+        sea_mask = np.array((self.grid('mask') & 1), dtype=bool)
 
         # Combine the two. I.e. a mask where there is sea AND ice.
         LOG.debug("Combine sea mask and sea ice fraction mask into sea ice mask.")
@@ -375,7 +646,9 @@ class Satellite(object):
         # Loop through all the points that are both sea and ice,
         # calculate the distance to our point,
         # insert the value into the distances matrix.
-        for lat_idx in np.arange(len(self.nc.variables['lat'])):
+        lats = self.variable('lat')
+        lons = self.variable('lon')
+        for lat_idx in np.arange(len(lats)):
             if not sea_ice_mask[lat_idx].any():
                 # If there are no ice in the sea for the current sea mask row,
                 # go to the next row.
@@ -383,12 +656,12 @@ class Satellite(object):
 
             # There ice values for this sea mask row.
             # Get the y component to the length to the latitude.
-            latitude = self.nc.variables['lat'][lat_idx]
+            latitude = lats[lat_idx]
             y = coordinatehelper.lats_2_km(np.abs(latitude-lat))
 
             # Run through every point in the row and check if there is
             # any ice in that point.
-            for lon_idx in np.arange(len(self.nc.variables['lon'])):
+            for lon_idx in np.arange(len(lons)):
                 # Is there ice in the point?
                 if not sea_ice_mask[lat_idx][lon_idx]:
                     # No there were no ice.
@@ -396,7 +669,7 @@ class Satellite(object):
 
                 # Yes there were ice.
                 # Get the x component for the length to the ice point.
-                longitude = self.nc.variables['lon'][lon_idx]
+                longitude = lons[lon_idx]
                 x = coordinatehelper.lons_2_km(np.abs(longitude - lon), latitude)
 
                 # Calculate the resulting distance.
@@ -443,18 +716,18 @@ class Satellite(object):
         As the lat/lons are center values in the grid cells, the edges are added to the range.
         """
         # The edge for latitude.
-        lat_edge = self.nc.geospatial_lat_resolution/2.0
+        lat_edge = (self.subset.lat_resolution if self.subset != None else self.nc.geospatial_lat_resolution)/2.0
 
         # The minimum and maximum values from the file +/- the edges.
-        lat_ranges = [min(self.nc.variables['lat']) - lat_edge,
-                      max(self.nc.variables['lat']) + lat_edge]
+        lat_ranges = [self.variable('lat').min() - lat_edge,
+                      self.variable('lat').max() + lat_edge]
 
         # The edge for longitude.
-        lon_edge = self.nc.geospatial_lon_resolution/2.0
+        lon_edge = (self.subset.lon_resolution if self.subset != None else self.nc.geospatial_lon_resolution)/2.0
 
         # The minimum and maximum values from the file +/- the edges.
-        lon_ranges = [min(self.nc.variables['lon']) - lon_edge,
-                      max(self.nc.variables['lon']) + lon_edge]
+        lon_ranges = [self.variable('lon').min() - lon_edge,
+                      self.variable('lon').max() + lon_edge]
 
         # The ranges.
         return lat_ranges, lon_ranges 
@@ -465,12 +738,164 @@ class Satellite(object):
         """
         LOG.debug("Getting variable names from %s"%self.input_filename)
 
-        # The variables names from the file.
-        variables = list(self.nc.variables)
+        # The variables names from the file (or the subset of it).
+        if self.subset != None:
+            variables = list(self.subset.variable_names)
+        else:
+            variables = list(self.nc.variables)
 
         # Calculated variable names.
         variables.append("analysed_sst_smooth")
         variables.append("dist2ice")
+
+        # The pixel the values are taken from, see data.
+        if self.nearest_sea_pixel_km != None:
+            variables.extend(VALID_PIXEL_VARIABLES)
         
         # Convert the variables to strings.
         return set([str(var) for var in variables])
+
+
+def get_nbytes(values):
+    """
+    The number of bytes used by the values (array or masked array), including the mask.
+    """
+    if isinstance(values, ma.MaskedArray):
+        return values.data.nbytes + np.asarray(values.mask).nbytes
+    return values.nbytes
+
+def get_source_variable_names(variable_names):
+    """
+    Gets the names of the variables that must be read from the file to get the
+    variables in variable_names. The calculated variables are replaced by the
+    variables they are calculated from.
+    """
+    source_variable_names = []
+    for variable_name in variable_names:
+        for source_variable_name in CALCULATED_VARIABLE_SOURCES.get(variable_name, [variable_name,]):
+            if source_variable_name not in source_variable_names:
+                source_variable_names.append(source_variable_name)
+    return source_variable_names
+
+def read_ahead(input_filename, block_size=READ_AHEAD_BLOCK_SIZE):
+    """
+    Reads through the file, without keeping the content.
+
+    This puts the file in the cache of the operating system, so it is
+    fast to read it when it is opened later. The file is read in plain
+    python, which allows other threads to run while waiting for the disk.
+    """
+    with open(input_filename, 'rb') as fp:
+        while fp.read(block_size):
+            pass
+
+def prefetch(input_filenames, number_of_files=2, variable_names=None, variable_cache_size=DEFAULT_VARIABLE_CACHE_SIZE, subset_dir=None,
+             nearest_sea_pixel_km=None, nearest_sea_pixel_map_dir=None):
+    """
+    Iterates over the satellite files and yields an opened Satellite object for each file.
+
+    The next number_of_files files are opened in a background thread while the current
+    file is being processed. When a file is opened, it is read ahead (see read_ahead) and
+    the variables in variable_names are warmed (see Satellite.warm). The files are
+    yielded in the same order as input_filenames.
+
+    The opened files wait in a queue with room for number_of_files files. That is, at
+    most number_of_files + 2 files are open at the same time: The one being processed, the
+    ones in the queue and the one being opened.
+
+    The netCDF library must not be called from two threads at the same time. If that can
+    happen with the netCDF4 module used (see datasetpool.is_thread_safe), the background
+    thread only reads the files ahead, and they are opened and warmed when they are yielded.
+
+    The caller must close the yielded Satellite objects, e.g. by using them in a
+    with statement. Files that were opened but never yielded, e.g. if the caller stops
+    the iteration, are closed here. If opening a file fails, the exception is raised
+    when that file would have been yielded.
+
+    If number_of_files is less than 1, the files are opened one by one when they are needed.
+
+    Each Satellite keeps at most variable_cache_size bytes of variables, see Satellite.variable.
+    If subset_dir is given, the subsets of the files in it are used, see Satellite. A file with
+    a subset is not read ahead. nearest_sea_pixel_km and nearest_sea_pixel_map_dir are passed on
+    to Satellite as well.
+    """
+    if number_of_files < 1:
+        for input_filename in input_filenames:
+            yield Satellite(input_filename, variable_cache_size, subset_dir, nearest_sea_pixel_km, nearest_sea_pixel_map_dir)
+        return
+
+    queue = Queue.Queue(maxsize=number_of_files)
+    stop = threading.Event()
+
+    # The files are only opened in the background if the netCDF library can not be called from two threads at once.
+    open_in_worker = datasetpool.is_thread_safe()
+    if not open_in_worker:
+        LOG.debug("netCDF4 %s releases the GIL. The files are only read ahead in the background."%(datasetpool.netCDF4.__version__))
+
+    # Marks that there are no more files.
+    done = object()
+
+    def put(item):
+        """
+        Puts the item in the queue, but gives up if the iteration has been stopped.
+        """
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def worker():
+        for input_filename in input_filenames:
+            if stop.is_set():
+                return
+            LOG.debug("Prefetching '%s'."%(input_filename))
+            try:
+                if open_in_worker:
+                    sat = Satellite(input_filename, variable_cache_size, subset_dir, nearest_sea_pixel_km, nearest_sea_pixel_map_dir)
+                    if sat.subset == None:
+                        read_ahead(input_filename)
+                    sat.warm(variable_names)
+                    item = sat
+                else:
+                    if subset_dir == None or not os.path.isfile(satellitesubset.get_filename(subset_dir, input_filename)):
+                        read_ahead(input_filename)
+                    item = input_filename
+            except Exception:
+                # The exception is raised in the iterating thread.
+                item = sys.exc_info()
+
+            if not put(item):
+                if isinstance(item, Satellite):
+                    item.close()
+                return
+        put(done)
+
+    thread = threading.Thread(target=worker, name="prefetch")
+    thread.daemon = True
+    thread.start()
+
+    try:
+        while True:
+            item = queue.get()
+            if item is done:
+                break
+            if isinstance(item, tuple):
+                raise item[0], item[1], item[2]
+            if isinstance(item, str):
+                # The file was only read ahead. It is opened here.
+                item = Satellite(item, variable_cache_size, subset_dir, nearest_sea_pixel_km, nearest_sea_pixel_map_dir)
+                item.warm(variable_names)
+            yield item
+    finally:
+        # Stop the worker and close the files that are waiting in the queue.
+        stop.set()
+        while thread.is_alive() or not queue.empty():
+            try:
+                item = queue.get(timeout=0.1)
+            except Queue.Empty:
+                continue
+            if isinstance(item, Satellite):
+                item.close()
@@ -0,0 +1,160 @@
+# coding: utf-8
+import logging
+import os
+import lazyimport
+
+np = lazyimport.LazyModule("numpy")
+ma = lazyimport.LazyModule("numpy.ma")
+
+# Define the logger
+LOG = logging.getLogger(__name__)
+
+# The subset of a satellite file, e.g. "<satellite filename>.subset.npz".
+FILENAME_EXTENSION = ".subset.npz"
+
+# The one dimensional variables, which are kept as they are.
+COORDINATE_VARIABLES = ["lat", "lon", "time"]
+
+class SubsetException(Exception):
+    pass
+
+def get_filename(subset_dir, input_filename):
+    """
+    The filename of the subset of the satellite file.
+    """
+    return os.path.join(subset_dir, "%s%s"%(os.path.basename(input_filename), FILENAME_EXTENSION))
+
+def get_source_stamp(input_filename):
+    """
+    The (size, mtime) of the satellite file, used to find out if the subset is out of date.
+    """
+    stat = os.stat(input_filename)
+    return [float(stat.st_size), float(stat.st_mtime)]
+
+def to_masked(data, mask):
+    return ma.masked_array(data, mask=mask)
+
+
+class SatelliteSubset(object):
+    def __init__(self, source_stamp, variable_names, variables, lat_resolution, lon_resolution,
+                 radius_km, positions, windows, grids, analysed_sst_smooth, dist2ice):
+        """
+        The parts of a satellite file around some positions (the buoys), see Satellite.make_subset.
+
+        - source_stamp:             (size, mtime) of the satellite file.
+        - variable_names:           The names of the variables in the file.
+        - variables:                The coordinate variables (COORDINATE_VARIABLES), whole, by name.
+        - lat/lon_resolution:       The resolution of the grid (geospatial_lat/lon_resolution).
+        - radius_km:                The smoothing radius the windows were made for.
+        - positions:                The (lat, lon) of the positions, array (n, 2).
+        - windows:                  For each position, (lat start, lat stop, lon start, lon stop)
+                                    of the window, as indexes in the grid of the file.
+        - grids:                    For each position, the window of each (time, lat, lon)
+                                    variable, for the first time, by name.
+        - analysed_sst_smooth:      The smoothed analysed_sst (Kelvin) at each position (masked array).
+        - dist2ice:                 The distance to ice from each position.
+
+        The calculated values, analysed_sst_smooth and dist2ice, are calculated from the whole
+        file when the subset is made, so they are exactly the values the file would give.
+        """
+        self.source_stamp = source_stamp
+        self.variable_names = variable_names
+        self.variables = variables
+        self.lat_resolution = lat_resolution
+        self.lon_resolution = lon_resolution
+        self.radius_km = radius_km
+        self.positions = positions
+        self.windows = windows
+        self.grids = grids
+        self.analysed_sst_smooth = analysed_sst_smooth
+        self.dist2ice = dist2ice
+
+    def get_position_index(self, lat, lon):
+        """
+        The index of the position, or None if the subset was not made for the position.
+        """
+        for i, (position_lat, position_lon) in enumerate(self.positions):
+            if position_lat == lat and position_lon == lon:
+                return i
+        return None
+
+    def get_grid_value(self, variable_name, lat_index, lon_index):
+        """
+        The value of the (time, lat, lon) variable at the indexes in the grid of the file,
+        as grid[lat_index][lon_index]. None is returned if no window has the indexes.
+        """
+        for i, (lat_start, lat_stop, lon_start, lon_stop) in enumerate(self.windows):
+            if lat_start <= lat_index < lat_stop and lon_start <= lon_index < lon_stop:
+                return self.grids[i][variable_name][lat_index - lat_start][lon_index - lon_start]
+        return None
+
+    def get_nbytes(self):
+        return sum([grid.nbytes for grids in self.grids for grid in grids.values()])
+
+    def save(self, filename):
+        """
+        Saves the subset as a numpy .npz file. The file is written to a temporary file
+        first, and then renamed, so a reader never sees a part of it.
+        """
+        arrays = {"source_stamp": np.array(self.source_stamp),
+                  "variable_names": np.array(self.variable_names),
+                  "resolution": np.array([self.lat_resolution, self.lon_resolution]),
+                  "radius_km": np.array(self.radius_km),
+                  "positions": np.array(self.positions, dtype=np.float64).reshape(-1, 2),
+                  "windows": np.array(self.windows, dtype=np.int64).reshape(-1, 4),
+                  "grid_names": np.array(sorted(self.grids[0].keys()) if len(self.grids) > 0 else [], dtype=str),
+                  "analysed_sst_smooth": ma.getdata(self.analysed_sst_smooth),
+                  "analysed_sst_smooth_mask": ma.getmaskarray(self.analysed_sst_smooth),
+                  "dist2ice": np.array(self.dist2ice, dtype=np.float64)}
+        for variable_name, values in self.variables.iteritems():
+            arrays[variable_name] = ma.getdata(values)
+            arrays["%s_mask"%(variable_name)] = ma.getmaskarray(values)
+        for i, grids in enumerate(self.grids):
+            for variable_name, grid in grids.iteritems():
+                arrays["%s_%i"%(variable_name, i)] = ma.getdata(grid)
+                arrays["%s_%i_mask"%(variable_name, i)] = ma.getmaskarray(grid)
+
+        directory = os.path.dirname(os.path.abspath(filename))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        temporary_filename = "%s.%i.tmp.npz"%(filename, os.getpid())
+        np.savez(temporary_filename, **arrays)
+        os.rename(temporary_filename, filename)
+
+    @staticmethod
+    def load(filename):
+        try:
+            with np.load(filename) as d:
+                grid_names = [str(name) for name in d["grid_names"]]
+                windows = [tuple(int(i) for i in window) for window in d["windows"]]
+                return SatelliteSubset([float(v) for v in d["source_stamp"]],
+                                       [str(name) for name in d["variable_names"]],
+                                       dict([(name, to_masked(d[name], d["%s_mask"%(name)])) for name in COORDINATE_VARIABLES]),
+                                       float(d["resolution"][0]), float(d["resolution"][1]),
+                                       float(d["radius_km"]),
+                                       [tuple(position) for position in d["positions"].tolist()],
+                                       windows,
+                                       [dict([(name, to_masked(d["%s_%i"%(name, i)], d["%s_%i_mask"%(name, i)])) for name in grid_names])
+                                        for i in range(len(windows))],
+                                       to_masked(d["analysed_sst_smooth"], d["analysed_sst_smooth_mask"]),
+                                       d["dist2ice"])
+        except (IOError, KeyError, ValueError), e:
+            raise SubsetException("Could not read the subset '%s': %s"%(filename, e))
+
+def load_if_current(subset_dir, input_filename):
+    """
+    The subset of the satellite file in the subset dir, or None if there is no subset, or
+    if the satellite file has changed since the subset was made.
+    """
+    filename = get_filename(subset_dir, input_filename)
+    if not os.path.isfile(filename):
+        return None
+    try:
+        subset = SatelliteSubset.load(filename)
+    except SubsetException, e:
+        LOG.warning(e.message)
+        return None
+    if subset.source_stamp != get_source_stamp(input_filename):
+        LOG.info("The subset '%s' is out of date, the satellite file has changed."%(filename))
+        return None
+    return subset
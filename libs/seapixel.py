@@ -0,0 +1,160 @@
+# coding: utf-8
+import logging
+import hashlib
+import math
+import os
+import lazyimport
+import coordinatehelper
+
+np = lazyimport.LazyModule("numpy")
+
+# Define the logger
+LOG = logging.getLogger(__name__)
+
+# The maps made in this process, by the key of the grid (get_grid_key).
+_MAPS = {}
+
+class SeaPixelException(Exception):
+    pass
+
+def get_distances_km(lat, lon, lats, lons):
+    """
+    The distance (km) from lat/lon to the lats/lons, the same way as dist2ice:
+    The longitudes are converted to km at the latitude of lats.
+    """
+    y = coordinatehelper.lats_2_km(np.abs(lats - lat))
+    x = coordinatehelper.lons_2_km(np.abs(lons - lon), lats)
+    return np.sqrt(x**2 + y**2)
+
+def get_grid_key(lats, lons, sea_mask, max_distance_km):
+    """
+    A key for the grid (the lats, lons and the sea mask) and the distance, used to find
+    the map made for the same grid.
+    """
+    key = hashlib.sha1()
+    for values in (lats, lons, sea_mask):
+        values = np.ascontiguousarray(values)
+        key.update(str(values.dtype))
+        key.update(str(values.shape))
+        key.update(values.tostring())
+    key.update(repr(float(max_distance_km)))
+    return key.hexdigest()
+
+
+class NearestSeaPixelMap(object):
+    def __init__(self, lat_indexes, lon_indexes, max_distance_km):
+        """
+        The nearest sea pixel for each pixel in a grid.
+
+        lat_indexes and lon_indexes are arrays with the shape of the grid, with the indexes
+        of the nearest sea pixel (the pixel itself for a sea pixel), or -1 if there is no
+        sea pixel within max_distance_km.
+        """
+        self.lat_indexes = lat_indexes
+        self.lon_indexes = lon_indexes
+        self.max_distance_km = max_distance_km
+
+    def get(self, lat_index, lon_index):
+        """
+        The (lat index, lon index) of the nearest sea pixel, or None if there is none within the distance.
+        """
+        nearest_lat_index = int(self.lat_indexes[lat_index, lon_index])
+        if nearest_lat_index < 0:
+            return None
+        return nearest_lat_index, int(self.lon_indexes[lat_index, lon_index])
+
+    def save(self, filename):
+        """
+        Saves the map to a numpy .npz file. It is written to a temporary file, and then renamed.
+        """
+        temporary_filename = "%s.%i.tmp.npz"%(filename, os.getpid())
+        np.savez(temporary_filename, lat_indexes=self.lat_indexes, lon_indexes=self.lon_indexes,
+                 max_distance_km=np.array(self.max_distance_km))
+        os.rename(temporary_filename, filename)
+
+    @staticmethod
+    def load(filename):
+        with np.load(filename) as d:
+            return NearestSeaPixelMap(d["lat_indexes"], d["lon_indexes"], float(d["max_distance_km"]))
+
+def make_map(lats, lons, sea_mask, max_distance_km):
+    """
+    Makes the map (NearestSeaPixelMap) of the nearest sea pixel for each pixel in the grid.
+
+    lats and lons are the coordinates of the grid, and sea_mask (array of bools, (lat, lon))
+    is True for the sea pixels. The distances are found as in get_distances_km.
+
+    The grid is shifted by each offset (in pixels) that can be within max_distance_km, and
+    the nearest sea pixel is updated for all the pixels at once. That is, the cost is the
+    number of pixels times the number of offsets, and it is done once for each grid.
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    sea_mask = np.asarray(sea_mask, dtype=bool)
+    number_of_lats, number_of_lons = sea_mask.shape
+    if len(lats) < 2 or len(lons) < 2:
+        raise SeaPixelException("The grid must have at least two lats and two lons.")
+
+    # The largest offsets that can be within the distance.
+    lat_step_km = coordinatehelper.lats_2_km(np.abs(np.diff(lats)).min())
+    lon_step_km = coordinatehelper.lons_2_km(np.abs(np.diff(lons)).min(), np.abs(lats).max())
+    max_lat_offset = min(int(math.ceil(max_distance_km/lat_step_km)), number_of_lats - 1)
+    max_lon_offset = min(int(math.ceil(max_distance_km/lon_step_km)), number_of_lons - 1)
+    LOG.debug("Making the nearest sea pixel map, +/- %i lats and +/- %i lons."%(max_lat_offset, max_lon_offset))
+
+    distances_km = np.empty(sea_mask.shape)
+    distances_km.fill(np.inf)
+    lat_indexes = np.empty(sea_mask.shape, dtype=np.int32)
+    lat_indexes.fill(-1)
+    lon_indexes = np.empty(sea_mask.shape, dtype=np.int32)
+    lon_indexes.fill(-1)
+
+    for lat_offset in range(-max_lat_offset, max_lat_offset + 1):
+        # The rows with a row at the offset.
+        lat_from = max(0, -lat_offset)
+        lat_to = min(number_of_lats, number_of_lats - lat_offset)
+        sea_lats = lats[lat_from + lat_offset:lat_to + lat_offset]
+        y = coordinatehelper.lats_2_km(np.abs(sea_lats - lats[lat_from:lat_to]))[:, np.newaxis]
+
+        for lon_offset in range(-max_lon_offset, max_lon_offset + 1):
+            lon_from = max(0, -lon_offset)
+            lon_to = min(number_of_lons, number_of_lons - lon_offset)
+            x = coordinatehelper.lons_2_km(np.abs(lons[lon_from + lon_offset:lon_to + lon_offset] - lons[lon_from:lon_to])[np.newaxis, :],
+                                           sea_lats[:, np.newaxis])
+            distances = np.sqrt(x**2 + y**2)
+
+            # The pixels where the pixel at the offset is sea, and nearer than the ones found.
+            nearest = distances_km[lat_from:lat_to, lon_from:lon_to]
+            closer = sea_mask[lat_from + lat_offset:lat_to + lat_offset, lon_from + lon_offset:lon_to + lon_offset] \
+                     & (distances <= max_distance_km) & (distances < nearest)
+            nearest[closer] = distances[closer]
+            lat_indexes[lat_from:lat_to, lon_from:lon_to][closer] = np.broadcast_to(np.arange(lat_from + lat_offset, lat_to + lat_offset)[:, np.newaxis], closer.shape)[closer]
+            lon_indexes[lat_from:lat_to, lon_from:lon_to][closer] = np.broadcast_to(np.arange(lon_from + lon_offset, lon_to + lon_offset)[np.newaxis, :], closer.shape)[closer]
+
+    return NearestSeaPixelMap(lat_indexes, lon_indexes, max_distance_km)
+
+def get_map(lats, lons, sea_mask, max_distance_km, map_dir=None):
+    """
+    The map (NearestSeaPixelMap) for the grid. It is made once for each grid: The maps
+    are kept in memory, and saved in map_dir (if given) for the next runs.
+    """
+    key = get_grid_key(lats, lons, sea_mask, max_distance_km)
+    if key in _MAPS:
+        return _MAPS[key]
+
+    filename = None
+    if map_dir != None:
+        filename = os.path.join(map_dir, "nearest_sea_pixel_%s.npz"%(key))
+        if os.path.isfile(filename):
+            LOG.debug("Reading the nearest sea pixel map from '%s'."%(filename))
+            _MAPS[key] = NearestSeaPixelMap.load(filename)
+            return _MAPS[key]
+
+    nearest_sea_pixel_map = make_map(lats, lons, sea_mask, max_distance_km)
+    if filename != None:
+        if not os.path.isdir(map_dir):
+            os.makedirs(map_dir)
+        LOG.debug("Saving the nearest sea pixel map to '%s'."%(filename))
+        nearest_sea_pixel_map.save(filename)
+    _MAPS[key] = nearest_sea_pixel_map
+    return nearest_sea_pixel_map
@@ -0,0 +1,249 @@
+# coding: utf-8
+import logging
+import json
+import math
+import lazyimport
+import filterhelper
+
+np = lazyimport.LazyModule("numpy")
+
+# Define the logger
+LOG = logging.getLogger(__name__)
+
+# The groups the statistics can be calculated for.
+GROUPS = ["buoy", "depth", "year", "month", "iceclass"]
+DEFAULT_GROUPS = ["buoy", "month", "iceclass"]
+
+# The sea ice fraction must be larger than this for the point to be in the "ice" class.
+ICE_CLASS_MIN_SEA_ICE_FRACTION = 0.15
+
+class StatisticsException(Exception):
+    pass
+
+def get_ice_class(sea_ice_fraction):
+    """
+    The ice class for a sea ice fraction: "ice", "open" or "unknown" if the value is missing.
+    """
+    try:
+        sea_ice_fraction = float(sea_ice_fraction)
+    except (TypeError, ValueError):
+        return "unknown"
+    if np.isnan(sea_ice_fraction):
+        return "unknown"
+    if sea_ice_fraction > ICE_CLASS_MIN_SEA_ICE_FRACTION:
+        return "ice"
+    return "open"
+
+def get_group_key(groups, buoy_name, depth, buoy_date, sea_ice_fraction=None):
+    """
+    The key, a tuple with one string for each group, that a matchup belongs to.
+    """
+    key = []
+    for group in groups:
+        if group == "buoy":
+            key.append(buoy_name)
+        elif group == "depth":
+            key.append("" if depth == None else str(depth))
+        elif group == "year":
+            key.append(buoy_date.strftime("%Y"))
+        elif group == "month":
+            key.append(buoy_date.strftime("%Y-%m"))
+        elif group == "iceclass":
+            key.append(get_ice_class(sea_ice_fraction))
+        else:
+            raise StatisticsException("Unknown group '%s'. Must be one of '%s'."%(group, "', '".join(GROUPS)))
+    return tuple(key)
+
+
+class RunningStatistics(object):
+    def __init__(self, n=0, mean=0.0, m2=0.0, minimum=None, maximum=None):
+        """
+        Running statistics for a series of values, e.g. satellite minus buoy.
+
+        The mean and the sum of squared differences from the mean (m2) are updated
+        with Welford's method, so the values do not have to be kept. Two statistics
+        can be merged (Chan et al.), e.g. from two runs in parallel.
+        """
+        self.n = n
+        self.mean = mean
+        self.m2 = m2
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def update(self, value):
+        """
+        Adds one value.
+        """
+        value = float(value)
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta/self.n
+        self.m2 += delta*(value - self.mean)
+        self.minimum = value if self.minimum == None else min(self.minimum, value)
+        self.maximum = value if self.maximum == None else max(self.maximum, value)
+
+    def update_many(self, values):
+        """
+        Adds a number of values at once.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return
+        mean = values.mean()
+        self.merge(RunningStatistics(len(values), mean, ((values - mean)**2).sum(), values.min(), values.max()))
+
+    def merge(self, other):
+        """
+        Adds the values from another RunningStatistics.
+        """
+        if other.n == 0:
+            return
+        if self.n == 0:
+            self.n, self.mean, self.m2, self.minimum, self.maximum = other.n, other.mean, other.m2, other.minimum, other.maximum
+            return
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.mean += delta*other.n/n
+        self.m2 += other.m2 + delta**2*self.n*other.n/n
+        self.n = n
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+
+    def bias(self):
+        """
+        The mean value, e.g. of satellite minus buoy.
+        """
+        if self.n == 0:
+            return float("nan")
+        return self.mean
+
+    def std(self):
+        """
+        The (sample) standard deviation.
+        """
+        if self.n < 2:
+            return float("nan")
+        return math.sqrt(self.m2/(self.n - 1))
+
+    def rmse(self):
+        """
+        The root mean square.
+        """
+        if self.n == 0:
+            return float("nan")
+        return math.sqrt(self.mean**2 + self.m2/self.n)
+
+    def to_dict(self):
+        return {"n": self.n, "mean": self.mean, "m2": self.m2, "min": self.minimum, "max": self.maximum}
+
+    @staticmethod
+    def from_dict(d):
+        return RunningStatistics(d["n"], d["mean"], d["m2"], d["min"], d["max"])
+
+
+class GroupedStatistics(object):
+    def __init__(self, groups=DEFAULT_GROUPS):
+        """
+        Running statistics for each group key, e.g. each (buoy, month, iceclass).
+
+        See get_group_key for the keys.
+        """
+        for group in groups:
+            if group not in GROUPS:
+                raise StatisticsException("Unknown group '%s'. Must be one of '%s'."%(group, "', '".join(GROUPS)))
+        self.groups = list(groups)
+        self.statistics = {}
+
+    def update(self, key, values):
+        """
+        Adds the values to the statistics for the key.
+        """
+        if key not in self.statistics:
+            self.statistics[key] = RunningStatistics()
+        self.statistics[key].update_many(values)
+
+    def update_block(self, keys, values):
+        """
+        Adds a block of values, with one key for each value.
+        Missing values (nan) are skipped.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return
+
+        # The keys are tuples, which numpy would turn into rows, so they are put in an object array.
+        key_array = np.empty(len(keys), dtype=object)
+        for i, key in enumerate(keys):
+            key_array[i] = key
+
+        # The values are sorted by group (keeping their order within the group), and split
+        # where the group changes, so each value is only looked at once.
+        unique_keys, groups = np.unique(key_array, return_inverse=True)
+        order = np.argsort(groups, kind="mergesort")
+        bounds = np.searchsorted(groups[order], np.arange(1, len(unique_keys)))
+        for key, indexes in zip(unique_keys, np.split(order, bounds)):
+            group_values = values[indexes]
+            group_values = group_values[~np.isnan(group_values)]
+            if len(group_values) > 0:
+                self.update(key, group_values)
+
+    def update_matchups(self, buoy_name, depth, buoy_dates, buoy_values, sat_value, sea_ice_fraction=None, missing_value=None):
+        """
+        Adds the satellite value minus the buoy value, for each buoy value.
+
+        The buoy values equal to missing_value, and nan values, are skipped.
+        """
+        buoy_values = np.array([float(value) for value in buoy_values], dtype=np.float64)
+        if missing_value != None:
+            buoy_values[buoy_values == missing_value] = np.nan
+        keys = [get_group_key(self.groups, buoy_name, depth, buoy_date, sea_ice_fraction) for buoy_date in buoy_dates]
+        self.update_block(keys, float(sat_value) - buoy_values)
+
+    def merge(self, other):
+        """
+        Adds the statistics from another GroupedStatistics, with the same groups.
+        """
+        if other.groups != self.groups:
+            raise StatisticsException("Can not merge statistics with groups '%s' into statistics with groups '%s'."%("', '".join(other.groups), "', '".join(self.groups)))
+        for key, statistics in other.statistics.iteritems():
+            if key not in self.statistics:
+                self.statistics[key] = RunningStatistics()
+            self.statistics[key].merge(statistics)
+
+    def save(self, filename):
+        """
+        Saves the state to a (json) file, which can be loaded and merged later.
+        """
+        with open(filename, 'w') as fp:
+            json.dump({"groups": self.groups,
+                       "statistics": [{"key": list(key), "statistics": statistics.to_dict()}
+                                      for key, statistics in sorted(self.statistics.iteritems())]},
+                      fp, indent=1)
+
+    @staticmethod
+    def load(filename):
+        """
+        Loads the state saved with save.
+        """
+        with open(filename) as fp:
+            state = json.load(fp)
+        grouped_statistics = GroupedStatistics([str(group) for group in state["groups"]])
+        for element in state["statistics"]:
+            grouped_statistics.statistics[tuple([str(k) for k in element["key"]])] = RunningStatistics.from_dict(element["statistics"])
+        return grouped_statistics
+
+    def summary(self):
+        """
+        A table with the statistics for each key, sorted by key.
+        """
+        header = "# %s n bias std rmse min max"%(" ".join(self.groups))
+        keys = sorted(self.statistics)
+        if len(keys) == 0:
+            return header
+
+        rows = []
+        for key in keys:
+            statistics = self.statistics[key]
+            rows.append(list(key) + [statistics.n, statistics.bias(), statistics.std(), statistics.rmse(), statistics.minimum, statistics.maximum])
+        kinds = ["s"]*len(self.groups) + ["i", "f", "f", "f", "f", "f"]
+        return header + "\n" + filterhelper.format_block(zip(*rows), kinds)
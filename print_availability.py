@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# coding: utf-8
+import logging
+import datetime
+import sys
+import os
+import libs.buoy
+import libs.availability
+
+LOG = logging.getLogger(__name__)
+
+
+
+if __name__ == "__main__":
+    import argparse
+
+    def date(date_string):
+        return datetime.datetime.strptime(date_string, '%Y-%m-%d')
+
+    def directory(path):
+        if not os.path.isdir(path):
+            raise argparse.ArgumentTypeError("'%s' does not exist. Please specify save directory!"%(path))
+        return path
+
+    def file(path):
+        if not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+            raise argparse.ArgumentTypeError("Directory for '%s' does not exist. Please specify a valid path!"%(path))
+        return path
+
+    parser = argparse.ArgumentParser(description='Print the data that are available for each day: If there is a satellite (L4) file, and the number of buoy rows in the matchup window (+/- %i hours) for each buoy. The satellite files are found from the file names, and only the dates of the buoy data files are read.'%(libs.availability.matchup.DEFAULT_WINDOW.total_seconds()/3600))
+
+    parser.add_argument('--data-dir-sat', type=directory, help='Specify the directory where the satellite data files can be found.', default=os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "sat"))
+    parser.add_argument('--data-dir-buoy', type=directory, help='Specify the directory where the buoy data files can be found. %s'%(libs.buoy.DECOMPRESSED_HELP), default=os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "buoy"))
+    parser.add_argument('--buoy-registry', type=file, help="Save what is known about the buoys (headers, first and last dates) in this file, and read it from here the next time.")
+    parser.add_argument('-b', '--buoy', type=str, action="append", help="Only this buoy. Can be given more than once. All the buoys if not given.")
+    parser.add_argument('--date-from', type=date, help='The first day (including). Default: The first satellite file or buoy row.')
+    parser.add_argument('--date-to', type=date, help='The last day (exclusive). Default: The day after the last satellite file or buoy row.')
+    parser.add_argument('--only-missing', action='store_true', help="Only print the days without a satellite file, or without buoy rows for one of the buoys.")
+
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('-d', '--debug', action='store_true', help="Output debugging information.")
+    group.add_argument('-v', '--verbose', action='store_true', help="Output info.")
+
+    parser.add_argument('--log-filename', type=str, help="File used to output logging information.")
+
+    # Do the parsing.
+    args = parser.parse_args()
+
+    # Set the log options.
+    if args.debug:
+        logging.basicConfig(filename=args.log_filename, level=logging.DEBUG)
+    elif args.verbose:
+        logging.basicConfig(filename=args.log_filename, level=logging.INFO)
+    else:
+        logging.basicConfig(filename=args.log_filename, level=logging.WARNING)
+
+    # Output what is in the args variable.
+    LOG.debug(args)
+
+    try:
+        registry = libs.buoy.get_registry(args.data_dir_buoy, args.buoy_registry)
+        buoy_names = registry.get_buoy_names()
+        if args.buoy != None:
+            for buoy_name in args.buoy:
+                if buoy_name not in buoy_names:
+                    raise argparse.ArgumentTypeError("'%s' can not be found. Please specify another buoy data dir (current: '%s') with --data-dir-buoy, or select one of the buoy names: '%s'!"%(buoy_name, args.data_dir_buoy, "', '".join(buoy_names)))
+            buoy_names = args.buoy
+
+        availability = libs.availability.get_availability(registry, args.data_dir_sat, args.date_from, args.date_to, buoy_names)
+        print availability.format(args.only_missing)
+
+        # The elements of the buoy registry made in this run are saved once, at the end.
+        registry.save()
+
+    except (argparse.ArgumentTypeError, libs.availability.AvailabilityException), e:
+        print("")
+        print("Error: %s"%(e.message))
+        sys.exit(1)
@@ -1,14 +1,25 @@
 #!/usr/bin/env python
 import logging
+import sys
 
 # Define the logger
 LOG = logging.getLogger(__name__)
 
+def print_series(series, order=None):
+    """
+    Prints the rows in the buoy series, in the same way as BuoyDataElement.filter.
+    """
+    import libs.filterhelper
+    if len(series) > 0:
+        print libs.filterhelper.format_block(series.columns(order), separator="")
+        sys.stdout.flush()
+
 if __name__ == "__main__":
-    import sys
     import libs.buoy
     import os
     import datetime
+    import json
+    import time
     try:
         import argparse
     except Exception, e:
@@ -26,8 +37,14 @@ if __name__ == "__main__":
             raise argparse.ArgumentTypeError( "'%s' does not exist. Please specify save directory!"%(path))
         return path
 
+    def predicate(predicate_string):
+        try:
+            return libs.buoy.parse_predicates([predicate_string,])[0]
+        except libs.buoy.BuoyException, e:
+            raise argparse.ArgumentTypeError(e.message)
+
     parser = argparse.ArgumentParser(description='Some description. This script does this and that...')
-    parser.add_argument('--data-dir', type=directory, help='Specify the directory where the data files can be found.',
+    parser.add_argument('--data-dir', type=directory, help='Specify the directory where the data files can be found. %s'%(libs.buoy.DECOMPRESSED_HELP),
                         default=libs.buoy.DEFAULT_DATA_DIR)
 
     group = parser.add_mutually_exclusive_group()
@@ -43,8 +60,14 @@ if __name__ == "__main__":
     parser.add_argument('--log-filename', type=str, help="File used to output logging information.")
 
     parser.add_argument('-f', '--filter', action="append", nargs="*", help="Only return a string with some of the values. Based on the header file. --print-header to see the available filter options.")
+    parser.add_argument('-w', '--where', type=predicate, action="append", help="Only print the lines where the values fulfil this predicate, e.g. 'WT:3 not missing' or '0 < WT:3 < 30'. The operators are <, <=, >, >=, == and !=. The missing values (%s) never fulfil a comparison. Can be given more than once."%(libs.buoy.DEFAULT_MISSING_VALUE))
     parser.add_argument('--date-from', type=date, help='Only print data values from (including) this date.')
     parser.add_argument('--date-to', type=date, help='Only print data untill (exclusive) this date.')
+    parser.add_argument('--tail-state', type=str, help="Only print the lines appended to the data files since the last run with the same tail state file. The position in each data file is saved in this file. If a data file has been truncated or rewritten, all of it is printed again.")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--processes', type=int, help="Parse the data files in parallel, with this number of processes. 0 means one process for each core.")
+    group.add_argument('--chunk-size', type=int, help="Read and print the data files this number of lines at a time, to use less memory for large files.")
+    parser.add_argument('--follow', type=float, metavar="SECONDS", help="Keep running, and print the new lines in the data files, looking for them every SECONDS seconds.")
 
     # Do the parser.
     args = parser.parse_args()
@@ -69,7 +92,8 @@ if __name__ == "__main__":
             sys.exit()
 
         # Get all the buoy names from the data directory.
-        buoy_names = libs.buoy.get_buoy_names(args.data_dir)
+        registry = libs.buoy.get_registry(args.data_dir)
+        buoy_names = registry.get_buoy_names()
         if buoy_names == None or len(buoy_names) == 0:
             # If there were no data in the data directory stop here.
             raise argparse.ArgumentTypeError("No data. Please specify a data dir with data. Default: %s"%(args.data_dir))
@@ -78,7 +102,7 @@ if __name__ == "__main__":
         if args.print_header:
             if args.buoy == None or args.buoy not in buoy_names:
                 raise argparse.ArgumentTypeError("Buoy name must be specifired with option -b when printing header: Available for buoy names: '%s'. Example: '-b %s'."%("', '".join(buoy_names), iter(buoy_names).next()))
-            buoy = libs.buoy.buoy_factory(args.buoy)
+            buoy = registry.get(args.buoy)
 
             # The header strings. The first header i all the files is the date.
             header_strings = buoy.get_header_strings()
@@ -93,11 +117,11 @@ if __name__ == "__main__":
             # Select only one buoy.
             if args.buoy not in buoy_names:
                 raise argparse.ArgumentTypeError("'%s' must be one of '%s'!"%(args.buoy, "', '".join(buoy.get_buoy_names(args.data_dir))))
-            buoys.append(libs.buoy.buoy_factory(args.buoy))
+            buoys.append(registry.get(args.buoy))
         else:
             # Select all available buoys
             for buoy_name in buoy_names:
-                buoys.append(libs.buoy.buoy_factory(buoy_name))
+                buoys.append(registry.get(buoy_name))
     
         ## Filtering.
         # It was not really possible to create a default filter with argparse. The new filter variables were inserted
@@ -114,9 +138,30 @@ if __name__ == "__main__":
                     header_strings = buoy.get_header_strings()
                     if f not in header_strings:
                         raise argparse.ArgumentTypeError("The filter option '{filter_option}' does not exist for buoy '{buoy_name}'. Available filter options for {buoy_name}: '{filter_options}'!".format(filter_option=f, buoy_name=buoy.name, filter_options="', '".join(header_strings)))
+
+        # Make sure the columns in the predicates exist.
+        if args.where != None:
+            for p in args.where:
+                for buoy in buoys:
+                    header_strings = buoy.get_header_strings()
+                    if p.column not in header_strings or p.column.split(":")[0] in ("date", "lat", "lon"):
+                        raise argparse.ArgumentTypeError("The column '{column}' in the predicate '{predicate}' does not exist for buoy '{buoy_name}'. Available columns for {buoy_name}: '{columns}'!".format(column=p.column, predicate=p, buoy_name=buoy.name, columns="', '".join(header_strings)))
         
+        # The positions in the data files from the last run.
+        tail_states = {}
+        if args.tail_state and os.path.isfile(args.tail_state):
+            with open(args.tail_state) as fp:
+                tail_states = json.load(fp)
+            for buoy in buoys:
+                buoy.set_tail_state(tail_states.get(buoy.short_name))
+
+        # Parse all the data files at once, in parallel.
+        all_series = None
+        if args.processes != None and not (args.tail_state or args.follow):
+            all_series = libs.buoy.read_series(buoys, args.date_from, args.date_to, args.processes or None, args.where)
+
         # Print the data.
-        for buoy in buoys:
+        for i, buoy in enumerate(buoys):
             print ""
             print "# %s ('%s')"%(buoy.name, buoy.short_name)
 
@@ -125,8 +170,36 @@ if __name__ == "__main__":
             else:
                 print "# '%s'"%("', '".join(buoy.get_header_strings()))
 
-            for data in buoy.data(args.date_from, args.date_to):
+            # Only the new lines are read, when the position in the file is needed.
+            if args.tail_state or args.follow:
+                print_series(buoy.read_new().window(args.date_from, args.date_to).where(args.where), args.filter[0])
+                continue
+
+            if all_series != None:
+                print_series(all_series[i], args.filter[0])
+                continue
+
+            if args.chunk_size:
+                for chunk in buoy.chunks(args.chunk_size, args.date_from, args.date_to, args.filter[0], args.where):
+                    print_series(chunk, args.filter[0])
+                continue
+
+            for data in buoy.data(args.date_from, args.date_to, args.where):
                 print data.filter(args.filter[0])
+
+        # Save the positions in the data files, for the next run.
+        if args.tail_state:
+            for buoy in buoys:
+                tail_states[buoy.short_name] = buoy.get_tail_state()
+            with open(args.tail_state, 'w') as fp:
+                json.dump(tail_states, fp)
+
+        # Print the new lines, as they are appended to the data files.
+        if args.follow:
+            while True:
+                time.sleep(args.follow)
+                for buoy in buoys:
+                    print_series(buoy.read_new().window(args.date_from, args.date_to).where(args.where), args.filter[0])
     except argparse.ArgumentTypeError, e:
         print "Error: %s"%(e.message)
         sys.exit(1)
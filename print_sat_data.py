@@ -53,6 +53,9 @@ if __name__ == "__main__":
     parser.add_argument('--data-dir', type=directory, help='Specify the directory where the data files can be found. Ignored if --input-filename is set. It still must exist, though. The files in the data dir must be of the form "<YYYYMMDD>000000-DMI-L4*.nc", e.g: "20150310000000-DMI-L4_GHRSST-SSTfnd-DMI_OI-NSEABALTIC-v02.0-fv01.0.nc".', default=os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "sat"))
 
 
+    parser.add_argument('--subset-dir', type=directory, help="Read the values from the subsets of the satellite files in this directory (see subset_satellite.py), when they have them.")
+    parser.add_argument('--nearest-sea-pixel', type=float, metavar="KM", help="If the closest pixel to lat/lon is land, print the values of the nearest sea pixel within this distance (km). The variables '%s' are then the position of the pixel used and its distance from lat/lon."%("', '".join(libs.satellite.VALID_PIXEL_VARIABLES)))
+    parser.add_argument('--nearest-sea-pixel-map-dir', type=directory, help="Save the maps of the nearest sea pixels in this directory, and read them from here the next time.")
     parser.add_argument('--print-variables', action="store_true", help="Print the available variables.")
     parser.add_argument('--print-lat-lon-ranges', action="store_true", help="Print the max/min lat/lon values in the file.")
     parser.add_argument('--print-dates', action="store_true", help="Print the dates available in the data-dir. The dates are based on the file names in the data directory.")
@@ -178,7 +181,8 @@ if __name__ == "__main__":
 
         # Print the values.
         for input_filename in input_files:
-            with libs.satellite.Satellite(input_filename) as sat:
+            with libs.satellite.Satellite(input_filename, subset_dir=args.subset_dir, nearest_sea_pixel_km=args.nearest_sea_pixel,
+                                           nearest_sea_pixel_map_dir=args.nearest_sea_pixel_map_dir) as sat:
                 assert(sat.has_variables(["lat", "lon"]))
 
                 # Filtering.
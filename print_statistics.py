@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# coding: utf-8
+import logging
+import sys
+import os
+import libs.validationstatistics
+
+LOG = logging.getLogger(__name__)
+
+def merge_statistics(filenames):
+    """
+    Loads and merges the statistics saved by compare_sat_with_bouy.py --statistics-state.
+    """
+    statistics = None
+    for filename in filenames:
+        LOG.debug("Merging statistics from '%s'."%(filename))
+        if statistics == None:
+            statistics = libs.validationstatistics.GroupedStatistics.load(filename)
+        else:
+            statistics.merge(libs.validationstatistics.GroupedStatistics.load(filename))
+    return statistics
+
+
+
+if __name__ == "__main__":
+    import argparse
+
+    def existing_file(path):
+        if not os.path.isfile(path):
+            raise argparse.ArgumentTypeError("File '%s' does not exist. Please specify a valid input file!"%(path))
+        return path
+
+    def file(path):
+        if not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+            raise argparse.ArgumentTypeError("Directory for '%s' does not exist. Please specify a valid path!"%(path))
+        return path
+
+    parser = argparse.ArgumentParser(description='Merge the statistics from a number of runs of compare_sat_with_bouy.py (--statistics-state) and print the summary.')
+    parser.add_argument('statistics_filenames', type=existing_file, nargs="+", help="The statistics files. They must all have the same groups.")
+    parser.add_argument('-o', '--output-filename', type=file, help="Save the merged statistics to this file.")
+
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('-d', '--debug', action='store_true', help="Output debugging information.")
+    group.add_argument('-v', '--verbose', action='store_true', help="Output info.")
+
+    parser.add_argument('--log-filename', type=str, help="File used to output logging information.")
+
+    # Do the parsing.
+    args = parser.parse_args()
+
+    # Set the log options.
+    if args.debug:
+        logging.basicConfig(filename=args.log_filename, level=logging.DEBUG)
+    elif args.verbose:
+        logging.basicConfig(filename=args.log_filename, level=logging.INFO)
+    else:
+        logging.basicConfig(filename=args.log_filename, level=logging.WARNING)
+
+    # Output what is in the args variable.
+    LOG.debug(args)
+
+    try:
+        statistics = merge_statistics(args.statistics_filenames)
+    except libs.validationstatistics.StatisticsException, e:
+        print "Error: %s"%(e.message)
+        sys.exit(1)
+
+    if args.output_filename:
+        statistics.save(args.output_filename)
+
+    print statistics.summary()
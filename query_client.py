@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# coding: utf-8
+import logging
+import sys
+import libs.queryclient
+
+LOG = logging.getLogger(__name__)
+
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Send a query to query_service.py and print the answer. The options are the same as for print_sat_data.py (--point), print_buoy_data.py (--buoy-data) and compare_sat_with_bouy.py (--matchup), and the answer is printed the same way.')
+
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--point', action='store_true', help="Print the satellite values for --lat/--lon, as print_sat_data.py.")
+    group.add_argument('--buoy-data', action='store_true', help="Print the buoy data, as print_buoy_data.py.")
+    group.add_argument('--matchup', action='store_true', help="Print the matchups for a buoy, as compare_sat_with_bouy.py. --buoy and --filter are required.")
+    group.add_argument('--status', action='store_true', help="Print the state of the service.")
+
+    parser.add_argument('--host', type=str, default=libs.queryclient.DEFAULT_HOST, help="The address of the service. Default: %s."%(libs.queryclient.DEFAULT_HOST))
+    parser.add_argument('--port', type=int, default=libs.queryclient.DEFAULT_PORT, help="The port of the service. Default: %i."%(libs.queryclient.DEFAULT_PORT))
+    parser.add_argument('--timeout', type=float, help="Give up after this number of seconds.")
+    parser.add_argument('--json', action='store_true', help="Print the answer as json.")
+
+    parser.add_argument('-b', '--buoy', type=str, help="Buoy short name.")
+    parser.add_argument('-f', '--filter', action="append", nargs="*", help="Only return some of the values. As for the script the query mirrors.")
+    parser.add_argument('-w', '--where', type=str, action="append", help="Only use the buoy data where the values fulfil this predicate, e.g. 'WT:3 not missing' or '0 < WT:3 < 30'. Can be given more than once.")
+    parser.add_argument('--date', type=str, help="Only print data values from (including) this date. YYYY-MM-DD.")
+    parser.add_argument('--date-from', type=str, help="Only print data values from (including) this date. YYYY-MM-DD.")
+    parser.add_argument('--date-to', type=str, help="Only print data untill (exclusive) this date. YYYY-MM-DD.")
+    parser.add_argument("--lat", type=float, help="Specify which latitude value to use.")
+    parser.add_argument("--lon", type=float, help="Specify which longitude value to use.")
+    parser.add_argument("--ignore-if-missing", action="store_true", help="Add this option to print the values only if there are NO missing values for the specified lat/lon values.")
+    parser.add_argument('--print-header', action='store_true', help="Print the header of the matchups.")
+
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('-d', '--debug', action='store_true', help="Output debugging information.")
+    group.add_argument('-v', '--verbose', action='store_true', help="Output info.")
+
+    parser.add_argument('--log-filename', type=str, help="File used to output logging information.")
+
+    # Do the parsing.
+    args = parser.parse_args()
+
+    # Set the log options.
+    if args.debug:
+        logging.basicConfig(filename=args.log_filename, level=logging.DEBUG)
+    elif args.verbose:
+        logging.basicConfig(filename=args.log_filename, level=logging.INFO)
+    else:
+        logging.basicConfig(filename=args.log_filename, level=logging.WARNING)
+
+    # Output what is in the args variable.
+    LOG.debug(args)
+
+    if args.point:
+        query_name = "point"
+    elif args.buoy_data:
+        query_name = "buoy"
+    elif args.matchup:
+        query_name = "matchup"
+    else:
+        query_name = "status"
+
+    parameters = [("buoy", args.buoy), ("date", args.date), ("date_from", args.date_from), ("date_to", args.date_to),
+                  ("lat", args.lat), ("lon", args.lon)]
+    if args.ignore_if_missing:
+        parameters.append(("ignore_if_missing", "1"))
+    if args.print_header:
+        parameters.append(("print_header", "1"))
+    if args.filter != None:
+        parameters.extend([("filter", f) for f in args.filter[0]])
+    if args.where != None:
+        parameters.extend([("where", w) for w in args.where])
+
+    try:
+        answer = libs.queryclient.query(query_name, parameters, args.host, args.port, "json" if args.json else "text", args.timeout)
+    except libs.queryclient.QueryClientException, e:
+        print "Error: %s"%(e.message)
+        sys.exit(1)
+    sys.stdout.write(answer)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# coding: utf-8
+import logging
+import sys
+import os
+import libs.buoy
+import libs.queryservice
+
+LOG = logging.getLogger(__name__)
+
+
+
+if __name__ == "__main__":
+    import argparse
+
+    def directory(path):
+        if not os.path.isdir(path):
+            raise argparse.ArgumentTypeError("'%s' does not exist. Please specify save directory!"%(path))
+        return path
+
+    def file(path):
+        if not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+            raise argparse.ArgumentTypeError("Directory for '%s' does not exist. Please specify a valid path!"%(path))
+        return path
+
+    parser = argparse.ArgumentParser(description='Keep running and answer queries for satellite points, buoy data and matchups, over HTTP on the local machine. The satellite files and the buoy data are kept open/parsed between the queries. Use query_client.py to send the queries.')
+
+    parser.add_argument('--data-dir-sat', type=directory, help='Specify the directory where the satellite data files can be found.', default=os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "sat"))
+    parser.add_argument('--data-dir-buoy', type=directory, help='Specify the directory where the buoy data files can be found. %s'%(libs.buoy.DECOMPRESSED_HELP), default=os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "buoy"))
+    parser.add_argument('--buoy-registry', type=file, help="Save what is known about the buoys (headers, first and last dates) in this file, and read it from here the next time.")
+
+    parser.add_argument('--host', type=str, default=libs.queryservice.DEFAULT_HOST, help="The address to listen on. Default: %s (only the local machine)."%(libs.queryservice.DEFAULT_HOST))
+    parser.add_argument('--port', type=int, default=libs.queryservice.DEFAULT_PORT, help="The port to listen on. Default: %i."%(libs.queryservice.DEFAULT_PORT))
+
+    parser.add_argument('--max-open-files', type=int, default=libs.queryservice.DEFAULT_MAX_OPEN_FILES, help="The number of satellite files kept open. Default: %i."%(libs.queryservice.DEFAULT_MAX_OPEN_FILES))
+    parser.add_argument('--max-buoy-series', type=int, default=libs.queryservice.DEFAULT_MAX_BUOY_SERIES, help="The number of parsed buoy data files kept. Default: %i."%(libs.queryservice.DEFAULT_MAX_BUOY_SERIES))
+    parser.add_argument('--max-points', type=int, default=libs.queryservice.DEFAULT_MAX_POINTS, help="The number of satellite data points (file and lat/lon) kept. Default: %i."%(libs.queryservice.DEFAULT_MAX_POINTS))
+    parser.add_argument('--catalog-max-age', type=float, default=libs.queryservice.DEFAULT_CATALOG_MAX_AGE, help="Look for new satellite files when the list of files is older than this number of seconds. Default: %i."%(libs.queryservice.DEFAULT_CATALOG_MAX_AGE))
+
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('-d', '--debug', action='store_true', help="Output debugging information.")
+    group.add_argument('-v', '--verbose', action='store_true', help="Output info.")
+
+    parser.add_argument('--log-filename', type=str, help="File used to output logging information.")
+
+    # Do the parsing.
+    args = parser.parse_args()
+
+    # Set the log options.
+    if args.debug:
+        logging.basicConfig(filename=args.log_filename, level=logging.DEBUG)
+    elif args.verbose:
+        logging.basicConfig(filename=args.log_filename, level=logging.INFO)
+    else:
+        logging.basicConfig(filename=args.log_filename, level=logging.WARNING)
+
+    # Output what is in the args variable.
+    LOG.debug(args)
+
+    service = libs.queryservice.QueryService(args.data_dir_sat, args.data_dir_buoy, args.buoy_registry,
+                                             args.max_open_files, args.max_buoy_series, args.max_points, args.catalog_max_age)
+    server = libs.queryservice.QueryServer(service, args.host, args.port)
+    LOG.info("Listening on %s:%i."%(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# coding: utf-8
+import logging
+import datetime
+import sys
+import os
+import libs.satellite
+import libs.satellitesubset
+import libs.buoy
+
+LOG = logging.getLogger(__name__)
+
+
+
+if __name__ == "__main__":
+    import argparse
+
+    def date(date_string):
+        return datetime.datetime.strptime(date_string, '%Y-%m-%d')
+
+    def directory(path):
+        if not os.path.isdir(path):
+            raise argparse.ArgumentTypeError("'%s' does not exist. Please specify save directory!"%(path))
+        return path
+
+    def file(path):
+        if not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+            raise argparse.ArgumentTypeError("Directory for '%s' does not exist. Please specify a valid path!"%(path))
+        return path
+
+    def existing_file(path):
+        if not os.path.isfile(path):
+            raise argparse.ArgumentTypeError("File '%s' does not exist. Please specify a valid input file!"%(path))
+        return path
+
+    parser = argparse.ArgumentParser(description='Write a subset of each satellite file, with the parts of the grids around the buoys, and the values calculated for the buoy positions (analysed_sst_smooth and dist2ice). The satellite values for the buoys can then be read from the subsets (compare_sat_with_bouy.py --subset-dir), which are a small part of the files.')
+
+    parser.add_argument('--data-dir-sat', type=directory, help='Specify the directory where the satellite data files can be found.', default=os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "sat"))
+    parser.add_argument('--data-dir-buoy', type=directory, help='Specify the directory where the buoy data files can be found. %s'%(libs.buoy.DECOMPRESSED_HELP), default=os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "buoy"))
+    parser.add_argument('--buoy-registry', type=file, help="Save what is known about the buoys (headers, first and last dates) in this file, and read it from here the next time.")
+    parser.add_argument('--subset-dir', type=file, required=True, help="The directory of the subsets. It is created if it does not exist.")
+    parser.add_argument('--radius', type=float, default=libs.satellite.DEFAULT_SMOOTH_RADIUS_KM, help="The part of the grids kept around each buoy, in km. Default: %s, the radius of analysed_sst_smooth."%(libs.satellite.DEFAULT_SMOOTH_RADIUS_KM))
+
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--sat-input-filename', type=existing_file, help="Input filename. This is a satellite data filename.")
+    group.add_argument('--date', type=date, help='Only the satellite files from (including) this date. All the files if no dates are given.')
+    group.add_argument('--date-from', type=date, help='Only the satellite files from (including) this date.')
+
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--date-to', type=date, help='Only the satellite files untill (exclusive) this date.')
+    group.add_argument('--days-back-in-time', type=int, help='Only the satellite files from --date or --date-from and this number of days back in time.')
+    group.add_argument('--days-forward-in-time', type=int, help='Only the satellite files from --date or --date-from and this number of days forward in time.')
+
+    parser.add_argument('--overwrite', action='store_true', help="Write the subsets again, also for the files with a subset that is up to date.")
+
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('-d', '--debug', action='store_true', help="Output debugging information.")
+    group.add_argument('-v', '--verbose', action='store_true', help="Output info.")
+
+    parser.add_argument('--log-filename', type=str, help="File used to output logging information.")
+
+    # Do the parsing.
+    args = parser.parse_args()
+
+    # Set the log options.
+    if args.debug:
+        logging.basicConfig(filename=args.log_filename, level=logging.DEBUG)
+    elif args.verbose:
+        logging.basicConfig(filename=args.log_filename, level=logging.INFO)
+    else:
+        logging.basicConfig(filename=args.log_filename, level=logging.WARNING)
+
+    # Output what is in the args variable.
+    LOG.debug(args)
+
+    try:
+        registry = libs.buoy.get_registry(args.data_dir_buoy, args.buoy_registry)
+        positions = [(registry.get_element(buoy_name).lat, registry.get_element(buoy_name).lon) for buoy_name in sorted(registry.get_buoy_names())]
+
+        if args.sat_input_filename:
+            sat_input_filenames = [args.sat_input_filename,]
+        else:
+            # All the files, if no dates are given.
+            date_from = args.date_from or args.date or datetime.datetime(1981, 1, 1)
+            if args.days_back_in_time:
+                date_to = date_from - datetime.timedelta(days = args.days_back_in_time)
+            elif args.days_forward_in_time:
+                date_to = date_from + datetime.timedelta(days = args.days_forward_in_time)
+            elif args.date_to:
+                date_to = args.date_to
+            elif args.date_from or args.date:
+                date_to = date_from + datetime.timedelta(days = 1)
+            else:
+                date_to = datetime.datetime.now() + datetime.timedelta(days = 1)
+            sat_input_filenames = sorted(libs.satellite.get_files_from_datadir(args.data_dir_sat, date_from, date_to))
+
+        for sat_input_filename in sat_input_filenames:
+            subset_filename = libs.satellitesubset.get_filename(args.subset_dir, sat_input_filename)
+            if not args.overwrite and libs.satellitesubset.load_if_current(args.subset_dir, sat_input_filename) != None:
+                LOG.debug("'%s' is up to date."%(subset_filename))
+                continue
+            with libs.satellite.Satellite(sat_input_filename) as sat:
+                subset = sat.make_subset(positions, args.radius)
+            subset.save(subset_filename)
+            LOG.info("Wrote '%s': %i positions, %i bytes of grids."%(subset_filename, len(subset.positions), subset.get_nbytes()))
+
+        # The elements of the buoy registry made in this run are saved once, at the end.
+        registry.save()
+
+    except argparse.ArgumentTypeError, e:
+        print("")
+        print("Error: %s"%(e.message))
+        sys.exit(1)